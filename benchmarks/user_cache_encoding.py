@@ -0,0 +1,68 @@
+"""
+Size and speed of the cached user payloads.
+
+Compares pickle of a Users instance loaded by the ORM, the format cached by
+earlier releases, with the orjson encoding of CachedUser.
+
+    python -m benchmarks.user_cache_encoding --number 20000
+"""
+
+import argparse
+import pickle
+import timeit
+from datetime import date
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from src.database.models import Base, Users
+from src.services.user_cache import CachedUser, dumps_user, loads_user
+
+
+def load_user() -> Users:
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as session:
+        session.add(
+            Users(
+                username="bill.johnson",
+                email="bill.johnson@example.com",
+                password="$2b$12$" + "x" * 53,
+                refresh_token="x" * 200,
+                first_name="Bill",
+                last_name="Johnson",
+                phone_number="999 999 99 99",
+                born_date=date(2000, 5, 5),
+                description="test",
+                avatar="https://www.gravatar.com/avatar/" + "0" * 32,
+            )
+        )
+        session.commit()
+        user = session.scalar(select(Users))
+    return user
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+    user = load_user()
+    cached = CachedUser.from_user(user)
+    variants = {
+        "pickle Users": (lambda: pickle.dumps(user), pickle.loads),
+        "orjson CachedUser": (lambda: dumps_user(cached), loads_user),
+    }
+    print(f"{'format':<20}{'bytes':>8}{'encode us':>12}{'decode us':>12}")
+    for name, (encode, decode) in variants.items():
+        payload = encode()
+        encode_us = timeit.timeit(encode, number=args.number) / args.number * 1e6
+        decode_us = (
+            timeit.timeit(lambda: decode(payload), number=args.number)
+            / args.number
+            * 1e6
+        )
+        print(f"{name:<20}{len(payload):>8}{encode_us:>12.2f}{decode_us:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
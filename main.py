@@ -1,6 +1,8 @@
 # from ipaddress import ip_address
 # from typing import Callable
+from contextlib import suppress
 from pathlib import Path
+import asyncio
 import time
 
 from fastapi import FastAPI, Depends, HTTPException, status, Request
@@ -10,15 +12,19 @@ from fastapi_limiter.depends import RateLimiter
 from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-import redis.asyncio as redis
 from sqlalchemy import text
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.middleware.cors import CORSMiddleware
 
 
-from src.database.db import get_db
-from src.routes import users, auth
+from src.database.db import get_db, dispose_engines
+from src.database.instrumentation import start_request_stats, log_request_stats
+from src.routes import users, auth, admin, well_known
 from src.conf.config import settings
+from src.services.redis_pool import init_redis_pool, get_redis, close_redis_pool
+from src.services.bulk_import import shutdown_executor
+from src.services.user_cache import user_cache
+from src.services.revocation import token_denylist
 
 app = FastAPI()
 
@@ -83,21 +89,69 @@ async def add_process_time_header(request: Request, call_next):
     return response
 
 
+@app.middleware("http")
+async def add_db_stats_headers(request: Request, call_next):
+    """
+    The add_db_stats_headers function is a middleware function that counts the SQL
+    statements executed while serving the request. It adds the X-DB-Query-Count and
+    X-DB-Time (milliseconds) headers to the response and logs the slowest statement,
+    as a warning when the request executed more than db_query_warn_count statements.
+    Statements run while a streaming response body is sent are not counted.
+
+    :param request: Request: Access the request object
+    :param call_next: Call the next middleware in the chain
+    :return: A response object
+    :doc-author: Trelent
+    """
+    if not settings.db_instrument:
+        return await call_next(request)
+    stats = start_request_stats()
+    response = await call_next(request)
+    response.headers["X-DB-Query-Count"] = str(stats.count)
+    response.headers["X-DB-Time"] = f"{stats.total_time * 1000:.2f}"
+    log_request_stats(
+        request.method, request.url.path, stats, settings.db_query_warn_count
+    )
+    return response
+
+
 @app.on_event("startup")
 async def startup():
     """
     The startup function is called when the application starts up.
     It can be used to initialize resources, such as database connections.
+    It creates the Redis connection pool shared by the rate limiter and the user cache,
+    and starts listening for the user cache invalidations and the token revocations
+    of the other workers.
 
     :return: A coroutine, so we need to run it:
     :doc-author: Trelent
     """
-    r = await redis.Redis(
-        host=settings.redis_host,
-        port=settings.redis_port,
-        db=0,
-    )
-    await FastAPILimiter.init(r)
+    init_redis_pool()
+    await FastAPILimiter.init(get_redis())
+    app.state.user_cache_listener = asyncio.create_task(user_cache.listen())
+    app.state.revocation_listener = asyncio.create_task(token_denylist.listen())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """
+    The shutdown function is called when the application stops.
+    It stops the user cache and revocation listeners and the bulk import workers,
+    and closes the connections of the shared Redis pool and of the database engines.
+
+    :return: A coroutine
+    :doc-author: Trelent
+    """
+    for name in ("user_cache_listener", "revocation_listener"):
+        listener = getattr(app.state, name, None)
+        if listener is not None:
+            listener.cancel()
+            with suppress(asyncio.CancelledError):
+                await listener
+    shutdown_executor()
+    await close_redis_pool()
+    await dispose_engines()
 
 
 @app.get(
@@ -156,19 +210,19 @@ async def signup(request: Request):
 
 
 @app.get("/api/healthchecker")
-def healthchecker(db: Session = Depends(get_db)):
+async def healthchecker(db: AsyncSession = Depends(get_db)):
     """
     The healthchecker function is a simple function that checks the health of the database.
     It does this by making a request to the database and checking if it returns any results.
     If there are no results, then we know something is wrong with our connection to the database.
 
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: The message &quot;welcome to fastapi!&quot;
     :doc-author: Trelent
     """
     try:
         # Make request
-        result = db.execute(text("SELECT 1")).fetchone()
+        result = (await db.execute(text("SELECT 1"))).fetchone()
         print(result)
         if result is None:
             raise HTTPException(
@@ -186,3 +240,5 @@ def healthchecker(db: Session = Depends(get_db)):
 
 app.include_router(auth.router, prefix="/api")
 app.include_router(users.router, prefix="/api")
+app.include_router(admin.router, prefix="/api")
+app.include_router(well_known.router)
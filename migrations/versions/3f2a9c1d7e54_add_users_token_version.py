@@ -0,0 +1,29 @@
+"""Add Users token_version
+
+Revision ID: 3f2a9c1d7e54
+Revises: 95c7c31106d4
+Create Date: 2026-10-17 09:12:44.183502
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f2a9c1d7e54'
+down_revision: Union[str, None] = '95c7c31106d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'users',
+        sa.Column('token_version', sa.Integer(), server_default='0', nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'token_version')
@@ -0,0 +1,35 @@
+"""Add Users born_md
+
+Revision ID: 95c7c31106d4
+Revises: c9cda1082301
+Create Date: 2026-10-17 02:08:39.726256
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '95c7c31106d4'
+down_revision: Union[str, None] = 'c9cda1082301'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('born_md', sa.SmallInteger(), nullable=True))
+    if op.get_bind().dialect.name == 'postgresql':
+        month_day = 'EXTRACT(MONTH FROM born_date) * 100 + EXTRACT(DAY FROM born_date)'
+    else:
+        month_day = "CAST(strftime('%m%d', born_date) AS INTEGER)"
+    op.execute(
+        f'UPDATE users SET born_md = {month_day} WHERE born_date IS NOT NULL'
+    )
+    op.create_index(op.f('ix_users_born_md'), 'users', ['born_md'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_users_born_md'), table_name='users')
+    op.drop_column('users', 'born_md')
@@ -0,0 +1,42 @@
+"""Add Users search indexes
+
+Revision ID: c9cda1082301
+Revises: c5f1b0700872
+Create Date: 2026-10-17 02:07:44.540829
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9cda1082301'
+down_revision: Union[str, None] = 'c5f1b0700872'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SEARCH_COLUMNS = ('first_name', 'last_name', 'email')
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for column in SEARCH_COLUMNS:
+        op.create_index(
+            f'ix_users_{column}_trgm',
+            'users',
+            [column],
+            unique=False,
+            postgresql_using='gin',
+            postgresql_ops={column: 'gin_trgm_ops'},
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for column in SEARCH_COLUMNS:
+        op.drop_index(f'ix_users_{column}_trgm', table_name='users')
@@ -6,8 +6,39 @@ class Settings(BaseSettings):
     sqlalchemy_database_url: str = (
         "postgresql+psycopg2://user:password@$localhost:5432/postgres"
     )
+    sqlalchemy_async: bool = True
+    sqlalchemy_replica_urls: list[str] = []
+    db_primary_pin_seconds: float = 5
+    db_primary_pin_redis_retry: float = 5
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_echo: bool = False
+    db_instrument: bool = True
+    db_query_warn_count: int = 20
     secret_key: str = "secret"
     algorithm: str = "HS256"
+    jwt_keys_dir: str = ""
+    jwt_active_kid: str = ""
+    jwks_max_age: int = 300
+    auth_claims_only: bool = False
+    refresh_token_store: str = "redis"
+    refresh_token_ttl: int = 604800
+    revocation_bloom_capacity: int = 100000
+    revocation_bloom_error_rate: float = 0.001
+    revocation_channel: str = "token-revoked"
+    token_cache_size: int = 10000
+    bcrypt_rounds: int = 12
+    hash_workers: int = 2
+    hash_queue_size: int = 32
+    rate_limit_enabled: bool = True
+    rate_limit_window: float = 60
+    rate_limit_per_ip: int = 20
+    rate_limit_per_account: int = 5
+    rate_limit_redis_retry: float = 5
+    rate_limit_trusted_proxies: list[str] = []
     mail_username: str = "username"
     mail_password: str = "password"
     mail_from: str = "username@example.com"
@@ -15,6 +46,19 @@ class Settings(BaseSettings):
     mail_server: str = "smtp.example.com"
     redis_host: str = "localhost"
     redis_port: int = 6379
+    redis_max_connections: int = 50
+    redis_socket_timeout: float = 0.5
+    redis_connect_timeout: float = 0.5
+    user_cache_ttl: int = 3600
+    user_cache_local_size: int = 1000
+    user_cache_local_ttl: float = 5
+    user_cache_channel: str = "user-cache-invalidate"
+    user_cache_lock_ttl: float = 0
+    user_cache_lock_wait: float = 0.2
+    user_cache_ttl_jitter: float = 0.1
+    user_cache_xfetch_beta: float = 1.0
+    bulk_import_batch_size: int = 1000
+    bulk_import_workers: int = 4
     cloudinary_name: str = "cloudinary_name"
     cloudinary_api_key: int = 21345195871934
     cloudinary_api_secret: str = "api_secret"
@@ -1,24 +1,362 @@
+import hashlib
+import itertools
+import time
+from contextlib import asynccontextmanager
+
+from redis.exceptions import RedisError
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
-from fastapi import HTTPException, status
+from sqlalchemy.ext.asyncio import (
+    AsyncSession,
+    create_async_engine,
+    async_sessionmaker,
+)
+from fastapi import HTTPException, Request, status
 
 from src.conf.config import settings
+from src.database.instrumentation import instrument_engine
+from src.database.pool import TimedQueuePool, TimedAsyncQueuePool
+from src.services.redis_pool import get_redis
 
 url = settings.sqlalchemy_database_url
 
-engine = create_engine(url, echo=True, pool_size=5)
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
 
-DBSession = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 
+def get_async_url(sync_url: str) -> str:
+    """
+    The get_async_url function converts a database url with a blocking driver
+    (psycopg2, pysqlite) into the url of the matching asyncio driver (asyncpg, aiosqlite).
+    Urls that already name an async driver are returned unchanged.
 
-# Dependency
-def get_db():
-    db = DBSession()
+    :param sync_url: str: The database url from the settings
+    :return: The database url for the async engine
+    :doc-author: Trelent
+    """
+    db_url = make_url(sync_url)
+    backend = db_url.get_backend_name()
+    if backend not in ASYNC_DRIVERS or db_url.drivername in ASYNC_DRIVERS.values():
+        return sync_url
+    return db_url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(
+        hide_password=False
+    )
+
+
+class SyncStreamResult:
+    """
+    Async iteration over a streamed (server-side cursor) Result of the sync engine,
+    the counterpart of the AsyncResult returned by AsyncSession.stream().
+    """
+
+    def __init__(self, result):
+        self.result = result
+
+    async def partitions(self, size: int | None = None):
+        for partition in self.result.partitions(size):
+            yield partition
+
+    def __aiter__(self):
+        return self._rows()
+
+    async def _rows(self):
+        for row in self.result:
+            yield row
+
+
+class SyncSession:
+    """
+    Adapter that exposes a blocking Session through the awaitable interface of
+    AsyncSession, so the repository layer runs unchanged on the sync engine.
+    The calls still block the event loop; it exists for A/B load tests only.
+    """
+
+    def __init__(self, session):
+        self.sync_session = session
+
+    @property
+    def info(self):
+        return self.sync_session.info
+
+    @property
+    def bind(self):
+        return self.sync_session.bind
+
+    def get_bind(self, *args, **kwargs):
+        return self.sync_session.get_bind(*args, **kwargs)
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement, *args, **kwargs):
+        return self.sync_session.execute(statement, *args, **kwargs)
+
+    async def scalar(self, statement, *args, **kwargs):
+        return self.sync_session.scalar(statement, *args, **kwargs)
+
+    async def scalars(self, statement, *args, **kwargs):
+        return self.sync_session.scalars(statement, *args, **kwargs)
+
+    async def stream(self, statement, *args, **kwargs):
+        statement = statement.execution_options(stream_results=True)
+        return SyncStreamResult(self.sync_session.execute(statement, *args, **kwargs))
+
+    async def get(self, entity, ident, **kwargs):
+        return self.sync_session.get(entity, ident, **kwargs)
+
+    async def delete(self, instance):
+        self.sync_session.delete(instance)
+
+    async def flush(self, objects=None):
+        self.sync_session.flush(objects)
+
+    async def refresh(self, instance, attribute_names=None):
+        self.sync_session.refresh(instance, attribute_names)
+
+    async def commit(self):
+        self.sync_session.commit()
+        await pin_after_commit(self)
+
+    async def rollback(self):
+        self.sync_session.rollback()
+
+    async def close(self):
+        self.sync_session.close()
+
+
+class PinningSession(AsyncSession):
+    """
+    AsyncSession that pins the client of the request to the primary after every
+    commit, see PrimaryPins.
+    """
+
+    async def commit(self):
+        await super().commit()
+        await pin_after_commit(self)
+
+
+engine_options = dict(
+    echo=settings.db_echo,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+    pool_recycle=settings.db_pool_recycle,
+    pool_pre_ping=settings.db_pool_pre_ping,
+)
+
+
+def create_session_factory(db_url: str):
+    """
+    The create_session_factory function builds the engine for a database url and
+    returns it together with a factory of sessions bound to it. Depending on the
+    sqlalchemy_async setting the sessions are AsyncSession or SyncSession objects.
+    With the db_instrument setting the engine reports its statements per request.
+
+    :param db_url: str: The database url from the settings
+    :return: A tuple of the engine and the session factory
+    :doc-author: Trelent
+    """
+    if settings.sqlalchemy_async:
+        db_engine = create_async_engine(
+            get_async_url(db_url), poolclass=TimedAsyncQueuePool, **engine_options
+        )
+        if settings.db_instrument:
+            instrument_engine(db_engine)
+        return db_engine, async_sessionmaker(
+            bind=db_engine,
+            class_=PinningSession,
+            autoflush=False,
+            expire_on_commit=False,
+        )
+
+    db_engine = create_engine(db_url, poolclass=TimedQueuePool, **engine_options)
+    if settings.db_instrument:
+        instrument_engine(db_engine)
+    sync_factory = sessionmaker(
+        bind=db_engine, autocommit=False, autoflush=False, expire_on_commit=False
+    )
+
+    def session_factory():
+        return SyncSession(sync_factory())
+
+    return db_engine, session_factory
+
+
+class PrimaryPins:
+    """
+    Remembers the clients that committed a write recently. Their reads are served
+    by the primary for a short window, so they always see their own writes even
+    when the replicas lag behind. A pin is a Redis key that expires with the
+    window, so it holds whichever worker process serves the next read; the worker
+    that committed also keeps it in memory and answers its own reads without
+    Redis. Without a window, e.g. when there are no replicas, nothing is pinned.
+    While Redis cannot be reached, the pins in memory are used alone and Redis is
+    only tried again after redis_retry seconds, so a Redis outage does not add a
+    socket timeout to every read.
+    """
+
+    def __init__(self, seconds: float, redis_retry: float = 5) -> None:
+        self.seconds = seconds
+        self.redis_retry = redis_retry
+        self._pins = {}
+        self.redis_down_until = 0.0
+
+    @staticmethod
+    def key(key: str) -> str:
+        return f"pin:{key}"
+
+    async def pin(self, key: str) -> None:
+        """
+        The pin function sends the reads of the client to the primary for the
+        next seconds, in every worker process. If Redis cannot be reached, only
+        this worker process knows the pin.
+
+        :param self: Represent the instance of the class
+        :param key: str: The key of the client, see get_pin_key
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        if self.seconds <= 0:
+            return
+        now = time.monotonic()
+        if len(self._pins) > 10000:
+            self._pins = {k: v for k, v in self._pins.items() if v > now}
+        self._pins[key] = now + self.seconds
+        if now < self.redis_down_until:
+            return
+        try:
+            await get_redis().set(self.key(key), 1, px=int(self.seconds * 1000))
+        except RedisError:
+            self.redis_down_until = time.monotonic() + self.redis_retry
+
+    async def is_pinned(self, key: str) -> bool:
+        """
+        The is_pinned function tells whether the reads of the client go to the
+        primary. When asking Redis fails, they do; until Redis is tried again,
+        only the pins of this worker process count.
+
+        :param self: Represent the instance of the class
+        :param key: str: The key of the client, see get_pin_key
+        :return: True if the client committed a write within the window
+        :doc-author: Trelent
+        """
+        if self.seconds <= 0:
+            return False
+        now = time.monotonic()
+        deadline = self._pins.get(key)
+        if deadline is not None:
+            if deadline > now:
+                return True
+            self._pins.pop(key, None)
+        if now < self.redis_down_until:
+            return False
+        try:
+            return bool(await get_redis().exists(self.key(key)))
+        except RedisError:
+            self.redis_down_until = time.monotonic() + self.redis_retry
+            return True
+
+
+class ReadSessionRouter:
+    """
+    Chooses the session factory for read-only requests: the replicas in
+    round-robin order, or the primary for clients pinned after a write.
+    """
+
+    def __init__(self, primary, replicas: list, pins: PrimaryPins) -> None:
+        self.primary = primary
+        self.replicas = itertools.cycle(replicas) if replicas else None
+        self.pins = pins
+
+    async def session_factory(self, pin_key: str | None):
+        if self.replicas is None:
+            return self.primary
+        if pin_key is not None and await self.pins.is_pinned(pin_key):
+            return self.primary
+        return next(self.replicas)
+
+
+def get_pin_key(request: Request) -> str | None:
+    """
+    The get_pin_key function identifies the client of a request for read-your-writes
+    pinning by the digest of its bearer token. Anonymous requests are not pinned:
+    behind a proxy their address is the one of the proxy, shared by every client.
+
+    :param request: Request: The incoming request
+    :return: A string key of the client, or None for anonymous requests
+    :doc-author: Trelent
+    """
+    authorization = request.headers.get("Authorization")
+    if authorization:
+        return hashlib.sha256(authorization.encode()).hexdigest()
+    return None
+
+
+async def pin_after_commit(session) -> None:
+    pin_key = session.info.get("pin_key")
+    if pin_key is not None:
+        await primary_pins.pin(pin_key)
+
+
+engine, DBSession = create_session_factory(url)
+replica_engines = []
+replica_sessions = []
+for replica_url in settings.sqlalchemy_replica_urls:
+    replica_engine, replica_session = create_session_factory(replica_url)
+    replica_engines.append(replica_engine)
+    replica_sessions.append(replica_session)
+
+primary_pins = PrimaryPins(
+    settings.db_primary_pin_seconds if replica_sessions else 0,
+    settings.db_primary_pin_redis_retry,
+)
+read_router = ReadSessionRouter(DBSession, replica_sessions, primary_pins)
+
+
+async def dispose_engines() -> None:
+    """
+    The dispose_engines function closes the pooled connections of the primary and
+    replica engines when the application stops.
+
+    :return: Nothing
+    :doc-author: Trelent
+    """
+    for db_engine in (engine, *replica_engines):
+        if settings.sqlalchemy_async:
+            await db_engine.dispose()
+        else:
+            db_engine.dispose()
+
+
+@asynccontextmanager
+async def session_scope(session_factory, pin_key: str | None = None):
+    db = session_factory()
+    if pin_key is not None:
+        db.info["pin_key"] = pin_key
     try:
         yield db
     except SQLAlchemyError as err:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
     finally:
-        db.close()
+        await db.close()
+
+
+# Dependency
+async def get_db(request: Request):
+    async with session_scope(DBSession, get_pin_key(request)) as db:
+        yield db
+
+
+# Dependency for read-only routes
+async def get_read_db(request: Request):
+    session_factory = await read_router.session_factory(get_pin_key(request))
+    async with session_scope(session_factory) as db:
+        yield db
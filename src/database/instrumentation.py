@@ -0,0 +1,126 @@
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """
+    The SQL statements executed while serving one request: how many, the time
+    spent in the database, the slowest statement and how often each statement
+    text repeats, which is how N+1 query patterns show up.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+        self.statements = Counter()
+
+    def record(self, statement: str, elapsed: float) -> None:
+        """
+        The record function adds a single executed statement to the stats.
+
+        :param self: Represent the instance of the class
+        :param statement: str: The SQL text of the statement
+        :param elapsed: float: Seconds spent executing it
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.count += 1
+        self.total_time += elapsed
+        self.statements[statement] += 1
+        if elapsed >= self.slowest_time:
+            self.slowest_time = elapsed
+            self.slowest_statement = statement
+
+    def most_repeated(self) -> tuple[str | None, int]:
+        if not self.statements:
+            return None, 0
+        return self.statements.most_common(1)[0]
+
+
+_request_stats: ContextVar[QueryStats | None] = ContextVar(
+    "request_query_stats", default=None
+)
+
+
+def start_request_stats() -> QueryStats:
+    """
+    The start_request_stats function starts collecting the statements executed
+    by the current request. SQLAlchemy runs the engine events of AsyncSession in
+    a greenlet that shares the context of the calling task, so the statements are
+    attributed to the request that awaited them.
+
+    :return: The QueryStats of the request
+    :doc-author: Trelent
+    """
+    stats = QueryStats()
+    _request_stats.set(stats)
+    return stats
+
+
+def get_request_stats() -> QueryStats | None:
+    return _request_stats.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+
+
+def instrument_engine(engine) -> None:
+    """
+    The instrument_engine function times every statement the engine executes
+    and adds it to the QueryStats of the current request, if any.
+    Async engines are instrumented through their sync_engine.
+
+    :param engine: An Engine or AsyncEngine
+    :return: Nothing
+    :doc-author: Trelent
+    """
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def log_request_stats(method: str, path: str, stats: QueryStats, warn_count: int):
+    """
+    The log_request_stats function writes a log record with the SQL stats of a request.
+    Requests that execute more than warn_count statements are logged as warnings,
+    together with their most repeated statement.
+
+    :param method: str: The HTTP method of the request
+    :param path: str: The path of the request
+    :param stats: QueryStats: The stats collected for the request
+    :param warn_count: int: The number of statements that triggers a warning
+    :return: Nothing
+    :doc-author: Trelent
+    """
+    if not stats.count:
+        return
+    message = "%s %s: %d queries in %.2f ms, slowest %.2f ms: %s"
+    args = [
+        method,
+        path,
+        stats.count,
+        stats.total_time * 1000,
+        stats.slowest_time * 1000,
+        stats.slowest_statement,
+    ]
+    if stats.count > warn_count:
+        statement, repeats = stats.most_repeated()
+        logger.warning(message + "; repeated %d times: %s", *args, repeats, statement)
+    else:
+        logger.info(message, *args)
@@ -1,4 +1,5 @@
 import enum
+from datetime import date
 
 from sqlalchemy import (
     Column,
@@ -10,6 +11,8 @@ from sqlalchemy import (
     Enum,
     event,
     Boolean,
+    Index,
+    SmallInteger,
 )
 
 # from sqlalchemy.ext.declarative import declarative_base
@@ -17,6 +20,8 @@ from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
 
+ADMIN_EMAIL = "admin@ex.ua"
+
 
 class Role(enum.Enum):
     admin: str = "admin"
@@ -24,6 +29,20 @@ class Role(enum.Enum):
     user: str = "user"
 
 
+def birth_month_day(born_date: date | None) -> int | None:
+    """
+    The birth_month_day function encodes the month and day of a birth date
+    as a single sortable number, month * 100 + day (December 31st is 1231).
+
+    :param born_date: date | None: The birth date
+    :return: The month-day number, or None if there is no birth date
+    :doc-author: Trelent
+    """
+    if born_date is None:
+        return None
+    return born_date.month * 100 + born_date.day
+
+
 class Users(Base):
     __tablename__ = "users"
 
@@ -38,19 +57,37 @@ class Users(Base):
     roles = Column("roles", Enum(Role), default=Role.user)
     phone_number = Column(String(25), nullable=True)
     born_date = Column(Date, nullable=True)
+    born_md = Column(SmallInteger, nullable=True, index=True)
     description = Column(String(250))
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     confirmed = Column(Boolean, default=False)
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = tuple(
+        Index(
+            f"ix_users_{column}_trgm",
+            column,
+            postgresql_using="gin",
+            postgresql_ops={column: "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql")
+        for column in ("first_name", "last_name", "email")
+    )
 
 
 @event.listens_for(Users, "before_insert")
 def updated_roles(mapper, conn, target):
-    if target.email == "admin@ex.ua":
+    if target.email == ADMIN_EMAIL:
         target.roles = Role.admin
 
 
 @event.listens_for(Users, "before_update")
 def updated_roles(mapper, conn, target):
-    if target.email == "admin@ex.ua":
+    if target.email == ADMIN_EMAIL:
         target.roles = Role.admin
+
+
+@event.listens_for(Users, "before_insert")
+@event.listens_for(Users, "before_update")
+def updated_born_md(mapper, conn, target):
+    target.born_md = birth_month_day(target.born_date)
@@ -0,0 +1,100 @@
+import time
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+
+class PoolWaitStats:
+    """
+    Counters for the time requests spend waiting on Pool.connect(),
+    which includes waiting for a free connection and opening overflow ones.
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float, timed_out: bool = False) -> None:
+        """
+        The record function adds a single checkout to the counters.
+
+        :param self: Represent the instance of the class
+        :param wait: float: Seconds spent inside Pool.connect()
+        :param timed_out: bool: The checkout failed with a pool timeout
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        if timed_out:
+            self.timeouts += 1
+        else:
+            self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def as_dict(self) -> dict:
+        attempts = self.checkouts + self.timeouts
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_total_ms": self.total_wait * 1000,
+            "wait_avg_ms": self.total_wait * 1000 / attempts if attempts else 0.0,
+            "wait_max_ms": self.max_wait * 1000,
+        }
+
+
+class TimedPoolMixin:
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolWaitStats()
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            self.wait_stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.wait_stats.record(time.perf_counter() - start)
+        return connection
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def get_pool_status(pool) -> dict:
+    """
+    The get_pool_status function reports the current state of a connection pool:
+    connections checked out, idle connections, overflow in use and the wait
+    statistics collected since the process started.
+
+    :param pool: The pool of the engine, engine.pool
+    :return: A dictionary with the pool figures
+    :doc-author: Trelent
+    """
+    status = {
+        "pool_class": type(pool).__name__,
+        "size": None,
+        "checked_out": None,
+        "idle": None,
+        "overflow": None,
+    }
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            idle=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+        )
+    wait_stats = getattr(pool, "wait_stats", None)
+    status.update(wait_stats.as_dict() if wait_stats else PoolWaitStats().as_dict())
+    return status
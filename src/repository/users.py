@@ -1,26 +1,52 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 from libgravatar import Gravatar
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, delete, or_, func, case
 
-from src.database.models import Users
-from src.schemas import UserModel, UserEmailModel
+from src.database.models import Users, Role, ADMIN_EMAIL, birth_month_day
+from src.schemas import UserModel, UserEmailModel, UserDb
+from src.services.user_cache import CachedUser, user_cache
 
 
-async def get_users(db: Session):
+async def get_users(db: AsyncSession, limit: int | None = None, after_id: int = 0):
     """
-    The get_users function returns a list of all users in the database.
+    The get_users function returns a page of users ordered by id.
+    It uses keyset pagination: the page starts right after the user with id after_id,
+    so the primary key index serves the query whatever the size of the table.
+
+    :param db: AsyncSession: Pass the database session to the function
+    :param limit: int | None: The maximum number of users to return, all users if None
+    :param after_id: int: Return only the users with a greater id
+    :return: A list of users ordered by id
+    :doc-author: Trelent
+    """
+    users = await db.scalars(
+        select(Users).where(Users.id > after_id).order_by(Users.id).limit(limit)
+    )
+    return users.all()
+
+
+async def stream_users(db: AsyncSession, batch_size: int = 1000):
+    """
+    The stream_users function reads the whole users table through a server-side cursor
+    and yields it in batches of rows, so memory use does not depend on the table size.
+    Only the columns of the UserDb schema are selected.
 
-    :param db: Session: Pass the database session to the function
-    :return: A list of all the users in the database
+    :param db: AsyncSession: Pass the database session to the function
+    :param batch_size: int: The number of rows fetched from the cursor at a time
+    :return: An async generator of lists of rows ordered by id
     :doc-author: Trelent
     """
-    users = db.query(Users).all()
-    return users
+    columns = [getattr(Users, name) for name in UserDb.model_fields]
+    result = await db.stream(
+        select(*columns).order_by(Users.id).execution_options(yield_per=batch_size)
+    )
+    async for rows in result.partitions():
+        yield rows
 
 
-async def get_user(user_id: int, db: Session):
+async def get_user(user_id: int, db: AsyncSession):
     """
     The get_user function is used to retrieve a user from the database.
     It takes in an integer representing the id of the user and a Session object
@@ -28,201 +54,306 @@ async def get_user(user_id: int, db: Session):
     a User object.
 
     :param user_id: int: Specify the user_id of the user we want to retrieve
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A user object
     :doc-author: Trelent
     """
-    user = db.query(Users).filter_by(id=user_id).first()
+    user = await db.scalar(select(Users).filter_by(id=user_id))
     return user
 
 
-async def create_user(body: UserModel, db: Session):
+async def create_user(body: UserModel, db: AsyncSession):
     """
     The create_user function creates a new user in the database.
 
     :param body: UserModel: Validate the request body against the usermodel schema
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: The user object
     :doc-author: Trelent
     """
     g = Gravatar(body.email)
     user = Users(**body.model_dump(), avatar=g.get_image())
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     return user
 
 
-async def update_token(user: Users, refresh_token, db: Session):
+async def update_token(user: Users, refresh_token, db: AsyncSession):
     """
     The update_token function updates the refresh token for a user.
 
     :param user: Users: Pass in the user object
     :param refresh_token: Update the user's refresh token in the database
-    :param db: Session: Commit the changes to the database
+    :param db: AsyncSession: Commit the changes to the database
     :return: The user's refresh token
     :doc-author: Trelent
     """
     user.refresh_token = refresh_token
-    db.commit()
+    await db.commit()
+
+
+async def update_password(user: Users, password: str, db: AsyncSession) -> None:
+    """
+    The update_password function stores a new password hash of a user,
+    e.g. a rehash with the current bcrypt cost made at login.
+
+    :param user: Users: Pass in the user object
+    :param password: str: The new password hash
+    :param db: AsyncSession: Commit the changes to the database
+    :return: Nothing
+    :doc-author: Trelent
+    """
+    user.password = password
+    await db.commit()
+
+
+def email_values(email: str) -> dict:
+    """
+    The email_values function returns the column values for a new email.
+    UPDATE statements bypass the ORM events of the Users model,
+    so the admin role is granted here. A changed email bumps the token version,
+    so access tokens issued for the previous email and role are rejected.
 
+    :param email: str: The new email of the user
+    :return: A dictionary of column values
+    :doc-author: Trelent
+    """
+    values = {
+        "email": email,
+        "token_version": case(
+            (Users.email != email, Users.token_version + 1),
+            else_=Users.token_version,
+        ),
+    }
+    if email == ADMIN_EMAIL:
+        values["roles"] = Role.admin
+    return values
+
+
+async def commit_write(user: Users, db: AsyncSession) -> None:
+    """
+    The commit_write function commits an UPDATE ... RETURNING of a user and
+    writes the user through to the user cache. The write generation of its email
+    is read while the UPDATE still holds the row lock, so a concurrent write
+    committed later bumps it only afterwards and the cache keeps the later row.
 
-async def update_user(body: UserModel, user_id: int, db: Session):
+    :param user: Users: The user returned by the UPDATE
+    :param db: AsyncSession: Commit the changes to the database
+    :return: Nothing
+    :doc-author: Trelent
     """
-    The update_user function updates the user's information in the database.
+    generation = await user_cache.generation(user.email)
+    await db.commit()
+    await user_cache.write_through(CachedUser.from_user(user), generation)
+
+
+async def update_user(body: UserModel, user_id: int, db: AsyncSession):
+    """
+    The update_user function updates the user's information in the database
+    with a single UPDATE ... RETURNING statement.
+    The updated user is written through to the user cache.
         Args:
             body (UserModel): The UserModel object containing all of the user's information.
             user_id (int): The id of the current logged in user.
 
     :param body: UserModel: Get the data from the request body
     :param user_id: int: Get the user with that id from the database
-    :param db: Session: Access the database
-    :return: A user object
+    :param db: AsyncSession: Access the database
+    :return: A user object, or None if there is no user with that id
     :doc-author: Trelent
     """
-    user = db.query(Users).filter_by(id=user_id).first()
+    user = await db.scalar(
+        update(Users)
+        .where(Users.id == user_id)
+        .values(
+            first_name=body.first_name,
+            last_name=body.last_name,
+            phone_number=body.phone_number,
+            born_date=body.born_date,
+            born_md=birth_month_day(body.born_date),
+            description=body.description,
+            **email_values(body.email),
+        )
+        .returning(Users)
+    )
     if user:
-        user.first_name = body.first_name
-        user.last_name = body.last_name
-        user.email = body.email
-        user.phone_number = body.phone_number
-        user.born_date = body.born_date
-        user.description = body.description
-        db.commit()
+        await commit_write(user, db)
     return user
 
 
-async def update_user_email(body: UserEmailModel, user_id: int, db: Session):
+async def update_user_email(body: UserEmailModel, user_id: int, db: AsyncSession):
     """
-    The update_user_email function updates the email of a user.
+    The update_user_email function updates the email of a user
+    with a single UPDATE ... RETURNING statement.
+    The updated user is written through to the user cache.
 
     :param body: UserEmailModel: Pass the data from the request body into the function
     :param user_id: int: Identify the user that is being updated
-    :param db: Session: Pass the database session to the function
-    :return: The user object
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The user object, or None if there is no user with that id
     :doc-author: Trelent
     """
-    user = db.query(Users).filter_by(id=user_id).first()
+    user = await db.scalar(
+        update(Users)
+        .where(Users.id == user_id)
+        .values(**email_values(body.email))
+        .returning(Users)
+    )
     if user:
-        user.email = body.email
-        db.commit()
+        await commit_write(user, db)
     return user
 
 
-async def remove_user(user_id: int, db: Session):
+async def remove_user(user_id: int, db: AsyncSession):
     """
-    The remove_user function removes a user from the database.
+    The remove_user function removes a user from the database
+    with a single DELETE ... RETURNING statement.
+    The user is evicted from the user cache.
 
     :param user_id: int: Specify the user to be deleted
-    :param db: Session: Pass the database session to the function
-    :return: The user object that was deleted from the database
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The user object that was deleted from the database, or None
     :doc-author: Trelent
     """
-    user = db.query(Users).filter_by(id=user_id).first()
+    user = await db.scalar(delete(Users).where(Users.id == user_id).returning(Users))
     if user:
-        db.delete(user)
-        db.commit()
+        await db.commit()
+        await user_cache.evict(user.id, user.email)
     return user
 
 
-async def search_user(q: str, skip: int, limit: int, db: Session):
+async def search_user(q: str, skip: int, limit: int, db: AsyncSession):
     """
     The search_user function searches for users in the database.
+    A user matches when the query is a substring of the first name, last name or email,
+    case insensitive. On PostgreSQL the match is served by the pg_trgm GIN indexes
+    and the results are ranked by trigram similarity; other databases rank exact
+    and prefix matches first.
 
     :param q: str: Search for a user by first name, last name or email
     :param skip: int: Skip the first n results
     :param limit: int: Limit the number of results returned
-    :param db: Session: Pass the database session to the function
-    :return: A list of users
-    :doc-author: Trelent
-    """
-    users = (
-        db.query(Users)
-        .query.filter(
-            or_(
-                Users.first_name.ilike(f"%{q}%"),
-                Users.last_name.ilike(f"%{q}%"),
-                Users.email.ilike(f"%{q}%"),
-            )
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A list of users, the most relevant first
+    :doc-author: Trelent
+    """
+    columns = (Users.first_name, Users.last_name, Users.email)
+    if db.get_bind().dialect.name == "postgresql":
+        relevance = func.greatest(*(func.similarity(column, q) for column in columns))
+    else:
+        relevance = case(
+            (func.lower(Users.email) == q.lower(), 3),
+            (or_(*(column.istartswith(q, autoescape=True) for column in columns)), 2),
+            else_=1,
         )
+    users = await db.scalars(
+        select(Users)
+        .filter(or_(*(column.icontains(q, autoescape=True) for column in columns)))
+        .order_by(relevance.desc(), Users.id)
         .offset(skip)
         .limit(limit)
-        .all()
     )
-    return users
+    return users.all()
 
 
-async def birthdays_per_week(days: int, skip: int, limit: int, db: Session):
+def upcoming_birthdays_filter(start: date, days: int):
+    """
+    The upcoming_birthdays_filter function builds the condition on the born_md column
+    that selects the birthdays from start up to start + days inclusive.
+    When the window crosses the end of the year it is split into two ranges,
+    so the condition is always served by the born_md index.
+
+    :param start: date: The first day of the window
+    :param days: int: The length of the window in days
+    :return: A SQL expression and the month-day number the window starts at
+    :doc-author: Trelent
+    """
+    date_from = birth_month_day(start)
+    date_to = birth_month_day(start + timedelta(days=days))
+    if days >= 365:
+        return Users.born_md.is_not(None), date_from
+    if date_from <= date_to:
+        return Users.born_md.between(date_from, date_to), date_from
+    return or_(Users.born_md >= date_from, Users.born_md <= date_to), date_from
+
+
+async def birthdays_per_week(days: int, skip: int, limit: int, db: AsyncSession):
     """
     The birthdays_per_week function returns a list of users whose birthdays are within the next
-        'days' days. The function takes three arguments:
+        'days' days, the nearest birthdays first. Windows that cross December 31st
+        include the birthdays at the start of the next year.
 
     :param days: int: Determine how many days in the future to look for birthdays
     :param skip: int: Skip the first n records
     :param limit: int: Limit the number of users returned
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A list of users whose birthday is within the next n days
     :doc-author: Trelent
     """
-    today = datetime.now().date()
-    date_to = today + timedelta(days=days)
-
-    upcoming_birthdays_filter = (
-        func.to_char(Users.born_date, "MM-DD") >= today.strftime("%m-%d")
-    ) & (func.to_char(Users.born_date, "MM-DD") <= date_to.strftime("%m-%d"))
-
-    birthday_users = (
-        db.query(Users)
-        .filter(upcoming_birthdays_filter)
+    upcoming_filter, date_from = upcoming_birthdays_filter(datetime.now().date(), days)
+    birthday_users = await db.scalars(
+        select(Users)
+        .filter(upcoming_filter)
+        .order_by(case((Users.born_md < date_from, 1), else_=0), Users.born_md)
         .offset(skip)
         .limit(limit)
-        .all()
     )
-    return birthday_users
+    return birthday_users.all()
 
 
-async def get_user_by_email(email: str, db: Session) -> Users | None:
+async def get_user_by_email(email: str, db: AsyncSession) -> Users | None:
     """
     The get_user_by_email function is used to retrieve a user from the database by their email address.
     It returns None if no user with that email exists.
 
     :param email: str: Specify the email of the user we want to get
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: The first user with the given email address
     :doc-author: Trelent
     """
-    return db.query(Users).filter_by(email=email).first()
+    return await db.scalar(select(Users).filter_by(email=email))
 
 
-async def confirmed_email(email: str, db: Session) -> None:
+async def confirmed_email(email: str, db: AsyncSession) -> Users | None:
     """
     The confirmed_email function takes an email and a database session as arguments.
-    It then gets the user by their email, sets their confirmed status to True, and commits the change.
+    It sets the confirmed status of the user with that email to True with a single
+    UPDATE ... RETURNING statement, which only matches users that are not confirmed yet.
+    The updated user is written through to the user cache.
 
     :param email: str: Get the email of the user
-    :param db: Session: Pass the database session to the function
-    :return: Nothing
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The confirmed user, or None if there is no unconfirmed user with that email
     :doc-author: Trelent
     """
-    user = await get_user_by_email(email, db)
-    user.confirmed = True
-    db.commit()
+    user = await db.scalar(
+        update(Users)
+        .where(Users.email == email, Users.confirmed.is_not(True))
+        .values(confirmed=True)
+        .returning(Users)
+    )
+    if user:
+        await commit_write(user, db)
+    return user
 
 
-async def update_avatar(email, url: str, db: Session) -> Users:
+async def update_avatar(email, url: str, db: AsyncSession) -> Users | None:
     """
     The update_avatar function takes an email and a url as arguments.
-    It then uses the get_user_by_email function to find the user with that email,
-    and sets their avatar property to be equal to the url argument. It then commits
-    the changes made in db and returns the updated user.
+    It sets the avatar of the user with that email to the url
+    with a single UPDATE ... RETURNING statement and commits the change.
+    The updated user is written through to the user cache.
 
     :param email: Find the user in the database
     :param url: str: Specify the type of data that is expected to be passed in
-    :param db: Session: Pass a database session to the function
-    :return: A user object
+    :param db: AsyncSession: Pass a database session to the function
+    :return: A user object, or None if there is no user with that email
     :doc-author: Trelent
     """
-    user = await get_user_by_email(email, db)
-    user.avatar = url
-    db.commit()
+    user = await db.scalar(
+        update(Users).where(Users.email == email).values(avatar=url).returning(Users)
+    )
+    if user:
+        await commit_write(user, db)
     return user
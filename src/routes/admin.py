@@ -0,0 +1,120 @@
+from typing import List
+
+from fastapi import APIRouter, Depends
+
+from src.database.db import engine, replica_engines
+from src.database.models import Role
+from src.database.pool import get_pool_status
+from src.schemas import (
+    PoolStatus,
+    HashPoolStatus,
+    TokenCacheStatus,
+    UserCacheStatus,
+    RevocationStatus,
+)
+from src.services.auth import auth_service
+from src.services.hashing import hash_pool
+from src.services.user_cache import user_cache
+from src.services.revocation import token_denylist
+from src.services.roles import RoleAccess
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+allowed_operation_metrics = RoleAccess([Role.admin])
+
+
+@router.get(
+    "/db/pool",
+    response_model=List[PoolStatus],
+    dependencies=[Depends(allowed_operation_metrics)],
+    description="Only admin",
+)
+async def db_pool_status():
+    """
+    The db_pool_status function reports the state of the database connection pools
+    of the primary and of every read replica: checked out and idle connections,
+    overflow in use and the time requests waited for a connection.
+    It is used to size the pool settings from real traffic.
+
+    :return: A list of PoolStatus objects
+    :doc-author: Trelent
+    """
+    pools = [{"name": "primary", **get_pool_status(engine.pool)}]
+    for number, replica_engine in enumerate(replica_engines):
+        pools.append(
+            {"name": f"replica-{number}", **get_pool_status(replica_engine.pool)}
+        )
+    return pools
+
+
+@router.get(
+    "/auth/hash-pool",
+    response_model=HashPoolStatus,
+    dependencies=[Depends(allowed_operation_metrics)],
+    description="Only admin",
+)
+async def hash_pool_status():
+    """
+    The hash_pool_status function reports the state of the password hashing pool
+    of this worker process: calls in flight and queued, calls rejected with 503,
+    and the time calls waited for a thread and spent hashing.
+
+    :return: A HashPoolStatus object
+    :doc-author: Trelent
+    """
+    return hash_pool.as_dict()
+
+
+@router.get(
+    "/auth/token-cache",
+    response_model=TokenCacheStatus,
+    dependencies=[Depends(allowed_operation_metrics)],
+    description="Only admin",
+)
+async def token_cache_status():
+    """
+    The token_cache_status function reports the verified-JWT cache of this worker
+    process: its size, hits and misses, and the entries evicted or expired.
+
+    :return: A TokenCacheStatus object
+    :doc-author: Trelent
+    """
+    return auth_service.token_cache.as_dict()
+
+
+@router.get(
+    "/auth/user-cache",
+    response_model=UserCacheStatus,
+    dependencies=[Depends(allowed_operation_metrics)],
+    description="Only admin",
+)
+async def user_cache_status():
+    """
+    The user_cache_status function reports the two tiers of the user cache
+    as seen by this worker process: the size, hits, misses, evictions and
+    expirations of the process cache, and the hits, misses and errors of Redis
+    with the invalidations sent and received, and the database loads of users
+    with the concurrent misses they coalesced.
+
+    :return: A UserCacheStatus object
+    :doc-author: Trelent
+    """
+    return user_cache.as_dict()
+
+
+@router.get(
+    "/auth/revocations",
+    response_model=RevocationStatus,
+    dependencies=[Depends(allowed_operation_metrics)],
+    description="Only admin",
+)
+async def revocation_status():
+    """
+    The revocation_status function reports the revoked-token filter of this worker
+    process: its fill and the checks it answered, the hits it sent to Redis and
+    how many of them were false positives.
+
+    :return: A RevocationStatus object
+    :doc-author: Trelent
+    """
+    return token_denylist.as_dict()
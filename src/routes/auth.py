@@ -6,10 +6,10 @@ from fastapi import (
     Security,
     BackgroundTasks,
     Request,
+    Response,
 )
 
-from fastapi_limiter.depends import RateLimiter
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.security import (
     OAuth2PasswordRequestForm,
     HTTPAuthorizationCredentials,
@@ -26,9 +26,25 @@ from src.schemas import (
 )
 
 from src.repository import users as repository_users
-from src.services.auth import auth_service
+from src.conf.config import settings
+from src.services.auth import Principal, auth_service
 from src.services.mail import send_email
-from src.schemas import UserModel, UserResponse, TokenModel, RequestEmail
+from src.services.rate_limit import SlidingWindowLimiter, get_rate_limiter
+from src.services.refresh_tokens import (
+    REUSED,
+    ROTATED,
+    UNKNOWN_FAMILY,
+    RefreshTokenStore,
+    get_refresh_token_store,
+    new_token_id,
+)
+from src.schemas import (
+    UserModel,
+    UserResponse,
+    TokenModel,
+    RequestEmail,
+    RevokeTokenModel,
+)
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 security = HTTPBearer()
@@ -38,13 +54,13 @@ security = HTTPBearer()
     "/signup",
     response_model=UserResponse,
     status_code=status.HTTP_201_CREATED,
-    # dependencies=[Depends(RateLimiter(times=2, seconds=10))],
 )
 async def signup(
     body: UserModel,
     background_tasks: BackgroundTasks,
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
+    limiter: SlidingWindowLimiter = Depends(get_rate_limiter),
 ):
     """
     The signup function creates a new user in the database.
@@ -58,16 +74,18 @@ async def signup(
     :param body: UserModel: Get the user's email and password
     :param background_tasks: BackgroundTasks: Add a task to the background tasks queue
     :param request: Request: Get the base url of the server
-    :param db: Session: Get a database session
+    :param db: AsyncSession: Get a database session
+    :param limiter: SlidingWindowLimiter: Limit the signups per client IP and email
     :return: A dictionary
     :doc-author: Trelent
     """
+    await limiter.hit("signup", request, body.email)
     exist_user = await repository_users.get_user_by_email(body.email, db)
     if exist_user:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail="Account already exists"
         )
-    body.password = auth_service.get_password_hash(body.password)
+    body.password = await auth_service.get_password_hash_async(body.password)
     new_user = await repository_users.create_user(body, db)
     background_tasks.add_task(
         send_email, new_user.email, new_user.username, str(request.base_url)
@@ -80,16 +98,29 @@ async def signup(
 
 @router.post("/login", response_model=TokenModel)
 async def login(
-    body: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)
+    request: Request,
+    body: OAuth2PasswordRequestForm = Depends(),
+    db: AsyncSession = Depends(get_db),
+    tokens: RefreshTokenStore = Depends(get_refresh_token_store),
+    limiter: SlidingWindowLimiter = Depends(get_rate_limiter),
 ):
     """
     The login function is used to authenticate a user.
+    A password hash made with another bcrypt cost than the bcrypt_rounds setting
+    is replaced with a new hash of the password on successful login.
+    The refresh token starts a new token family in the refresh token store.
+    Attempts are rate limited per client IP and per email before the password
+    is checked.
 
+    :param request: Request: Get the client IP
     :param body: OAuth2PasswordRequestForm: Get the username and password from the request body
-    :param db: Session: Get a database session
+    :param db: AsyncSession: Get a database session
+    :param tokens: RefreshTokenStore: The store of the valid refresh tokens
+    :param limiter: SlidingWindowLimiter: Limit the attempts per client IP and email
     :return: A token, but it is not stored in the database
     :doc-author: Trelent
     """
+    await limiter.hit("login", request, body.username)
     user = await repository_users.get_user_by_email(body.username, db)
     if user is None:
         raise HTTPException(
@@ -99,14 +130,25 @@ async def login(
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Email not confirmed"
         )
-    if not auth_service.verify_password(body.password, user.password):
+    verified, new_hash = await auth_service.verify_and_update_async(
+        body.password, user.password
+    )
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password"
         )
+    if new_hash:
+        # rehashed with the current bcrypt cost
+        await repository_users.update_password(user, new_hash, db)
 
-    access_token = await auth_service.create_access_token(data={"sub": user.email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email})
-    await repository_users.update_token(user, refresh_token, db)
+    family, jti = new_token_id(), new_token_id()
+    access_token = await auth_service.create_access_token(
+        data={**auth_service.access_claims(user), "fam": family}
+    )
+    refresh_token = await auth_service.create_refresh_token(
+        data={"sub": user.email, "fam": family, "jti": jti}
+    )
+    await tokens.start(user.email, family, jti, settings.refresh_token_ttl)
     return {
         "access_token": access_token,
         "refresh_token": refresh_token,
@@ -116,31 +158,56 @@ async def login(
 
 @router.get("/refresh_token", response_model=TokenModel)
 async def refresh_token(
+    request: Request,
     credentials: HTTPAuthorizationCredentials = Security(security),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
+    tokens: RefreshTokenStore = Depends(get_refresh_token_store),
+    limiter: SlidingWindowLimiter = Depends(get_rate_limiter),
 ):
     """
     The refresh_token function is used to refresh the access token.
     The function will check if the user has a valid refresh token and then return a new access_token and refresh_token.
+    The refresh token must be the current one of its family in the refresh token
+    store, which then holds the new one instead. A token that was already
+    rotated is reused, and every token family of the user is revoked; a token
+    of a family that ended, e.g. at logout, is only rejected.
+    The users row is only read.
 
-
+    :param request: Request: Get the client IP
     :param credentials: HTTPAuthorizationCredentials: Get the token from the request header
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
+    :param tokens: RefreshTokenStore: The store of the valid refresh tokens
+    :param limiter: SlidingWindowLimiter: Limit the refreshes per client IP and user
     :return: A new access token and a new refresh token
     :doc-author: Trelent
     """
-    token = credentials.credentials
-    email = await auth_service.decode_refresh_token(token)
+    payload = await auth_service.decode_refresh_token(credentials.credentials)
+    await limiter.hit("refresh", request, payload["sub"])
+    email, family = payload["sub"], payload.get("fam")
+    new_jti = new_token_id()
+    rotated = UNKNOWN_FAMILY
+    if family is not None:
+        rotated = await tokens.rotate(
+            email, family, payload.get("jti"), new_jti, settings.refresh_token_ttl
+        )
+    if rotated != ROTATED:
+        if rotated == REUSED:
+            await tokens.revoke_user(email)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token"
+        )
     user = await repository_users.get_user_by_email(email, db)
-    if user.refresh_token != token:
-        await repository_users.update_token(user, None, db)
+    if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token"
         )
 
-    access_token = await auth_service.create_access_token(data={"sub": email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": email})
-    await repository_users.update_token(user, refresh_token, db)
+    access_token = await auth_service.create_access_token(
+        data={**auth_service.access_claims(user), "fam": family}
+    )
+    refresh_token = await auth_service.create_refresh_token(
+        data={"sub": email, "fam": family, "jti": new_jti}
+    )
     return {
         "access_token": access_token,
         "refresh_token": refresh_token,
@@ -148,8 +215,76 @@ async def refresh_token(
     }
 
 
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(
+    token: str = Depends(auth_service.oauth2_scheme),
+    tokens: RefreshTokenStore = Depends(get_refresh_token_store),
+):
+    """
+    The logout function ends the session of the access token: the token is revoked
+    until it expires and the refresh token family it was issued with is dropped.
+    Other sessions of the user stay logged in.
+
+    :param token: str: Get the access token from the authorization header
+    :param tokens: RefreshTokenStore: The store of the valid refresh tokens
+    :return: Nothing
+    :doc-author: Trelent
+    """
+    payload = await auth_service.access_token_claims(token)
+    await auth_service.revoke_access_token(payload)
+    if payload.get("fam") is not None:
+        await tokens.revoke_family(payload["sub"], payload["fam"])
+
+
+@router.post("/revoke", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke(
+    body: RevokeTokenModel,
+    tokens: RefreshTokenStore = Depends(get_refresh_token_store),
+):
+    """
+    The revoke function revokes an access or a refresh token, like the token
+    revocation endpoint of RFC 7009. A revoked access token is rejected until it
+    expires and ends its refresh token family; a revoked refresh token ends its
+    family. Invalid and expired tokens need no revocation and are accepted too.
+
+    :param body: RevokeTokenModel: The token to revoke
+    :param tokens: RefreshTokenStore: The store of the valid refresh tokens
+    :return: Nothing
+    :doc-author: Trelent
+    """
+    payload = auth_service.decode_token(body.token)
+    if payload is None or payload.get("sub") is None:
+        return
+    if payload.get("scope") == "access_token":
+        await auth_service.revoke_access_token(payload)
+    if payload.get("scope") in ("access_token", "refresh_token"):
+        if payload.get("fam") is not None:
+            await tokens.revoke_family(payload["sub"], payload["fam"])
+
+
+@router.get("/verify", status_code=status.HTTP_204_NO_CONTENT)
+async def verify(principal: Principal = Depends(auth_service.get_token_principal)):
+    """
+    The verify function is the auth_request endpoint of the reverse proxy: 204 with
+    the X-User-Id, X-User-Email and X-User-Role headers for a valid access token,
+    401 otherwise. It needs neither the database nor Redis for current tokens.
+
+    :param principal: Principal: The owner of the access token
+    :return: An empty response with the identity headers
+    :doc-author: Trelent
+    """
+    return Response(
+        status_code=status.HTTP_204_NO_CONTENT,
+        headers={
+            "X-User-Id": str(principal.id),
+            "X-User-Email": principal.email,
+            "X-User-Role": principal.roles.value,
+        },
+    )
+
+
 @router.get("/confirmed_email/{token}")
-async def confirmed_email(token: str, db: Session = Depends(get_db)):
+async def confirmed_email(token: str, db: AsyncSession = Depends(get_db)):
     """
     The confirmed_email function is used to confirm a user's email address.
     The function takes the token from the URL and uses it to get the user's email address.
@@ -158,20 +293,19 @@ async def confirmed_email(token: str, db: Session = Depends(get_db)):
     If it has been confirmed already, we return another message saying so; otherwise we update their account status to &quot;confirmed&quot;.
 
     :param token: str: Get the token from the url
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A dictionary with a message key
     :doc-author: Trelent
     """
     email = auth_service.get_email_from_token(token)
+    if await repository_users.confirmed_email(email, db):
+        return {"message": "Email confirmed"}
     user = await repository_users.get_user_by_email(email, db)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Verification error"
         )
-    if user.confirmed:
-        return {"message": "Your email is already confirmed"}
-    await repository_users.confirmed_email(email, db)
-    return {"message": "Email confirmed"}
+    return {"message": "Your email is already confirmed"}
 
 
 @router.post("/request_email")
@@ -179,7 +313,8 @@ async def request_email(
     body: RequestEmail,
     background_tasks: BackgroundTasks,
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
+    limiter: SlidingWindowLimiter = Depends(get_rate_limiter),
 ):
     """
     The request_email function is used to request a confirmation email.
@@ -187,10 +322,12 @@ async def request_email(
     :param body: RequestEmail: Get the email from the request body
     :param background_tasks: BackgroundTasks: Add a task to the background tasks queue
     :param request: Request: Get the base url of the application
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
+    :param limiter: SlidingWindowLimiter: Limit the requests per client IP and email
     :return: A message to the user
     :doc-author: Trelent
     """
+    await limiter.hit("request_email", request, body.email)
     user = await repository_users.get_user_by_email(body.email, db)
 
     if user:
@@ -1,4 +1,5 @@
-from typing import List
+import io
+from typing import List, Literal
 
 import cloudinary
 import cloudinary.uploader
@@ -12,14 +13,19 @@ from fastapi import (
     File,
     UploadFile,
 )
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
+from src.database.db import get_db, get_read_db
 from src.database.models import Users, Role
-from src.schemas import UserDb, UserModel, UserEmailModel
+from src.schemas import UserDb, UserModel, UserEmailModel, UsersPage, ImportReport
 from src.repository import users as repository_users
-from src.services.auth import auth_service
+from src.services.auth import Principal, auth_service
 from src.services.roles import RoleAccess
+from src.services.cursor import encode_cursor, decode_cursor
+from src.services.export import export_lines, EXPORT_FORMATS
+from src.services import bulk_import
+from src.services.bulk_import import read_rows
 from src.conf.config import settings
 
 # from src.services.cloud_image import CloudImage
@@ -30,26 +36,37 @@ allowed_operation_get = RoleAccess([Role.admin, Role.moderator, Role.user])
 # allowed_operation_create = RoleAccess([Role.admin, Role.moderator])
 allowed_operation_update = RoleAccess([Role.admin, Role.moderator, Role.user])
 allowed_operation_remove = RoleAccess([Role.admin])
+allowed_operation_export = RoleAccess([Role.admin])
+allowed_operation_import = RoleAccess([Role.admin])
 
 
 @router.get(
     "/",
-    response_model=List[UserDb],
+    response_model=UsersPage,
 )
 async def get_users(
-    db: Session = Depends(get_db),
-    curent_user: Users = Depends(auth_service.get_current_user),
+    limit: int = Query(default=50, ge=1, le=100),
+    cursor: str | None = Query(
+        default=None, description="next_cursor of the previous page"
+    ),
+    db: AsyncSession = Depends(get_read_db),
+    principal: Principal = Depends(auth_service.get_principal),
 ):
     """
-    The get_users function returns a list of users.
-
-    :param db: Session: Pass the database connection to the function
-    :param curent_user: Users: Get the current user from the database
-    :return: A list of users
+    The get_users function returns a page of users ordered by id.
+    The next_cursor of the response is passed as cursor to get the next page;
+    it is None on the last page.
+
+    :param limit: int: The number of users on a page
+    :param cursor: str | None: The cursor of the page, the first page if None
+    :param db: AsyncSession: Pass the database connection to the function
+    :param principal: Principal: The authenticated caller
+    :return: A page of users and the cursor of the next page
     :doc-author: Trelent
     """
-    users = await repository_users.get_users(db)
-    return users
+    users = await repository_users.get_users(db, limit + 1, decode_cursor(cursor))
+    next_cursor = encode_cursor(users[limit - 1].id) if len(users) > limit else None
+    return {"items": users[:limit], "next_cursor": next_cursor}
 
 
 @router.get(
@@ -59,16 +76,14 @@ async def get_users(
 )
 async def get_user(
     user_id: int = Path(ge=1),
-    db: Session = Depends(get_db),
-    curent_user: Users = Depends(auth_service.get_current_user),
+    db: AsyncSession = Depends(get_read_db),
 ):
     """
     The get_user function returns a user object with the given id.
     If the user does not exist, it raises an HTTP 404 error.
 
     :param user_id: int: Specify the user_id that is passed in as a path parameter
-    :param db: Session: Get the database session
-    :param curent_user: Users: Get the current user
+    :param db: AsyncSession: Get the database session
     :return: The user object if it exists, otherwise raises an httpexception
     :doc-author: Trelent
     """
@@ -86,15 +101,15 @@ async def get_user(
 )
 async def create_user(
     body: UserModel,
-    db: Session = Depends(get_db),
-    curent_user: Users = Depends(auth_service.get_current_user),
+    db: AsyncSession = Depends(get_db),
+    principal: Principal = Depends(auth_service.get_principal),
 ):
     """
     The create_user function creates a new user in the database.
 
     :param body: UserModel: Get the data from the request body
-    :param db: Session: Pass the database session to the function
-    :param curent_user: Users: Get the current user from the database
+    :param db: AsyncSession: Pass the database session to the function
+    :param principal: Principal: The authenticated caller
     :return: A user object
     :doc-author: Trelent
     """
@@ -111,8 +126,8 @@ async def create_user(
 async def update_user(
     body: UserModel,
     user_id: int = Path(ge=1),
-    db: Session = Depends(get_db),
-    curent_user: Users = Depends(auth_service.get_current_user),
+    db: AsyncSession = Depends(get_db),
+    principal: Principal = Depends(auth_service.get_principal),
 ):
     """
     The update_user function updates a user in the database.
@@ -121,8 +136,8 @@ async def update_user(
 
     :param body: UserModel: Get the data from the request body
     :param user_id: int: Specify the path parameter
-    :param db: Session: Pass the database session to the function
-    :param curent_user: Users: Get the current user
+    :param db: AsyncSession: Pass the database session to the function
+    :param principal: Principal: The authenticated caller
     :return: The updated user
     :doc-author: Trelent
     """
@@ -141,8 +156,8 @@ async def update_user(
 async def update_user_email(
     body: UserEmailModel,
     user_id: int = Path(ge=1),
-    db: Session = Depends(get_db),
-    curent_user: Users = Depends(auth_service.get_current_user),
+    db: AsyncSession = Depends(get_db),
+    principal: Principal = Depends(auth_service.get_principal),
 ):
     """
     The update_user_email function updates the user's email.
@@ -152,8 +167,8 @@ async def update_user_email(
 
     :param body: UserEmailModel: Pass the useremailmodel object to the update_user_email function
     :param user_id: int: Get the user_id from the url
-    :param db: Session: Get the database session
-    :param curent_user: Users: Get the current user from the database
+    :param db: AsyncSession: Get the database session
+    :param principal: Principal: The authenticated caller
     :return: A usermodel object
     :doc-author: Trelent
     """
@@ -171,18 +186,16 @@ async def update_user_email(
 )
 async def remove_user(
     user_id: int = Path(ge=1),
-    db: Session = Depends(get_db),
-    curent_user: Users = Depends(auth_service.get_current_user),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     The remove_user function removes a user from the database.
         Args:
             user_id (int): The id of the user to remove.
-            db (Session, optional): An open DB session. Defaults to Depends(get_db).
+            db (AsyncSession, optional): An open DB session. Defaults to Depends(get_db).
 
     :param user_id: int: Get the user_id from the url
-    :param db: Session: Pass the database connection to the function
-    :param curent_user: Users: Get the current user
+    :param db: AsyncSession: Pass the database connection to the function
     :return: The removed user
     :doc-author: Trelent
     """
@@ -205,8 +218,7 @@ async def search_user(
         le=100,
         ge=10,
     ),
-    db: Session = Depends(get_db),
-    curent_user: Users = Depends(auth_service.get_current_user),
+    db: AsyncSession = Depends(get_read_db),
 ):
     """
     The search_user function allows you to search for users by name, last name or email.
@@ -219,12 +231,11 @@ async def search_user(
     :param le: Limit the number of results returned by the search_user function
     :param ge: Set a minimum value for the limit parameter
     :param ): Define the number of results to return
-    :param db: Session: Get the database session
-    :param curent_user: Users: Get the current user
+    :param db: AsyncSession: Get the database session
     :return: A list of users
     :doc-author: Trelent
     """
-    users = await repository_users.search_user(db, q, skip, limit)
+    users = await repository_users.search_user(q, skip, limit, db)
     if users is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
     return users
@@ -236,15 +247,14 @@ async def search_user(
     dependencies=[Depends(allowed_operation_get)],
 )
 async def birthday_users(
-    days: int = Query(default=7, description="Enter the number of days"),
+    days: int = Query(default=7, ge=0, le=366, description="Enter the number of days"),
     skip: int = 0,
     limit: int = Query(
         default=10,
         le=100,
         ge=10,
     ),
-    db: Session = Depends(get_db),
-    curent_user: Users = Depends(auth_service.get_current_user),
+    db: AsyncSession = Depends(get_read_db),
 ):
     """
     The birthday_users function returns a list of users who have birthdays in the next 7 days.
@@ -255,17 +265,72 @@ async def birthday_users(
     :param limit: int: Limit the number of results returned
     :param le: Limit the number of records returned to 100
     :param ge: Set the minimum value for the limit parameter
-    :param db: Session: Get the database session
-    :param curent_user: Users: Get the current user from the database
+    :param db: AsyncSession: Get the database session
     :return: A list of users that have a birthday in the next 7 days
     :doc-author: Trelent
     """
-    birthday_users = await repository_users.birthdays_per_week(db, days, skip, limit)
+    birthday_users = await repository_users.birthdays_per_week(days, skip, limit, db)
     if birthday_users is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
     return birthday_users
 
 
+@router.get(
+    "/export/",
+    response_class=StreamingResponse,
+    dependencies=[Depends(allowed_operation_export)],
+    description="Only admin",
+)
+async def export_users(
+    export_format: Literal["ndjson", "csv"] = Query(default="ndjson", alias="format"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    The export_users function streams the whole users table as NDJSON or CSV.
+    Rows are read through a server-side cursor and sent batch by batch,
+    so memory use stays flat and the first bytes go out right away.
+
+    :param export_format: Literal["ndjson", "csv"]: The format of the export
+    :param db: AsyncSession: Get the database session
+    :return: A StreamingResponse with the users
+    :doc-author: Trelent
+    """
+    batches = repository_users.stream_users(db)
+    return StreamingResponse(
+        export_lines(export_format, batches),
+        media_type=EXPORT_FORMATS[export_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="users.{export_format}"'
+        },
+    )
+
+
+@router.post(
+    "/import/",
+    response_model=ImportReport,
+    dependencies=[Depends(allowed_operation_import)],
+    description="Only admin",
+)
+async def import_users(
+    file: UploadFile = File(),
+    import_format: Literal["csv", "ndjson"] = Query(default="csv", alias="format"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    The import_users function creates users from an uploaded CSV or NDJSON file.
+    Every row is validated on its own; the response counts the imported and failed
+    rows and lists the errors with their row numbers.
+
+    :param file: UploadFile: The CSV or NDJSON file with one user per row
+    :param import_format: Literal["csv", "ndjson"]: The format of the file
+    :param db: AsyncSession: Get the database session
+    :return: An ImportReport object
+    :doc-author: Trelent
+    """
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    return await bulk_import.import_users(read_rows(stream, import_format), db)
+
+
 @router.get(
     "/me/",
     response_model=UserDb,
@@ -289,7 +354,7 @@ async def read_users_me(current_user: Users = Depends(auth_service.get_current_u
 # async def update_avatar_user(
 #     file: UploadFile = File(),
 #     current_user: Users = Depends(auth_service.get_current_user),
-#     db: Session = Depends(get_db),
+#     db: AsyncSession = Depends(get_db),
 # ):
 #     public_id = CloudImage.generate_name_avatar(current_user.email)
 #     r = CloudImage.upload(file.file, public_id)
@@ -302,7 +367,7 @@ async def read_users_me(current_user: Users = Depends(auth_service.get_current_u
 async def update_avatar_user(
     file: UploadFile = File(),
     current_user: Users = Depends(auth_service.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     The update_avatar_user function updates the avatar of a user.
@@ -311,7 +376,7 @@ async def update_avatar_user(
 
     :param file: UploadFile: Upload the file to cloudinary
     :param current_user: Users: Get the current user that is logged in
-    :param db: Session: Pass the database session to the repository layer
+    :param db: AsyncSession: Pass the database session to the repository layer
     :return: The user object
     :doc-author: Trelent
     """
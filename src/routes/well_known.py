@@ -0,0 +1,35 @@
+import hashlib
+import json
+
+from fastapi import APIRouter, Request, Response, status
+
+from src.conf.config import settings
+from src.services.auth import auth_service
+
+router = APIRouter(prefix="/.well-known", tags=["well-known"])
+
+JWKS_BODY = json.dumps(auth_service.keyring.jwks(), separators=(",", ":")).encode()
+JWKS_ETAG = f'"{hashlib.sha256(JWKS_BODY).hexdigest()[:16]}"'
+
+
+@router.get("/jwks.json")
+async def jwks(request: Request):
+    """
+    The jwks function publishes the public keys that verify the tokens of the app
+    as a JWK Set, so other services verify tokens without calling the app.
+    The body is built once per process; clients and proxies may cache it for
+    jwks_max_age seconds and revalidate it with its ETag. After a key rotation
+    they pick up the new key when their copy expires, so a new key should be
+    added jwks_max_age seconds before it becomes the active one.
+
+    :param request: Request: Get the If-None-Match header
+    :return: The JWK Set
+    :doc-author: Trelent
+    """
+    headers = {
+        "Cache-Control": f"public, max-age={settings.jwks_max_age}",
+        "ETag": JWKS_ETAG,
+    }
+    if request.headers.get("If-None-Match") == JWKS_ETAG:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(JWKS_BODY, media_type="application/json", headers=headers)
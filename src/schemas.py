@@ -1,6 +1,7 @@
 from datetime import date, datetime
+from typing import List
 
-from pydantic import BaseModel, EmailStr, Field, ConfigDict
+from pydantic import BaseModel, EmailStr, Field, ConfigDict, model_validator
 from src.database.models import Role
 
 
@@ -15,6 +16,18 @@ class UserModel(BaseModel):
     description: str | None = Field(default="", max_length=250)
 
 
+class UserImportModel(UserModel):
+    password: str | None = Field(default=None, min_length=6, max_length=8)
+    password_hash: str | None = Field(default=None, pattern=r"^\$2[aby]?\$\d{2}\$")
+    born_date: date | None = None
+
+    @model_validator(mode="after")
+    def check_password(self) -> "UserImportModel":
+        if (self.password is None) == (self.password_hash is None):
+            raise ValueError("Exactly one of password and password_hash is required")
+        return self
+
+
 class UserDb(BaseModel):
     id: int
     first_name: str | None
@@ -33,6 +46,11 @@ class UserDb(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class UsersPage(BaseModel):
+    items: List[UserDb]
+    next_cursor: str | None = None
+
+
 class UserResponse(BaseModel):
     user: UserDb
     detail: str = "User successfully created"
@@ -50,3 +68,110 @@ class TokenModel(BaseModel):
 
 class RequestEmail(BaseModel):
     email: EmailStr
+
+
+class RevokeTokenModel(BaseModel):
+    token: str
+
+
+class PoolStatus(BaseModel):
+    name: str
+    pool_class: str
+    size: int | None
+    checked_out: int | None
+    idle: int | None
+    overflow: int | None
+    checkouts: int
+    timeouts: int
+    wait_total_ms: float
+    wait_avg_ms: float
+    wait_max_ms: float
+
+
+class HashPoolStatus(BaseModel):
+    workers: int
+    queue_size: int
+    in_flight: int
+    queued: int
+    completed: int
+    rejected: int
+    wait_avg_ms: float
+    wait_max_ms: float
+    hash_avg_ms: float
+    hash_max_ms: float
+
+
+class TokenCacheStatus(BaseModel):
+    size: int
+    maxsize: int
+    hits: int
+    misses: int
+    hit_ratio: float
+    evictions: int
+    expired: int
+
+
+class LocalCacheStatus(BaseModel):
+    size: int
+    maxsize: int
+    hits: int
+    misses: int
+    evictions: int
+    expired: int
+
+
+class RedisCacheStatus(BaseModel):
+    hits: int
+    misses: int
+    errors: int
+    invalidations_sent: int
+    invalidations_received: int
+    stale_fills: int
+    stale_writes: int
+
+
+class UserLoadStatus(BaseModel):
+    in_flight: int
+    calls: int
+    coalesced: int
+    lock_waits: int
+    lock_wait_hits: int
+    early_refreshes: int
+    refresh_errors: int
+    load_time_ms: float
+
+
+class BloomFilterStatus(BaseModel):
+    capacity: int
+    count: int
+    size_bits: int
+    hashes: int
+
+
+class RevocationStatus(BaseModel):
+    bloom: BloomFilterStatus
+    checks: int
+    bloom_hits: int
+    false_positives: int
+    revoked: int
+    rebuilds: int
+    redis_errors: int
+
+
+class UserCacheStatus(BaseModel):
+    local: LocalCacheStatus
+    redis: RedisCacheStatus
+    loads: UserLoadStatus
+
+
+class ImportRowError(BaseModel):
+    row: int
+    email: str | None = None
+    detail: str
+
+
+class ImportReport(BaseModel):
+    total: int = 0
+    imported: int = 0
+    failed: int = 0
+    errors: List[ImportRowError] = []
@@ -1,26 +1,87 @@
-import pickle
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
 
 from fastapi import Depends, HTTPException, status
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer
-import redis
-from sqlalchemy.orm import Session
-from jose import JWTError, jwt
+from sqlalchemy.ext.asyncio import AsyncSession
+from jose import JWTError
 
 
-from src.database.db import get_db
+from src.database.db import DBSession, get_db, session_scope
+from src.database.models import Users, Role
 from src.repository import users as repository_users
 from src.conf.config import settings
+from src.services.hashing import hash_pool
+from src.services.keyring import KeyRing
+from src.services.refresh_tokens import new_token_id
+from src.services.revocation import token_denylist
+from src.services.token_cache import TokenCache
+from src.services.user_cache import CachedUser, user_cache
+
+
+@dataclass(slots=True)
+class Principal:
+    """
+    Who an access token was issued to: the email, role and confirmed flag of the
+    user, the token version of the user at that time and the user id.
+    """
+
+    email: str
+    roles: Role
+    confirmed: bool | None
+    version: int | None
+    id: int | None = None
+
+    @classmethod
+    def from_claims(cls, claims: dict) -> "Principal":
+        return cls(
+            claims["sub"],
+            Role(claims["role"]),
+            claims["confirmed"],
+            claims["ver"],
+            claims.get("uid"),
+        )
+
+    @classmethod
+    def from_user(cls, user: Users | CachedUser) -> "Principal":
+        return cls(user.email, user.roles, user.confirmed, user.token_version, user.id)
 
 
 class Auth:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-    SECRET_KEY = settings.secret_key
-    ALGORITHM = settings.algorithm
+    pwd_context = CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__rounds=settings.bcrypt_rounds,
+        bcrypt__min_rounds=settings.bcrypt_rounds,
+        bcrypt__max_rounds=settings.bcrypt_rounds,
+    )
+    keyring = KeyRing.load(
+        settings.algorithm,
+        settings.secret_key,
+        settings.jwt_keys_dir,
+        settings.jwt_active_kid,
+    )
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
-    r = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0)
+    token_cache = TokenCache(settings.token_cache_size)
+
+    def _decode(self, token: str) -> dict:
+        """
+        The _decode function verifies a JWT and returns its claims.
+        The claims of verified tokens are kept in the token cache until the tokens
+        expire, so a token is only verified on its first use in this process.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded JWT
+        :return: The claims of the token
+        :doc-author: Trelent
+        """
+        claims = self.token_cache.get(token)
+        if claims is None:
+            claims = self.keyring.verify(token)
+            self.token_cache.set(token, claims)
+        return claims
 
     def verify_password(self, plain_password, hashed_password):
         """
@@ -48,12 +109,57 @@ class Auth:
         """
         return self.pwd_context.hash(password)
 
+    async def verify_password_async(self, plain_password, hashed_password):
+        """
+        The verify_password_async function checks a password like verify_password,
+        but runs bcrypt in the hash pool, so the event loop keeps serving other
+        requests meanwhile. It raises 503 when the pool is saturated.
+
+        :param self: Represent the instance of the class
+        :param plain_password: Verify the password that is entered by the user
+        :param hashed_password: Compare the plain_password parameter to see if they match
+        :return: A boolean value
+        :doc-author: Trelent
+        """
+        return await hash_pool.run(
+            self.verify_password, plain_password, hashed_password
+        )
+
+    async def verify_and_update_async(self, plain_password, hashed_password):
+        """
+        The verify_and_update_async function checks a password in the hash pool and,
+        when it matches a hash made with another bcrypt cost than the bcrypt_rounds
+        setting, also returns a new hash of it. Both happen in one pool call, so a
+        hash that is up to date costs a single bcrypt run.
+
+        :param self: Represent the instance of the class
+        :param plain_password: Verify the password that is entered by the user
+        :param hashed_password: The stored hash of the password
+        :return: A tuple of a boolean value and the new hash, or None if no update is needed
+        :doc-author: Trelent
+        """
+        return await hash_pool.run(
+            self.pwd_context.verify_and_update, plain_password, hashed_password
+        )
+
+    async def get_password_hash_async(self, password: str):
+        """
+        The get_password_hash_async function hashes a password like get_password_hash,
+        but runs bcrypt in the hash pool. It raises 503 when the pool is saturated.
+
+        :param self: Represent the instance of the class
+        :param password: str: Get the password from the user
+        :return: A hash of the password
+        :doc-author: Trelent
+        """
+        return await hash_pool.run(self.get_password_hash, password)
+
     async def create_access_token(
         self, data: dict, expires_delta: Optional[float] = None
     ):
         """
         The create_access_token function creates a new access token.
-
+        Every token gets a unique jti claim, by which it can be revoked.
 
         :param self: Make the function a method of the class
         :param data: dict: Pass the data that is to be encoded into the token
@@ -67,11 +173,14 @@ class Auth:
         else:
             expire = datetime.utcnow() + timedelta(minutes=20)
         to_encode.update(
-            {"iat": datetime.utcnow(), "exp": expire, "scope": "access_token"}
-        )
-        encoded_access_token = jwt.encode(
-            to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM
+            {
+                "iat": datetime.utcnow(),
+                "exp": expire,
+                "scope": "access_token",
+                "jti": new_token_id(),
+            }
         )
+        encoded_access_token = self.keyring.sign(to_encode)
         return encoded_access_token
 
     async def create_refresh_token(
@@ -80,7 +189,7 @@ class Auth:
         """
         The create_refresh_token function creates a refresh token for the user.
             The function takes in three parameters: self, data, and expires_delta.
-            The self parameter is used to access the SECRET_KEY and ALGORITHM variables from the OAuth2PasswordBearer class.
+            The self parameter is used to access the keyring that signs the token.
             The data parameter is a dictionary containing information about the user that will be encoded into JSON Web Token format (JWT).  This includes their username, email address, password hash (hashed using bcrypt), and scope of authorization (&quot;refresh_token&quot;).  It also contains two datetime objects: iat (issued at)
 
         :param self: Represent the instance of the class
@@ -93,34 +202,29 @@ class Auth:
         if expires_delta:
             expire = datetime.utcnow() + timedelta(seconds=expires_delta)
         else:
-            expire = datetime.utcnow() + timedelta(days=7)
+            expire = datetime.utcnow() + timedelta(seconds=settings.refresh_token_ttl)
         to_encode.update(
             {"iat": datetime.utcnow(), "exp": expire, "scope": "refresh_token"}
         )
-        encoded_refresh_token = jwt.encode(
-            to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM
-        )
+        encoded_refresh_token = self.keyring.sign(to_encode)
         return encoded_refresh_token
 
     async def decode_refresh_token(self, refresh_token: str):
         """
         The decode_refresh_token function is used to decode the refresh token.
-            The function takes in a refresh_token as an argument and returns the email of the user if successful.
+            The function takes in a refresh_token as an argument and returns its claims if successful:
+            the email of the user (sub), and the token family (fam) and id (jti) checked by the refresh token store.
             If there is an error, it raises a HTTPException with status code 401 (Unauthorized) and detail message &quot;Invalid scope for token&quot; or &quot;Could not validate credentials&quot;.
 
         :param self: Represent the instance of the class
         :param refresh_token: str: Pass in the refresh token that is being decoded
-        :return: A payload with the following information:
+        :return: A payload with the following information: sub, fam, jti
         :doc-author: Trelent
         """
         try:
-            print(refresh_token)
-            payload = jwt.decode(
-                refresh_token, self.SECRET_KEY, algorithms=[self.ALGORITHM]
-            )
+            payload = self._decode(refresh_token)
             if payload["scope"] == "refresh_token":
-                email = payload["sub"]
-                return email
+                return payload
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid scope for token",
@@ -132,51 +236,170 @@ class Auth:
                 detail="Could not validate credentials",
             )
 
+    @staticmethod
+    def access_claims(user: Users) -> dict:
+        """
+        The access_claims function returns the claims of an access token for a user:
+        its email, and the id, role, confirmed flag and token version that let
+        get_principal authorize requests without loading the user.
+
+        :param user: Users: The user the token is issued to
+        :return: The claims to pass to create_access_token
+        :doc-author: Trelent
+        """
+        return {
+            "sub": user.email,
+            "uid": user.id,
+            "role": user.roles.value,
+            "confirmed": bool(user.confirmed),
+            "ver": user.token_version,
+        }
+
+    @staticmethod
+    def credentials_error() -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    def decode_token(self, token: str) -> dict | None:
+        """
+        The decode_token function returns the claims of a valid token of any scope.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded JWT
+        :return: The claims of the token, or None if it is invalid or expired
+        :doc-author: Trelent
+        """
+        try:
+            return self._decode(token)
+        except JWTError:
+            return None
+
+    async def access_token_claims(self, token: str) -> dict:
+        """
+        The access_token_claims function verifies an access token and returns
+        its claims. It raises 401 for invalid, revoked and expired tokens and for
+        tokens of another scope. Checking that a token is not revoked costs no
+        network round trip, see src.services.revocation.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded JWT
+        :return: The claims of the token
+        :doc-author: Trelent
+        """
+        try:
+            payload = self._decode(token)
+        except JWTError:
+            raise self.credentials_error()
+        if payload.get("scope") != "access_token" or payload.get("sub") is None:
+            raise self.credentials_error()
+        if await token_denylist.is_revoked(payload.get("jti")):
+            raise self.credentials_error()
+        return payload
+
+    async def revoke_access_token(self, payload: dict) -> None:
+        """
+        The revoke_access_token function revokes an access token until it expires.
+
+        :param self: Represent the instance of the class
+        :param payload: dict: The claims of the token
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        if payload.get("jti") is not None:
+            await token_denylist.revoke(payload["jti"], payload["exp"])
+
     async def get_current_user(
-        self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
-    ):
+        self, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
+    ) -> CachedUser:
         """
         The get_current_user function is a dependency that will be used in the
             protected routes. It takes an OAuth2 token as input and returns the user
             associated with that token. If no user is found, it raises an exception.
+            The user is cached in the process and in Redis, see src.services.user_cache.
+            Cached users close to their expiry are refreshed in the background,
+            with a session of their own. Tokens issued before a change of the
+            token version of the user are rejected.
 
         :param self: Access the class attributes
         :param token: str: Get the token from the authorization header
-        :param db: Session: Pass the database connection to the function
-        :return: The user object that corresponds to the email in the token
+        :param db: AsyncSession: Pass the database connection to the function
+        :return: The CachedUser that corresponds to the email in the token
         :doc-author: Trelent
         """
-        credentials_exception = HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+        return await self._current_user(await self.access_token_claims(token), db)
 
-        try:
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            if payload["scope"] == "access_token":
-                email = payload["sub"]
-                if email is None:
-                    raise credentials_exception
-            else:
-                raise credentials_exception
-        except JWTError as e:
-            raise credentials_exception
+    async def _current_user(self, payload: dict, db: AsyncSession) -> CachedUser:
+        email = payload["sub"]
 
-        # user = await repository_users.get_user_by_email(email, db)
-        user = self.r.get(f"user:{email}")
-        if user is None:
-            user = await repository_users.get_user_by_email(email, db)
-            if user is None:
-                raise credentials_exception
-            self.r.set(f"user:{email}", pickle.dumps(user))
-            self.r.expire(f"user:{email}", 900)
-        else:
-            user = pickle.loads(user)
+        async def load_user():
+            db_user = await repository_users.get_user_by_email(email, db)
+            return CachedUser.from_user(db_user) if db_user is not None else None
+
+        async def refresh_user():
+            async with session_scope(DBSession) as refresh_db:
+                db_user = await repository_users.get_user_by_email(email, refresh_db)
+            return CachedUser.from_user(db_user) if db_user is not None else None
+
+        user = await user_cache.get_or_load(email, load_user, refresh_user)
         if user is None:
-            raise credentials_exception
+            raise self.credentials_error()
+        if payload.get("ver", user.token_version) != user.token_version:
+            raise self.credentials_error()
         return user
 
+    async def get_principal(
+        self, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
+    ) -> Principal:
+        """
+        The get_principal function is a dependency for routes that only need to know
+            who makes the request, such as role checks. With the auth_claims_only
+            setting it is read from the verified claims of the access token, without
+            a cache or database lookup; a changed role or a bumped token version
+            then takes effect when the access token expires. Otherwise, and for
+            tokens issued without these claims, it comes from get_current_user.
+
+        :param self: Access the class attributes
+        :param token: str: Get the token from the authorization header
+        :param db: AsyncSession: Pass the database connection to the function
+        :return: The Principal of the token
+        :doc-author: Trelent
+        """
+        payload = await self.access_token_claims(token)
+        if settings.auth_claims_only and "role" in payload:
+            try:
+                return Principal.from_claims(payload)
+            except (KeyError, ValueError):
+                raise self.credentials_error()
+        return Principal.from_user(await self._current_user(payload, db))
+
+    async def get_token_principal(
+        self, token: str = Depends(oauth2_scheme)
+    ) -> Principal:
+        """
+        The get_token_principal function is a dependency like get_principal for
+            checks that must stay off the database and Redis, such as the
+            auth_request of a reverse proxy. Tokens issued with the id and role
+            claims are answered from their verified claims, which the token cache
+            and the revocation filter keep in the process, whatever the
+            auth_claims_only setting. Only older tokens load the user.
+
+        :param self: Access the class attributes
+        :param token: str: Get the token from the authorization header
+        :return: The Principal of the token
+        :doc-author: Trelent
+        """
+        payload = await self.access_token_claims(token)
+        if "uid" in payload and "role" in payload:
+            try:
+                return Principal.from_claims(payload)
+            except (KeyError, ValueError):
+                raise self.credentials_error()
+        async with session_scope(DBSession) as db:
+            return Principal.from_user(await self._current_user(payload, db))
+
     def create_email_token(self, data: dict):
         """
         The create_email_token function creates a token that is used to verify the user's email address.
@@ -193,7 +416,7 @@ class Auth:
         to_encode.update(
             {"iat": datetime.utcnow(), "exp": expire, "scope": "email_token"}
         )
-        token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        token = self.keyring.sign(to_encode)
         return token
 
     def get_email_from_token(self, token: str):
@@ -207,7 +430,7 @@ class Auth:
         :doc-author: Trelent
         """
         try:
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            payload = self._decode(token)
             if payload["scope"] == "email_token":
                 email = payload["sub"]
                 return email
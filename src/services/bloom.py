@@ -0,0 +1,51 @@
+import hashlib
+import math
+
+
+class BloomFilter:
+    """
+    A Bloom filter of strings: membership tests with no false negatives and
+    a false positive rate of about error_rate while it holds up to capacity
+    items. A test hashes the item once and reads hashes bits, whatever the
+    number of items.
+    """
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.capacity = capacity
+        self.size = max(
+            8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        # double hashing: h1 + i * h2 gives the hashes bit positions of the item
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str) -> None:
+        added = False
+        for position in self._positions(item):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                self.bits[position >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+    def as_dict(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "count": self.count,
+            "size_bits": self.size,
+            "hashes": self.hashes,
+        }
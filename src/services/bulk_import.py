@@ -0,0 +1,258 @@
+import argparse
+import asyncio
+import csv
+import json
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+from libgravatar import Gravatar
+from pydantic import ValidationError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import iterate_in_threadpool
+
+from src.conf.config import settings
+from src.database.db import DBSession
+from src.database.models import Users, Role, ADMIN_EMAIL, birth_month_day
+from src.schemas import UserImportModel, ImportReport, ImportRowError
+from src.services.auth import auth_service
+
+MAX_REPORTED_ERRORS = 1000
+
+INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def read_rows(stream, import_format: str):
+    """
+    The read_rows function reads the raw rows of an import file one by one.
+    CSV rows are returned as dictionaries with empty cells set to None,
+    NDJSON rows as the text of the line; they are parsed by parse_row.
+
+    :param stream: A text stream of the import file
+    :param import_format: str: csv or ndjson
+    :return: A generator of raw rows
+    :doc-author: Trelent
+    """
+    if import_format == "csv":
+        for row in csv.DictReader(stream):
+            yield {key: value if value != "" else None for key, value in row.items()}
+    else:
+        for line in stream:
+            if line.strip():
+                yield line
+
+
+def parse_row(raw) -> UserImportModel:
+    """
+    The parse_row function validates a raw import row with the UserImportModel schema.
+
+    :param raw: A dictionary, or the JSON text of an NDJSON line
+    :return: The validated user
+    :doc-author: Trelent
+    """
+    if isinstance(raw, str):
+        raw = json.loads(raw)
+    return UserImportModel.model_validate(raw)
+
+
+def error_detail(err: ValueError) -> str:
+    if isinstance(err, ValidationError):
+        return "; ".join(
+            f"{'.'.join(map(str, error['loc'])) or 'row'}: {error['msg']}"
+            for error in err.errors()
+        )
+    return str(err)
+
+
+def add_error(report: ImportReport, row: int, email: str | None, detail: str) -> None:
+    report.failed += 1
+    if len(report.errors) < MAX_REPORTED_ERRORS:
+        report.errors.append(ImportRowError(row=row, email=email, detail=detail))
+
+
+def user_values(user: UserImportModel, password_hash: str) -> dict:
+    """
+    The user_values function builds the column values of an imported user.
+    The bulk insert bypasses the ORM events of the Users model,
+    so the avatar, born_md and role are set here.
+
+    :param user: UserImportModel: The validated user
+    :param password_hash: str: The bcrypt hash of the user's password
+    :return: A dictionary of column values
+    :doc-author: Trelent
+    """
+    values = user.model_dump(exclude={"password", "password_hash"})
+    values.update(
+        password=password_hash,
+        avatar=Gravatar(user.email).get_image(),
+        born_md=birth_month_day(user.born_date),
+        roles=Role.admin if user.email == ADMIN_EMAIL else Role.user,
+    )
+    return values
+
+
+_executor = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """
+    The get_executor function returns the pool of worker processes that prepare
+    import batches. It is created on first use and reused by later imports.
+
+    :return: A ProcessPoolExecutor
+    :doc-author: Trelent
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            settings.bulk_import_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def shutdown_executor() -> None:
+    """
+    The shutdown_executor function stops the worker processes of the import pool,
+    if it was created, and cancels the batches still waiting for them.
+
+    :return: Nothing
+    :doc-author: Trelent
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+def prepare_batch(batch: list) -> tuple[list, list]:
+    """
+    The prepare_batch function does the CPU-bound part of an import batch:
+    it validates the rows, hashes the passwords and builds the column values.
+    It runs in a worker process, so batches are prepared in parallel
+    and the event loop only waits for the results.
+
+    :param batch: list: A list of (row number, raw row) tuples
+    :return: A list of (row number, email, values) tuples and a list of row errors
+    :doc-author: Trelent
+    """
+    users = []
+    errors = []
+    for number, raw in batch:
+        try:
+            user = parse_row(raw)
+        except ValueError as err:
+            errors.append((number, None, error_detail(err)))
+            continue
+        password_hash = user.password_hash or auth_service.get_password_hash(
+            user.password
+        )
+        users.append((number, user.email, user_values(user, password_hash)))
+    return users, errors
+
+
+async def insert_batch(users: list, statement, db: AsyncSession, report) -> None:
+    rows = {}
+    for number, email, values in users:
+        if email in rows:
+            add_error(report, number, email, "Duplicate email in the import")
+        else:
+            rows[email] = (number, values)
+    if not rows:
+        return
+
+    result = await db.execute(statement, [values for _, values in rows.values()])
+    inserted = set(result.scalars().all())
+    await db.commit()
+    for email, (number, _) in rows.items():
+        if email in inserted:
+            report.imported += 1
+        else:
+            add_error(report, number, email, "Account already exists")
+
+
+async def import_users(
+    rows, db: AsyncSession, batch_size: int | None = None
+) -> ImportReport:
+    """
+    The import_users function inserts users from an iterable of raw rows.
+    The rows are read batch by batch in a worker thread, so reading the file does
+    not block the event loop. Batches of rows are validated with UserImportModel
+    and their passwords hashed in a pool of worker processes, while the event loop
+    writes the prepared batches with one multi-row INSERT ... ON CONFLICT DO NOTHING
+    each and commits them.
+    Rows with a password_hash column skip hashing.
+    Invalid rows and existing emails are reported per row and do not stop the import.
+
+    :param rows: An iterable of raw rows, see read_rows
+    :param db: AsyncSession: Pass the database session to the function
+    :param batch_size: int | None: The number of rows inserted by one statement
+    :return: An ImportReport with the counters and the row errors
+    :doc-author: Trelent
+    """
+    batch_size = batch_size or settings.bulk_import_batch_size
+    insert = INSERTS[db.get_bind().dialect.name]
+    statement = (
+        insert(Users)
+        .on_conflict_do_nothing(index_elements=[Users.email])
+        .returning(Users.email)
+    )
+    report = ImportReport()
+    loop = asyncio.get_running_loop()
+    numbered_rows = enumerate(rows, start=1)
+    batches = iterate_in_threadpool(
+        iter(lambda: list(islice(numbered_rows, batch_size)), [])
+    )
+    executor = get_executor()
+    pending = deque()
+    try:
+        while True:
+            while len(pending) < settings.bulk_import_workers * 2 and (
+                batch := await anext(batches, None)
+            ):
+                report.total += len(batch)
+                pending.append(loop.run_in_executor(executor, prepare_batch, batch))
+            if not pending:
+                break
+            users, errors = await pending.popleft()
+            for number, email, detail in errors:
+                add_error(report, number, email, detail)
+            await insert_batch(users, statement, db, report)
+    finally:
+        for future in pending:
+            future.cancel()
+    return report
+
+
+async def import_file(path: Path, import_format: str, batch_size: int | None):
+    db = DBSession()
+    try:
+        with open(path, newline="", encoding="utf-8-sig") as stream:
+            return await import_users(read_rows(stream, import_format), db, batch_size)
+    finally:
+        await db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import users from a CSV or NDJSON file"
+    )
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--format", choices=["csv", "ndjson"], dest="import_format")
+    parser.add_argument("--batch-size", type=int)
+    args = parser.parse_args()
+    import_format = args.import_format or (
+        "ndjson" if args.path.suffix in (".ndjson", ".jsonl") else "csv"
+    )
+    report = asyncio.run(import_file(args.path, import_format, args.batch_size))
+    print(report.model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import base64
+import binascii
+import json
+
+from fastapi import HTTPException, status
+
+
+def encode_cursor(last_id: int) -> str:
+    """
+    The encode_cursor function builds the opaque cursor of the next page
+    from the id of the last item on the current page.
+
+    :param last_id: int: The id of the last item returned
+    :return: A url-safe cursor string
+    :doc-author: Trelent
+    """
+    data = json.dumps({"id": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str | None) -> int:
+    """
+    The decode_cursor function returns the id a page starts after.
+    A missing cursor means the first page. If the cursor can not be decoded,
+    it raises an HTTPException with status code 400.
+
+    :param cursor: str | None: The cursor sent by the client
+    :return: The id of the last item of the previous page
+    :doc-author: Trelent
+    """
+    if not cursor:
+        return 0
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        last_id = json.loads(data)["id"]
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        last_id = None
+    if not isinstance(last_id, int):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+    return last_id
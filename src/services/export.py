@@ -0,0 +1,56 @@
+import csv
+import io
+from enum import Enum
+
+from src.schemas import UserDb
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+async def ndjson_lines(batches):
+    """
+    The ndjson_lines function turns batches of user rows into NDJSON chunks,
+    one JSON document per line and one chunk per batch.
+
+    :param batches: An async iterable of lists of rows
+    :return: An async generator of str chunks
+    :doc-author: Trelent
+    """
+    async for rows in batches:
+        yield "".join(
+            UserDb.model_validate(row).model_dump_json() + "\n" for row in rows
+        )
+
+
+async def csv_lines(batches):
+    """
+    The csv_lines function turns batches of user rows into CSV chunks.
+    The header line is sent first, before the first batch is read from the database.
+
+    :param batches: An async iterable of lists of rows
+    :return: An async generator of str chunks
+    :doc-author: Trelent
+    """
+    fields = list(UserDb.model_fields)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    yield buffer.getvalue()
+    async for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        for row in rows:
+            writer.writerow(
+                value.value if isinstance(value, Enum) else value
+                for value in (getattr(row, field) for field in fields)
+            )
+        yield buffer.getvalue()
+
+
+def export_lines(export_format: str, batches):
+    if export_format == "csv":
+        return csv_lines(batches)
+    return ndjson_lines(batches)
@@ -0,0 +1,170 @@
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+from passlib.hash import bcrypt
+
+from src.conf.config import settings
+
+
+class HashPool:
+    """
+    Runs the password hashing functions in a bounded pool of threads.
+    bcrypt releases the GIL while it hashes, so the threads run in parallel with
+    each other and with the event loop. At most workers + queue_size calls are
+    admitted at a time; the next ones are rejected with 503 instead of queueing.
+    """
+
+    def __init__(self, workers: int, queue_size: int) -> None:
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = None
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+        self.max_run = 0.0
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                self.workers, thread_name_prefix="password-hash"
+            )
+        return self._executor
+
+    async def run(self, func, *args):
+        """
+        The run function calls func(*args) in a worker thread and waits for the result
+        without blocking the event loop. The in_flight counter is only changed on the
+        event loop thread, so it needs no lock. A call stays in flight until its
+        thread is done, even if the request waiting for it is cancelled.
+
+        :param self: Represent the instance of the class
+        :param func: The blocking function, e.g. CryptContext.verify
+        :param args: The arguments of the function
+        :return: The result of the function
+        :doc-author: Trelent
+        """
+        if self.in_flight >= self.workers + self.queue_size:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, try again later",
+                headers={"Retry-After": "1"},
+            )
+
+        def call():
+            started = time.perf_counter()
+            result = func(*args)
+            return result, started, time.perf_counter()
+
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        submitted = time.perf_counter()
+        future = self.executor.submit(call)
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.release))
+        result, started, finished = await asyncio.wrap_future(future)
+        self.record(started - submitted, finished - started)
+        return result
+
+    def release(self) -> None:
+        self.in_flight -= 1
+
+    def record(self, wait: float, run: float) -> None:
+        self.completed += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.total_run += run
+        self.max_run = max(self.max_run, run)
+
+    def as_dict(self) -> dict:
+        completed = self.completed or 1
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "in_flight": self.in_flight,
+            "queued": max(self.in_flight - self.workers, 0),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait_avg_ms": self.total_wait * 1000 / completed,
+            "wait_max_ms": self.max_wait * 1000,
+            "hash_avg_ms": self.total_run * 1000 / completed,
+            "hash_max_ms": self.max_run * 1000,
+        }
+
+
+hash_pool = HashPool(settings.hash_workers, settings.hash_queue_size)
+
+
+MIN_BCRYPT_ROUNDS = 10
+MAX_BCRYPT_ROUNDS = 16
+
+
+def measure_bcrypt(rounds: int, samples: int = 3) -> float:
+    """
+    The measure_bcrypt function returns the median time of hashing a password
+    with the given bcrypt cost on this host.
+
+    :param rounds: int: The bcrypt cost factor, log2 of the number of iterations
+    :param samples: int: The number of hashes to time
+    :return: The median time in seconds
+    :doc-author: Trelent
+    """
+    hasher = bcrypt.using(rounds=rounds)
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        hasher.hash("calibration-password")
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def calibrate_bcrypt(target_ms: float, samples: int = 3) -> tuple[int, float]:
+    """
+    The calibrate_bcrypt function picks the highest bcrypt cost whose hash time
+    on this host stays within target_ms. Every extra round doubles the work, so the
+    cost is extrapolated from a cheap measurement and then checked, stepping down
+    while the measured time is above the target. The cost never goes below
+    MIN_BCRYPT_ROUNDS.
+
+    :param target_ms: float: The wanted hash time in milliseconds
+    :param samples: int: The number of hashes timed per measurement
+    :return: The rounds and their measured hash time in milliseconds
+    :doc-author: Trelent
+    """
+    base_rounds = 8
+    base_ms = measure_bcrypt(base_rounds, samples) * 1000
+    rounds = base_rounds
+    while (
+        rounds < MAX_BCRYPT_ROUNDS
+        and base_ms * 2 ** (rounds + 1 - base_rounds) <= target_ms
+    ):
+        rounds += 1
+    rounds = max(rounds, MIN_BCRYPT_ROUNDS)
+    measured_ms = measure_bcrypt(rounds, samples) * 1000
+    while rounds > MIN_BCRYPT_ROUNDS and measured_ms > target_ms:
+        rounds -= 1
+        measured_ms = measure_bcrypt(rounds, samples) * 1000
+    return rounds, measured_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pick the bcrypt cost that hashes within a target time on this host"
+    )
+    parser.add_argument("--target-ms", type=float, default=250)
+    parser.add_argument("--samples", type=int, default=3)
+    args = parser.parse_args()
+    rounds, measured_ms = calibrate_bcrypt(args.target_ms, args.samples)
+    print(f"# {measured_ms:.0f} ms per hash, target {args.target_ms:.0f} ms")
+    print(f"BCRYPT_ROUNDS={rounds}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import argparse
+import base64
+import hashlib
+from pathlib import Path
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from jose import JWTError, jwk, jwt
+
+from src.conf.config import settings
+
+KEY_TYPES = {"RS": "RSA", "ES": "EC"}
+EC_CURVES = {"ES256": ec.SECP256R1, "ES384": ec.SECP384R1, "ES512": ec.SECP521R1}
+
+
+class KeyRing:
+    """
+    The keys that sign and verify the JWTs of the app. With an HS algorithm it is
+    the shared secret_key. With an RS or ES algorithm every key has a kid: tokens
+    are signed with the active key and carry its kid in their header, and tokens
+    signed with any key of the ring verify. To rotate, add a new key, make it
+    active, and remove the old key once the tokens it signed have expired. The
+    public keys are published as a JWK Set, so other services can verify the
+    tokens themselves.
+    """
+
+    def __init__(
+        self,
+        algorithm: str,
+        secret: str | None = None,
+        keys: dict[str, str] | None = None,
+        active_kid: str | None = None,
+    ) -> None:
+        self.algorithm = algorithm
+        self.symmetric = algorithm.startswith("HS")
+        self.verify_keys = {}
+        self.signing_key = None
+        self.active_kid = None
+        if self.symmetric:
+            self.signing_key = secret
+            return
+        if algorithm[:2] not in KEY_TYPES:
+            raise ValueError(f"Unsupported JWT algorithm {algorithm}")
+        keys = keys or {}
+        private_kids = [kid for kid, pem in keys.items() if "PRIVATE KEY" in pem]
+        if not active_kid and len(private_kids) == 1:
+            active_kid = private_kids[0]
+        if active_kid not in private_kids:
+            raise ValueError(f"No private key for the active kid {active_kid!r}")
+        for kid, pem in keys.items():
+            key = jwk.construct(pem, algorithm)
+            self.verify_keys[kid] = key.public_key() if kid in private_kids else key
+        self.signing_key = jwk.construct(keys[active_kid], algorithm)
+        self.active_kid = active_kid
+        self._jwks = {"keys": [self.public_jwk(kid) for kid in sorted(keys)]}
+
+    @classmethod
+    def load(
+        cls, algorithm: str, secret: str, keys_dir: str, active_kid: str
+    ) -> "KeyRing":
+        """
+        The load function builds the key ring of the settings. The keys of RS and
+        ES algorithms are the PEM files in keys_dir, named {kid}.pem; files with
+        only a public key verify the tokens of retired keys.
+
+        :param algorithm: str: The JWT algorithm, e.g. HS256, RS256 or ES256
+        :param secret: str: The shared secret of HS algorithms
+        :param keys_dir: str: The directory of the PEM files
+        :param active_kid: str: The kid of the signing key; may be empty if there is one private key
+        :return: The KeyRing
+        :doc-author: Trelent
+        """
+        if algorithm.startswith("HS"):
+            return cls(algorithm, secret=secret)
+        keys = {path.stem: path.read_text() for path in Path(keys_dir).glob("*.pem")}
+        return cls(algorithm, keys=keys, active_kid=active_kid)
+
+    def sign(self, claims: dict) -> str:
+        """
+        The sign function encodes and signs claims with the active key.
+
+        :param self: Represent the instance of the class
+        :param claims: dict: The claims of the token
+        :return: The encoded JWT
+        :doc-author: Trelent
+        """
+        headers = {"kid": self.active_kid} if self.active_kid else None
+        return jwt.encode(
+            claims, self.signing_key, algorithm=self.algorithm, headers=headers
+        )
+
+    def verify(self, token: str) -> dict:
+        """
+        The verify function checks the signature and the expiry of a token
+        with the key named by its kid and returns its claims.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded JWT
+        :return: The claims of the token
+        :doc-author: Trelent
+        """
+        if self.symmetric:
+            key = self.signing_key
+        else:
+            key = self.verify_keys.get(jwt.get_unverified_header(token).get("kid"))
+            if key is None:
+                raise JWTError("Unknown signing key")
+        return jwt.decode(token, key, algorithms=[self.algorithm])
+
+    def public_jwk(self, kid: str) -> dict:
+        return {
+            **self.verify_keys[kid].to_dict(),
+            "kid": kid,
+            "use": "sig",
+            "alg": self.algorithm,
+        }
+
+    def jwks(self) -> dict:
+        """
+        The jwks function returns the public keys of the ring as a JWK Set
+        (RFC 7517), with the retired keys whose tokens may still be valid.
+        The set of an HS ring is empty, as its secret cannot be published.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary with the keys list
+        :doc-author: Trelent
+        """
+        return {"keys": []} if self.symmetric else self._jwks
+
+
+def generate_key(algorithm: str) -> tuple[str, str]:
+    """
+    The generate_key function creates a private key for an RS or ES algorithm
+    and names it with the first 16 characters of the base64url SHA-256 digest of
+    its public key.
+
+    :param algorithm: str: The JWT algorithm, e.g. RS256 or ES256
+    :return: The kid and the private key in PEM format
+    :doc-author: Trelent
+    """
+    if algorithm.startswith("RS"):
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    elif algorithm in EC_CURVES:
+        key = ec.generate_private_key(EC_CURVES[algorithm]())
+    else:
+        raise ValueError(f"Unsupported JWT algorithm {algorithm}")
+    public_der = key.public_key().public_bytes(
+        serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    kid = base64.urlsafe_b64encode(hashlib.sha256(public_der).digest())[:16].decode()
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+    return kid, pem
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Create a JWT signing key in the keys directory"
+    )
+    parser.add_argument("--algorithm", default=settings.algorithm)
+    parser.add_argument("--keys-dir", default=settings.jwt_keys_dir or "keys")
+    args = parser.parse_args()
+    kid, pem = generate_key(args.algorithm)
+    path = Path(args.keys_dir) / f"{kid}.pem"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(pem)
+    path.chmod(0o600)
+    print(f"# {path}")
+    print(f"JWT_ACTIVE_KID={kid}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import ipaddress
+import math
+import secrets
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException, Request, status
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.services.redis_pool import get_redis
+
+# KEYS: the sliding windows of the request; ARGV: now and window in ms, a unique
+# member, then the limit of every key. The request is counted in every window or,
+# if one is full, in none, and the script returns the ms until it has room.
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local retry = 0
+for i, key in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    if redis.call('ZCARD', key) >= tonumber(ARGV[i + 3]) then
+        local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+        local since = oldest[2] and tonumber(oldest[2]) or now
+        retry = math.max(retry, since + window - now, 1)
+    end
+end
+if retry > 0 then
+    return retry
+end
+for i, key in ipairs(KEYS) do
+    redis.call('ZADD', key, now, ARGV[3])
+    redis.call('PEXPIRE', key, window)
+end
+return 0
+"""
+
+
+def client_ip(request: Request, trusted_proxies: list) -> str:
+    """
+    The client_ip function returns the address of the client of a request. When
+    the request comes from a trusted proxy, the client is the last address in
+    X-Forwarded-For that is not a trusted proxy itself; the header is ignored
+    otherwise, as any client can send it.
+
+    :param request: Request: The incoming request
+    :param trusted_proxies: list: The ip_network of every trusted proxy
+    :return: The address of the client
+    :doc-author: Trelent
+    """
+    host = request.client.host if request.client else "unknown"
+    if not trusted_proxies:
+        return host
+    forwarded = request.headers.get("X-Forwarded-For", "")
+    for address in [host, *reversed(forwarded.split(","))]:
+        address = address.strip()
+        try:
+            trusted = any(
+                ipaddress.ip_address(address) in proxy for proxy in trusted_proxies
+            )
+        except ValueError:
+            return address or host
+        if not trusted:
+            return address
+        host = address
+    return host
+
+
+class SlidingWindowLimiter:
+    """
+    Limits the requests of the auth endpoints per client IP and per account: at
+    most per_ip, resp. per_account, requests of a scope in any window seconds.
+    The account limit is counted per client IP, so requests for an account from
+    elsewhere cannot lock its owner out.
+    The windows are sorted sets in Redis, checked and updated by one Lua script
+    per request, so every worker process enforces the same limits. While Redis
+    cannot be reached, each worker falls back to token buckets of the same rate
+    in its memory, and Redis is only tried again after redis_retry seconds, so a
+    Redis outage does not add a socket timeout to every request.
+    """
+
+    def __init__(
+        self,
+        window: float,
+        per_ip: int,
+        per_account: int,
+        redis_retry: float = 5,
+        local_size: int = 10000,
+        enabled: bool = True,
+        trusted_proxies: list[str] | None = None,
+    ) -> None:
+        self.window = window
+        self.per_ip = per_ip
+        self.per_account = per_account
+        self.redis_retry = redis_retry
+        self.local_size = local_size
+        self.enabled = enabled
+        self.trusted_proxies = [
+            ipaddress.ip_network(proxy, strict=False) for proxy in trusted_proxies or []
+        ]
+        self.script = get_redis().register_script(SLIDING_WINDOW_SCRIPT)
+        self.buckets = OrderedDict()
+        self.redis_down_until = 0.0
+
+    @staticmethod
+    def key(scope: str, kind: str, value: str) -> str:
+        return f"rate:{scope}:{kind}:{value}"
+
+    async def hit(self, scope: str, request: Request, account: str | None = None):
+        """
+        The hit function counts a request of a scope, e.g. login, against the
+        limits of its client IP and, if given, of the account it is for, and
+        answers 429 with a Retry-After header when either limit is reached.
+        Call it before any hashing or database work of the request.
+
+        :param self: Represent the instance of the class
+        :param scope: str: The endpoint the limits apply to
+        :param request: Request: Get the client IP, see client_ip
+        :param account: str | None: The email or username the request is for
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        if not self.enabled:
+            return
+        host = client_ip(request, self.trusted_proxies)
+        limits = {self.key(scope, "ip", host): self.per_ip}
+        if account:
+            account_key = self.key(scope, "account", f"{host}:{account.lower()}")
+            limits[account_key] = self.per_account
+        retry = None
+        if time.monotonic() >= self.redis_down_until:
+            retry = await self._redis_hit(limits)
+        if retry is None:
+            retry = self._local_hit(limits)
+        if retry > 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, try again later",
+                headers={"Retry-After": str(math.ceil(retry))},
+            )
+
+    async def _redis_hit(self, limits: dict[str, int]) -> float | None:
+        now = int(time.time() * 1000)
+        try:
+            retry_ms = await self.script(
+                keys=list(limits),
+                args=[
+                    now,
+                    int(self.window * 1000),
+                    f"{now}-{secrets.token_hex(4)}",
+                    *limits.values(),
+                ],
+                client=get_redis(),
+            )
+        except RedisError:
+            self.redis_down_until = time.monotonic() + self.redis_retry
+            return None
+        return int(retry_ms) / 1000
+
+    def _local_hit(self, limits: dict[str, int]) -> float:
+        # token buckets of limit tokens refilled at limit / window per second
+        now = time.monotonic()
+        buckets = {}
+        retry = 0.0
+        for key, limit in limits.items():
+            tokens, updated = self.buckets.pop(key, (limit, now))
+            rate = limit / self.window
+            tokens = min(limit, tokens + (now - updated) * rate)
+            buckets[key] = tokens
+            if tokens < 1:
+                retry = max(retry, (1 - tokens) / rate)
+        for key, tokens in buckets.items():
+            self.buckets[key] = (tokens if retry else tokens - 1, now)
+        while len(self.buckets) > self.local_size:
+            self.buckets.popitem(last=False)
+        return retry
+
+
+rate_limiter = SlidingWindowLimiter(
+    settings.rate_limit_window,
+    settings.rate_limit_per_ip,
+    settings.rate_limit_per_account,
+    settings.rate_limit_redis_retry,
+    enabled=settings.rate_limit_enabled,
+    trusted_proxies=settings.rate_limit_trusted_proxies,
+)
+
+
+def get_rate_limiter() -> SlidingWindowLimiter:
+    """
+    The get_rate_limiter function is the dependency that provides the rate limiter
+    of the auth endpoints.
+
+    :return: The rate limiter
+    :doc-author: Trelent
+    """
+    return rate_limiter
@@ -0,0 +1,73 @@
+import redis.asyncio as redis
+
+from src.conf.config import settings
+
+_pool: redis.ConnectionPool | None = None
+_pubsub_client: redis.Redis | None = None
+
+
+def init_redis_pool() -> redis.ConnectionPool:
+    """
+    The init_redis_pool function creates the connection pool shared by every Redis
+    client of the worker process: the user cache, the read-your-writes pins, the
+    rate limiter and the token stores. It is called from the startup hook of the app; code running outside
+    the app, such as the CLI commands, gets the pool on first use.
+
+    :return: The connection pool
+    :doc-author: Trelent
+    """
+    global _pool
+    if _pool is None:
+        _pool = redis.ConnectionPool(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            db=0,
+            max_connections=settings.redis_max_connections,
+            socket_timeout=settings.redis_socket_timeout,
+            socket_connect_timeout=settings.redis_connect_timeout,
+        )
+    return _pool
+
+
+def get_redis() -> redis.Redis:
+    """
+    The get_redis function returns an async Redis client on the shared pool.
+    Clients are cheap, every command borrows a connection from the pool.
+
+    :return: A redis.asyncio.Redis client
+    :doc-author: Trelent
+    """
+    return redis.Redis(connection_pool=init_redis_pool())
+
+
+def get_pubsub() -> redis.client.PubSub:
+    """
+    The get_pubsub function returns a PubSub on its own connection.
+    The connection has no socket timeout, as a subscriber waits for messages
+    for as long as there are none; health checks detect a dead connection.
+    The subscribers of the worker process share one client, whose pool keeps
+    the connections of closed PubSubs for the next ones.
+
+    :return: A redis.asyncio PubSub object
+    :doc-author: Trelent
+    """
+    global _pubsub_client
+    if _pubsub_client is None:
+        _pubsub_client = redis.Redis(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            db=0,
+            socket_connect_timeout=settings.redis_connect_timeout,
+            health_check_interval=30,
+        )
+    return _pubsub_client.pubsub(ignore_subscribe_messages=True)
+
+
+async def close_redis_pool() -> None:
+    global _pool, _pubsub_client
+    if _pool is not None:
+        await _pool.disconnect()
+        _pool = None
+    if _pubsub_client is not None:
+        await _pubsub_client.close()
+        _pubsub_client = None
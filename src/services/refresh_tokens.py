@@ -0,0 +1,233 @@
+import secrets
+import time
+from abc import ABC, abstractmethod
+
+from fastapi import HTTPException, status
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.services.redis_pool import get_redis
+
+ROTATE_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if not current then
+    return -1
+end
+if current ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return 1
+"""
+
+# the results of RefreshTokenStore.rotate
+ROTATED = 1
+REUSED = 0
+UNKNOWN_FAMILY = -1
+
+
+def new_token_id() -> str:
+    return secrets.token_urlsafe(16)
+
+
+class RefreshTokenStore(ABC):
+    """
+    Keeps the refresh tokens that are still valid, one per token family.
+    A family starts at login; every refresh replaces its token with the next one
+    (rotation). Presenting a token that is no longer the current one of its family
+    means it was reused, e.g. stolen, and revokes every family of the user. A token
+    of a family that ended, by logout or expiry, is only rejected.
+    Tokens are identified by their jti claim, the store never sees the JWTs.
+    """
+
+    @abstractmethod
+    async def start(self, email: str, family: str, jti: str, ttl: int) -> None: ...
+
+    @abstractmethod
+    async def rotate(
+        self, email: str, family: str, jti: str, new_jti: str, ttl: int
+    ) -> int: ...
+
+    @abstractmethod
+    async def revoke_family(self, email: str, family: str) -> None: ...
+
+    @abstractmethod
+    async def revoke_user(self, email: str) -> None: ...
+
+
+class RedisRefreshTokenStore(RefreshTokenStore):
+    """
+    The refresh token store in Redis: the current jti of a family under
+    refresh-family:{family}, and the families of a user in the set
+    refresh-families:{email}, both expiring with the refresh tokens.
+    Redis errors are answered with 503, as no refresh token can be checked.
+    """
+
+    def __init__(self) -> None:
+        self.rotate_script = get_redis().register_script(ROTATE_SCRIPT)
+
+    @staticmethod
+    def family_key(family: str) -> str:
+        return f"refresh-family:{family}"
+
+    @staticmethod
+    def user_key(email: str) -> str:
+        return f"refresh-families:{email}"
+
+    @staticmethod
+    def unavailable() -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Token store unavailable, try again later",
+            headers={"Retry-After": "1"},
+        )
+
+    async def start(self, email: str, family: str, jti: str, ttl: int) -> None:
+        """
+        The start function stores the first refresh token of a new family.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the user
+        :param family: str: The id of the new family
+        :param jti: str: The jti claim of the refresh token
+        :param ttl: int: The lifetime of the refresh token in seconds
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        try:
+            async with get_redis().pipeline(transaction=True) as pipe:
+                pipe.set(self.family_key(family), jti, ex=ttl)
+                pipe.sadd(self.user_key(email), family)
+                pipe.expire(self.user_key(email), ttl)
+                await pipe.execute()
+        except RedisError:
+            raise self.unavailable()
+
+    async def rotate(
+        self, email: str, family: str, jti: str, new_jti: str, ttl: int
+    ) -> int:
+        """
+        The rotate function replaces the current refresh token of a family with
+        the next one, if jti is the current one. The check and the write run in
+        one Lua script, so two refreshes with the same token cannot both succeed.
+        A family that no longer exists is told apart from a reused token.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the user
+        :param family: str: The family of the presented token
+        :param jti: str: The jti claim of the presented token
+        :param new_jti: str: The jti claim of the next refresh token
+        :param ttl: int: The lifetime of the next refresh token in seconds
+        :return: ROTATED, REUSED if jti is not the current token of the family, or UNKNOWN_FAMILY
+        :doc-author: Trelent
+        """
+        try:
+            rotated = await self.rotate_script(
+                keys=[self.family_key(family), self.user_key(email)],
+                args=[jti, new_jti, ttl],
+                client=get_redis(),
+            )
+        except RedisError:
+            raise self.unavailable()
+        return int(rotated)
+
+    async def revoke_family(self, email: str, family: str) -> None:
+        """
+        The revoke_family function drops a refresh token family, e.g. at logout.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the user
+        :param family: str: The id of the family
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        try:
+            async with get_redis().pipeline(transaction=True) as pipe:
+                pipe.delete(self.family_key(family))
+                pipe.srem(self.user_key(email), family)
+                await pipe.execute()
+        except RedisError:
+            raise self.unavailable()
+
+    async def revoke_user(self, email: str) -> None:
+        """
+        The revoke_user function drops every refresh token family of a user.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the user
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        try:
+            redis = get_redis()
+            families = await redis.smembers(self.user_key(email))
+            keys = [self.family_key(family.decode()) for family in families]
+            await redis.delete(self.user_key(email), *keys)
+        except RedisError:
+            raise self.unavailable()
+
+
+class MemoryRefreshTokenStore(RefreshTokenStore):
+    """
+    The refresh token store in the memory of the worker process, for a single
+    worker and the tests. Tokens are lost on restart.
+    """
+
+    def __init__(self) -> None:
+        self._families = {}
+        self._users = {}
+
+    def _current(self, family: str) -> str | None:
+        entry = self._families.get(family)
+        if entry is None:
+            return None
+        jti, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._families[family]
+            return None
+        return jti
+
+    async def start(self, email: str, family: str, jti: str, ttl: int) -> None:
+        self._families[family] = (jti, time.monotonic() + ttl)
+        families = {item for item in self._users.get(email, ()) if self._current(item)}
+        families.add(family)
+        self._users[email] = families
+
+    async def rotate(
+        self, email: str, family: str, jti: str, new_jti: str, ttl: int
+    ) -> int:
+        current = self._current(family)
+        if current is None:
+            return UNKNOWN_FAMILY
+        if current != jti:
+            return REUSED
+        self._families[family] = (new_jti, time.monotonic() + ttl)
+        return ROTATED
+
+    async def revoke_family(self, email: str, family: str) -> None:
+        self._families.pop(family, None)
+        self._users.get(email, set()).discard(family)
+
+    async def revoke_user(self, email: str) -> None:
+        for family in self._users.pop(email, ()):
+            self._families.pop(family, None)
+
+
+REFRESH_TOKEN_STORES = {
+    "redis": RedisRefreshTokenStore,
+    "memory": MemoryRefreshTokenStore,
+}
+
+refresh_token_store = REFRESH_TOKEN_STORES[settings.refresh_token_store]()
+
+
+def get_refresh_token_store() -> RefreshTokenStore:
+    """
+    The get_refresh_token_store function is the dependency that provides the
+    refresh token store chosen by the refresh_token_store setting.
+
+    :return: The refresh token store
+    :doc-author: Trelent
+    """
+    return refresh_token_store
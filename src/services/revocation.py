@@ -0,0 +1,162 @@
+import asyncio
+import time
+
+from fastapi import HTTPException, status
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.services.bloom import BloomFilter
+from src.services.redis_pool import get_redis, get_pubsub
+
+
+class TokenDenylist:
+    """
+    The jti claims of revoked access tokens. The source of truth is Redis, a key
+    per token that expires with the token; every worker process also keeps the
+    jtis in a BloomFilter. A token whose jti is not in the filter is not revoked,
+    which is decided without a network round trip; only filter hits are looked up
+    in Redis, to tell revoked tokens from false positives. Revocations are
+    published on a channel, so every worker adds them to its filter. Until the
+    filter was first loaded from Redis, every token is looked up there.
+    """
+
+    def __init__(self, capacity: int, error_rate: float, channel: str) -> None:
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.channel = channel
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.loaded = False
+        self.checks = 0
+        self.bloom_hits = 0
+        self.false_positives = 0
+        self.revoked = 0
+        self.rebuilds = 0
+        self.redis_errors = 0
+
+    @staticmethod
+    def key(jti: str) -> str:
+        return f"revoked:{jti}"
+
+    async def revoke(self, jti: str, expires_at: float) -> None:
+        """
+        The revoke function revokes the token with the jti until it expires.
+        Redis errors are answered with 503, as the revocation would not reach
+        the other workers.
+
+        :param self: Represent the instance of the class
+        :param jti: str: The jti claim of the token
+        :param expires_at: float: The exp claim of the token
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        ttl = int(expires_at - time.time()) + 1
+        if ttl <= 0:
+            return
+        self.bloom.add(jti)
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                pipe.set(self.key(jti), 1, ex=ttl)
+                pipe.publish(self.channel, jti)
+                await pipe.execute()
+        except RedisError:
+            self.redis_errors += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Token store unavailable, try again later",
+                headers={"Retry-After": "1"},
+            )
+        self.revoked += 1
+
+    async def is_revoked(self, jti: str | None) -> bool:
+        """
+        The is_revoked function tells whether the token with the jti was revoked.
+        When the filter has the jti, or was not loaded yet, and Redis cannot be
+        asked, the token is taken as revoked.
+
+        :param self: Represent the instance of the class
+        :param jti: str | None: The jti claim of the token; tokens without one cannot be revoked
+        :return: True if the token was revoked
+        :doc-author: Trelent
+        """
+        self.checks += 1
+        if jti is None:
+            return False
+        if self.loaded:
+            if jti not in self.bloom:
+                return False
+            self.bloom_hits += 1
+        try:
+            revoked = bool(await get_redis().exists(self.key(jti)))
+        except RedisError:
+            self.redis_errors += 1
+            return True
+        if not revoked and self.loaded:
+            self.false_positives += 1
+        return revoked
+
+    async def rebuild(self) -> None:
+        """
+        The rebuild function replaces the filter with one of the jtis revoked in
+        Redis. Revocations that expired meanwhile drop out of the filter. When more
+        jtis are revoked than half the capacity, the new filter is sized for twice
+        their number, so it does not fill up again right away.
+
+        :param self: Represent the instance of the class
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        prefix = len(self.key(""))
+        jtis = [
+            key.decode()[prefix:]
+            async for key in get_redis().scan_iter(match=self.key("*"), count=1000)
+        ]
+        bloom = BloomFilter(max(self.capacity, 2 * len(jtis)), self.error_rate)
+        for jti in jtis:
+            bloom.add(jti)
+        self.bloom = bloom
+        self.loaded = True
+        self.rebuilds += 1
+
+    async def listen(self) -> None:
+        """
+        The listen function adds the revocations published by the other worker
+        processes to the filter until it is cancelled. The filter is rebuilt from
+        Redis after every (re)connect, as messages may have been missed, and when it
+        is full.
+
+        :param self: Represent the instance of the class
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        while True:
+            pubsub = get_pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                await self.rebuild()
+                async for message in pubsub.listen():
+                    self.bloom.add(message["data"].decode())
+                    if self.bloom.count >= self.bloom.capacity:
+                        await self.rebuild()
+            except RedisError:
+                self.redis_errors += 1
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    def as_dict(self) -> dict:
+        return {
+            "bloom": self.bloom.as_dict(),
+            "checks": self.checks,
+            "bloom_hits": self.bloom_hits,
+            "false_positives": self.false_positives,
+            "revoked": self.revoked,
+            "rebuilds": self.rebuilds,
+            "redis_errors": self.redis_errors,
+        }
+
+
+token_denylist = TokenDenylist(
+    settings.revocation_bloom_capacity,
+    settings.revocation_bloom_error_rate,
+    settings.revocation_channel,
+)
@@ -2,8 +2,8 @@ from typing import Any, List
 
 from fastapi import Depends, HTTPException, status, Request
 
-from src.database.models import Users, Role
-from src.services.auth import auth_service
+from src.database.models import Role
+from src.services.auth import Principal, auth_service
 
 
 class RoleAccess:
@@ -13,17 +13,19 @@ class RoleAccess:
     async def __call__(
         self,
         request: Request,
-        curent_user: Users = Depends(auth_service.get_current_user),
+        curent_user: Principal = Depends(auth_service.get_principal),
     ) -> Any:
         """
         The __call__ function is a decorator that allows us to use the class as a function.
         It takes in the request and current user, then checks if the current user's role is allowed to access this endpoint.
         If not, it raises an HTTPException with status code 403 (Forbidden).
+        The role comes from auth_service.get_principal, so in the claims-only mode
+        the check needs no cache or database lookup.
 
 
         :param self: Access the class attributes
         :param request: Request: Get the request object
-        :param curent_user: Users: Get the current user from the database
+        :param curent_user: Principal: Get the current user from the token
         :param : Get the current user from the database
         :return: The decorated function
         :doc-author: Trelent
@@ -0,0 +1,66 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls by key: while a call for a key runs, later calls
+    for the same key wait for its result instead of running their own.
+    A failure of the running call is shared by its waiters; if it is cancelled,
+    a waiter takes over and runs the call itself.
+    """
+
+    def __init__(self) -> None:
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, func):
+        """
+        The do function returns the result of func(), running it only if no call
+        for the key is in flight.
+
+        :param self: Represent the instance of the class
+        :param key: The key that identifies the work, e.g. an email
+        :param func: An async function without arguments that does the work
+        :return: The result of func
+        :doc-author: Trelent
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+            return await self.do(key, func)
+
+        future = asyncio.get_running_loop().create_future()
+        # marks the exception as retrieved when nobody waited for it
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._calls[key] = future
+        self.calls += 1
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def running(self, key) -> bool:
+        return key in self._calls
+
+    def as_dict(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,84 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+
+class TokenCache:
+    """
+    A bounded LRU of the claims of verified JWTs, keyed by the SHA-256 digest of
+    the token. An entry is kept until the exp claim of its token, so a token is
+    verified once and every later request with it skips the signature check and
+    the parsing. The cache is per worker process.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> dict | None:
+        """
+        The get function returns the cached claims of a token, or None when the
+        token was not verified yet or has expired.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded JWT
+        :return: The claims of the token, or None
+        :doc-author: Trelent
+        """
+        key = self.key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        claims, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return claims
+
+    def set(self, token: str, claims: dict) -> None:
+        """
+        The set function caches the claims of a verified token until its exp claim.
+        Tokens without an exp claim are not cached.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded JWT
+        :param claims: dict: The claims returned by jwt.decode
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        if self.maxsize <= 0 or "exp" not in claims:
+            return
+        key = self.key(token)
+        self._entries[key] = (claims, claims["exp"])
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def as_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
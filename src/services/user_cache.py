@@ -0,0 +1,703 @@
+import asyncio
+import logging
+import math
+import random
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from datetime import date, datetime
+
+import orjson
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.database.models import Users, Role
+from src.services.redis_pool import get_redis, get_pubsub
+from src.services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 3
+LOCK_POLL_INTERVAL = 0.02
+
+# KEYS: the user entry, the email of the user id and the write generation of the
+# email; ARGV: the generation read before the load, the TTL, the payload and the
+# email. The entry is only written if no write to the user happened meanwhile.
+FILL_SCRIPT = """
+if (redis.call('GET', KEYS[3]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[3], 'EX', ARGV[2])
+redis.call('SET', KEYS[2], ARGV[4], 'EX', ARGV[2])
+return 1
+"""
+
+# KEYS: the email of the user id, then the entry and the write generation of the
+# email and, after an email change, of the previous email; ARGV: the generation
+# read before the write was committed, the TTL, the payload, the email, the TTL of
+# the generations, the channel and the emails to publish. The entry is only
+# written if no other write to the user happened meanwhile and deleted otherwise;
+# either way the generations are bumped and the emails published in the same step.
+WRITE_SCRIPT = """
+local written = 0
+if (redis.call('GET', KEYS[3]) or '') == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[4], 'EX', ARGV[2])
+    redis.call('SET', KEYS[2], ARGV[3], 'EX', ARGV[2])
+    written = 1
+else
+    redis.call('DEL', KEYS[2])
+end
+if KEYS[4] then
+    redis.call('DEL', KEYS[4])
+end
+for i = 3, #KEYS, 2 do
+    redis.call('INCR', KEYS[i])
+    redis.call('EXPIRE', KEYS[i], ARGV[5])
+end
+for i = 7, #ARGV do
+    redis.call('PUBLISH', ARGV[6], ARGV[i])
+end
+return written
+"""
+
+
+@dataclass(slots=True)
+class CachedUser:
+    """
+    The part of a user that authenticated requests need: the fields of UserDb
+    and the token version. It carries no ORM state and no password or refresh
+    token hashes.
+    """
+
+    id: int
+    username: str
+    email: str
+    roles: Role
+    confirmed: bool | None
+    first_name: str | None
+    last_name: str | None
+    phone_number: str | None
+    born_date: date | None
+    description: str | None
+    avatar: str | None
+    created_at: datetime | None
+    updated_at: datetime | None
+    token_version: int
+
+    @classmethod
+    def from_user(cls, user: Users) -> "CachedUser":
+        return cls(*(getattr(user, name) for name in FIELDS))
+
+
+FIELDS = tuple(field.name for field in fields(CachedUser))
+
+
+def dumps_user(user: CachedUser, expires_at: float = 0, delta: float = 0) -> bytes:
+    """
+    The dumps_user function encodes a cached user as a compact JSON array:
+    the cache version, the expiry time and the load time of the entry, followed
+    by the field values in FIELDS order.
+
+    :param user: CachedUser: The user to encode
+    :param expires_at: float: The unix time at which the Redis entry expires
+    :param delta: float: The seconds it took to load the user from the database
+    :return: The encoded user
+    :doc-author: Trelent
+    """
+    return orjson.dumps(
+        [CACHE_VERSION, expires_at, delta, *(getattr(user, name) for name in FIELDS)]
+    )
+
+
+def loads_entry(payload: bytes) -> tuple[CachedUser, float, float] | None:
+    """
+    The loads_entry function decodes a payload written by dumps_user.
+    Payloads of another cache version or format, such as the pickled entries
+    of earlier releases, or with invalid values decode to None and are treated
+    as cache misses.
+
+    :param payload: bytes: The cached value
+    :return: The cached user, the expiry time and the load time, or None
+    :doc-author: Trelent
+    """
+    try:
+        data = orjson.loads(payload)
+        if (
+            not isinstance(data, list)
+            or len(data) != len(FIELDS) + 3
+            or data[0] != CACHE_VERSION
+        ):
+            return None
+        expires_at, delta = float(data[1]), float(data[2])
+        user = CachedUser(*data[3:])
+        user.roles = Role(user.roles)
+        if user.born_date is not None:
+            user.born_date = date.fromisoformat(user.born_date)
+        if user.created_at is not None:
+            user.created_at = datetime.fromisoformat(user.created_at)
+        if user.updated_at is not None:
+            user.updated_at = datetime.fromisoformat(user.updated_at)
+    except (ValueError, TypeError):
+        return None
+    return user, expires_at, delta
+
+
+def loads_user(payload: bytes) -> CachedUser | None:
+    """
+    The loads_user function decodes the user of a payload written by dumps_user.
+
+    :param payload: bytes: The cached value
+    :return: The cached user, or None
+    :doc-author: Trelent
+    """
+    entry = loads_entry(payload)
+    return entry[0] if entry is not None else None
+
+
+class LocalCache:
+    """
+    The in-process tier of the user cache: a bounded LRU whose entries live for
+    a few seconds. The short TTL bounds how stale an entry can get if an
+    invalidation message is lost.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value) -> None:
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def delete_if(self, predicate) -> None:
+        for key in [
+            key for key, (value, _) in self._entries.items() if predicate(value)
+        ]:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def as_dict(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
+
+
+class UserCache:
+    """
+    The cache of authenticated users, by email: the LocalCache of the worker
+    process (L1) in front of Redis (L2). Invalidations delete the Redis entry
+    and are published on a channel, so every worker evicts its L1 entry.
+    Redis errors are counted and treated as misses; the database stays the
+    source of truth. Concurrent misses for the same email load the user once
+    per worker, and with a lock_ttl once across the workers.
+
+    Entries written together, e.g. in a wave of logins, would also expire
+    together. Their TTLs are shortened by a random part of up to ttl_jitter, and
+    get_or_load refreshes an entry in the background before it expires with the
+    probabilistic early expiration of XFetch: the closer the entry is to its
+    expiry and the slower its last load, the likelier a read triggers the refresh.
+    beta scales the chance; 0 turns early refreshes off.
+
+    Every write to a user bumps the write generation of its email. A load reads
+    the generation before it reads the database and only fills the cache if the
+    generation is unchanged, so a load that read the row before a concurrent
+    write cannot overwrite the entry of that write with the old row.
+    """
+
+    def __init__(
+        self,
+        local: LocalCache,
+        ttl: int,
+        channel: str,
+        lock_ttl: float = 0,
+        lock_wait: float = 0,
+        ttl_jitter: float = 0,
+        beta: float = 0,
+    ) -> None:
+        self.local = local
+        self.ttl = ttl
+        self.channel = channel
+        self.lock_ttl = lock_ttl
+        self.lock_wait = lock_wait
+        self.ttl_jitter = ttl_jitter
+        self.beta = beta
+        self.loads = SingleFlight()
+        self.fill_script = get_redis().register_script(FILL_SCRIPT)
+        self.write_script = get_redis().register_script(WRITE_SCRIPT)
+        self._refreshes = {}
+        self.load_time = 0.0
+        self.early_refreshes = 0
+        self.refresh_errors = 0
+        self.stale_fills = 0
+        self.stale_writes = 0
+        self.lock_waits = 0
+        self.lock_wait_hits = 0
+        self.redis_hits = 0
+        self.redis_misses = 0
+        self.redis_errors = 0
+        self.invalidations_sent = 0
+        self.invalidations_received = 0
+
+    @staticmethod
+    def key(email: str) -> str:
+        return f"user:{email}"
+
+    async def get(self, email: str) -> CachedUser | None:
+        """
+        The get function returns the cached user with the email, looking in the
+        process cache first and then in Redis. Redis hits are copied to the
+        process cache.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the user
+        :return: The cached user, or None
+        :doc-author: Trelent
+        """
+        user, _ = await self._lookup(email)
+        return user
+
+    async def _lookup(self, email: str) -> tuple[CachedUser | None, bool]:
+        """
+        The _lookup function returns the cached user with the email and whether
+        the Redis entry is due for an early refresh. Entries found in the process
+        cache are never due; their Redis entry is checked when they expire there.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the user
+        :return: The cached user or None, and whether to refresh it
+        :doc-author: Trelent
+        """
+        user = self.local.get(email)
+        if user is not None:
+            return user, False
+        try:
+            payload = await get_redis().get(self.key(email))
+        except RedisError:
+            self.redis_errors += 1
+            return None, False
+        entry = loads_entry(payload) if payload is not None else None
+        if entry is None:
+            self.redis_misses += 1
+            return None, False
+        self.redis_hits += 1
+        user, expires_at, delta = entry
+        self.local.set(email, user)
+        return user, self.refresh_due(expires_at, delta)
+
+    def refresh_due(self, expires_at: float, delta: float) -> bool:
+        """
+        The refresh_due function draws whether an entry should be refreshed now,
+        the XFetch test: now - delta * beta * log(rand()) >= expires_at.
+        -log(rand()) is exponentially distributed, so the chance grows steeply
+        in the last few delta * beta seconds of the entry. A worker reads the Redis
+        entry of a user at most once per TTL of its process cache, so that TTL is
+        added to delta; with the load time alone the window would fall between
+        two reads.
+
+        :param self: Represent the instance of the class
+        :param expires_at: float: The unix time at which the entry expires
+        :param delta: float: The seconds the last load of the entry took
+        :return: True if the entry should be refreshed
+        :doc-author: Trelent
+        """
+        if self.beta <= 0:
+            return False
+        delta += self.local.ttl
+        gap = -delta * self.beta * math.log(1.0 - random.random())
+        return time.time() + gap >= expires_at
+
+    def entry_ttl(self) -> int:
+        """
+        The entry_ttl function returns the TTL of a new Redis entry: ttl shortened
+        by a random part of up to ttl_jitter, so entries written together spread
+        their expiry over that part of the TTL.
+
+        :param self: Represent the instance of the class
+        :return: The TTL in seconds
+        :doc-author: Trelent
+        """
+        return max(1, round(self.ttl * (1 - self.ttl_jitter * random.random())))
+
+    async def get_or_load(self, email: str, loader, refresh=None) -> CachedUser | None:
+        """
+        The get_or_load function returns the cached user with the email, or loads
+        it with loader and caches it. Concurrent misses for the same email in this
+        worker share a single call of loader. When a cached entry is due for an
+        early refresh, it is still returned and refresh reloads it in a
+        background task. refresh must not use the session of the request, which is
+        closed when the request ends.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the user
+        :param loader: An async function that returns the CachedUser from the database, or None
+        :param refresh: An async function like loader with its own database session
+        :return: The user, or None if there is no user with that email
+        :doc-author: Trelent
+        """
+        user, refresh_due = await self._lookup(email)
+        if user is not None:
+            if refresh_due and refresh is not None:
+                self.refresh_in_background(email, refresh)
+            return user
+        return await self.loads.do(email, lambda: self._load(email, loader))
+
+    def refresh_in_background(self, email: str, refresh) -> None:
+        """
+        The refresh_in_background function starts a task that reloads the user
+        with the email and caches it, unless a refresh or a load of the email is
+        already under way. Requests that miss meanwhile wait for the refresh
+        instead of loading.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the user
+        :param refresh: An async function that returns the CachedUser from the database, or None
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        if email in self._refreshes or self.loads.running(email):
+            return
+        self.early_refreshes += 1
+        task = asyncio.create_task(
+            self.loads.do(email, lambda: self._load(email, refresh))
+        )
+        self._refreshes[email] = task
+        task.add_done_callback(lambda done: self._refresh_done(email, done))
+
+    def _refresh_done(self, email: str, task: asyncio.Task) -> None:
+        del self._refreshes[email]
+        if not task.cancelled() and task.exception() is not None:
+            self.refresh_errors += 1
+            logger.warning("User cache refresh failed", exc_info=task.exception())
+
+    async def _load(self, email: str, loader) -> CachedUser | None:
+        lock = None
+        if self.lock_ttl > 0:
+            lock = get_redis().lock(
+                f"lock:{self.key(email)}",
+                timeout=self.lock_ttl,
+                blocking=False,
+                thread_local=False,
+            )
+            try:
+                if not await lock.acquire():
+                    lock = None
+                    user = await self._wait_for_entry(email)
+                    if user is not None:
+                        return user
+            except RedisError:
+                self.redis_errors += 1
+                lock = None
+        try:
+            generation = await self.generation(email)
+            started = time.perf_counter()
+            user = await loader()
+            delta = time.perf_counter() - started
+            self.load_time = (
+                delta if not self.load_time else (self.load_time * 0.9 + delta * 0.1)
+            )
+            if user is not None:
+                await self.set(user, delta, generation)
+            return user
+        finally:
+            if lock is not None:
+                try:
+                    await lock.release()
+                except RedisError:
+                    self.redis_errors += 1
+
+    async def _wait_for_entry(self, email: str) -> CachedUser | None:
+        """
+        The _wait_for_entry function waits up to lock_wait seconds for another
+        worker, which holds the load lock of the email, to cache the user.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the user
+        :return: The user cached by the other worker, or None on timeout
+        :doc-author: Trelent
+        """
+        self.lock_waits += 1
+        deadline = time.monotonic() + self.lock_wait
+        while time.monotonic() < deadline:
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+            payload = await get_redis().get(self.key(email))
+            user = loads_user(payload) if payload is not None else None
+            if user is not None:
+                self.lock_wait_hits += 1
+                self.local.set(email, user)
+                return user
+        return None
+
+    @staticmethod
+    def id_key(user_id: int) -> str:
+        return f"user-id:{user_id}"
+
+    @staticmethod
+    def generation_key(email: str) -> str:
+        return f"user-gen:{email}"
+
+    async def generation(self, email: str) -> bytes | None:
+        """
+        The generation function returns the write generation of the email, to
+        pass to set after loading the user.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the user
+        :return: The generation, empty if the user was not written recently, or None if Redis cannot be read
+        :doc-author: Trelent
+        """
+        try:
+            generation = await get_redis().get(self.generation_key(email))
+        except RedisError:
+            self.redis_errors += 1
+            return None
+        return generation or b""
+
+    def _bump_generation(self, pipe, email: str) -> None:
+        pipe.incr(self.generation_key(email))
+        pipe.expire(self.generation_key(email), self.ttl)
+
+    async def set(
+        self, user: CachedUser, delta: float = 0, generation: bytes | None = b""
+    ) -> None:
+        """
+        The set function caches a user loaded from the database in both tiers,
+        unless the user was written since the load began, i.e. the write
+        generation of its email is no longer generation. Next to the user entry,
+        Redis keeps the email of the user id, so a later email change can find
+        and drop the entry under the previous email.
+
+        :param self: Represent the instance of the class
+        :param user: CachedUser: The user loaded from the database
+        :param delta: float: The seconds it took to load the user
+        :param generation: bytes | None: The write generation read before the load; None skips Redis
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        if generation is None:
+            self.local.set(user.email, user)
+            return
+        ttl = self.entry_ttl()
+        try:
+            filled = await self.fill_script(
+                keys=[
+                    self.key(user.email),
+                    self.id_key(user.id),
+                    self.generation_key(user.email),
+                ],
+                args=[
+                    generation,
+                    ttl,
+                    dumps_user(user, time.time() + ttl, delta),
+                    user.email,
+                ],
+                client=get_redis(),
+            )
+        except RedisError:
+            self.redis_errors += 1
+            self.local.set(user.email, user)
+            return
+        if not filled:
+            self.stale_fills += 1
+            return
+        self.local.set(user.email, user)
+
+    async def previous_email(self, user_id: int) -> str | None:
+        email = await get_redis().get(self.id_key(user_id))
+        return email.decode() if email is not None else None
+
+    async def write_through(self, user: CachedUser, generation: bytes | None) -> None:
+        """
+        The write_through function stores a user that was just written to the
+        database in both tiers of the cache, replacing the cached copy. If the email
+        changed, the entry under the previous email is deleted. The other worker
+        processes are told to drop the emails from their L1, and loads that began
+        before the write do not fill the cache. As the user was not loaded, the
+        average load time stands in for its load time.
+
+        Concurrent writes to a user can reach Redis in another order than they
+        were committed, so the entry is only stored if the write generation of the
+        email is still the one read before the commit, and deleted otherwise.
+        The L1 entries of the user are dropped by id, as without Redis the previous
+        email is unknown.
+
+        :param self: Represent the instance of the class
+        :param user: CachedUser: The user returned by the write
+        :param generation: bytes | None: The write generation read before the commit; None deletes the entry
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.local.delete_if(lambda cached: cached.id == user.id)
+        ttl = self.entry_ttl()
+        try:
+            previous = await self.previous_email(user.id)
+            keys = [
+                self.id_key(user.id),
+                self.key(user.email),
+                self.generation_key(user.email),
+            ]
+            emails = [user.email]
+            if previous is not None and previous != user.email:
+                keys += [self.key(previous), self.generation_key(previous)]
+                emails.append(previous)
+            written = await self.write_script(
+                keys=keys,
+                args=[
+                    # a generation is empty or a number, so "-" never matches
+                    generation if generation is not None else "-",
+                    ttl,
+                    dumps_user(user, time.time() + ttl, self.load_time),
+                    user.email,
+                    self.ttl,
+                    self.channel,
+                    *emails,
+                ],
+                client=get_redis(),
+            )
+            self.invalidations_sent += len(emails)
+        except RedisError:
+            self.redis_errors += 1
+            return
+        if written:
+            self.local.set(user.email, user)
+        else:
+            self.stale_writes += 1
+
+    async def evict(self, user_id: int, email: str) -> None:
+        """
+        The evict function removes a deleted user from both tiers of the cache,
+        under its email and under the email cached for its id.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: The id of the user
+        :param email: str: The email of the user
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        try:
+            previous = await self.previous_email(user_id)
+        except RedisError:
+            previous = None
+        await self.invalidate(email, previous, user_id=user_id)
+
+    async def invalidate(self, *emails: str | None, user_id: int | None = None) -> None:
+        """
+        The invalidate function removes users from both tiers of the cache
+        and tells the other worker processes to drop them from their L1. Loads
+        that began before do not fill the cache.
+
+        :param self: Represent the instance of the class
+        :param emails: str: The emails of the users that changed
+        :param user_id: int | None: The id of the user, to drop its email entry too
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        emails = list(dict.fromkeys(email for email in emails if email))
+        keys = [self.key(email) for email in emails]
+        if user_id is not None:
+            keys.append(self.id_key(user_id))
+        if not keys:
+            return
+        for email in emails:
+            self.local.delete(email)
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                pipe.delete(*keys)
+                for email in emails:
+                    self._bump_generation(pipe, email)
+                    pipe.publish(self.channel, email)
+                await pipe.execute()
+            self.invalidations_sent += len(emails)
+        except RedisError:
+            self.redis_errors += 1
+
+    async def listen(self) -> None:
+        """
+        The listen function applies the invalidations published by the other
+        worker processes until it is cancelled. It reconnects after Redis errors
+        and clears the process cache then, as messages may have been missed.
+
+        :param self: Represent the instance of the class
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        while True:
+            pubsub = get_pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                self.local.clear()
+                async for message in pubsub.listen():
+                    self.local.delete(message["data"].decode())
+                    self.invalidations_received += 1
+            except RedisError:
+                self.redis_errors += 1
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    def as_dict(self) -> dict:
+        return {
+            "local": self.local.as_dict(),
+            "redis": {
+                "hits": self.redis_hits,
+                "misses": self.redis_misses,
+                "errors": self.redis_errors,
+                "invalidations_sent": self.invalidations_sent,
+                "invalidations_received": self.invalidations_received,
+                "stale_fills": self.stale_fills,
+                "stale_writes": self.stale_writes,
+            },
+            "loads": {
+                **self.loads.as_dict(),
+                "lock_waits": self.lock_waits,
+                "lock_wait_hits": self.lock_wait_hits,
+                "early_refreshes": self.early_refreshes,
+                "refresh_errors": self.refresh_errors,
+                "load_time_ms": self.load_time * 1000,
+            },
+        }
+
+
+user_cache = UserCache(
+    LocalCache(settings.user_cache_local_size, settings.user_cache_local_ttl),
+    settings.user_cache_ttl,
+    settings.user_cache_channel,
+    settings.user_cache_lock_ttl,
+    settings.user_cache_lock_wait,
+    settings.user_cache_ttl_jitter,
+    settings.user_cache_xfetch_beta,
+)
@@ -2,12 +2,20 @@ import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
 
 from main import app
 from src.database.models import Base
-from src.database.db import get_db
-
+from src.database.db import get_db, get_read_db
+from src.database.instrumentation import instrument_engine
+from src.services.refresh_tokens import (
+    MemoryRefreshTokenStore,
+    get_refresh_token_store,
+)
+from src.services.rate_limit import SlidingWindowLimiter, get_rate_limiter
+from src.services.revocation import token_denylist
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 
@@ -16,6 +24,12 @@ engine = create_engine(
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=NullPool)
+instrument_engine(async_engine)
+AsyncTestingSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
+
 
 @pytest.fixture(scope="module")
 def session():
@@ -35,13 +49,18 @@ def session():
 def client(session):
     # Dependency override
 
-    def override_get_db():
-        try:
-            yield session
-        finally:
-            session.close()
+    async def override_get_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    refresh_tokens = MemoryRefreshTokenStore()
+    app.dependency_overrides[get_refresh_token_store] = lambda: refresh_tokens
+    rate_limiter = SlidingWindowLimiter(60, 20, 5, enabled=False)
+    app.dependency_overrides[get_rate_limiter] = lambda: rate_limiter
+    # no revocations yet: the tests run without Redis to load the filter from
+    token_denylist.loaded = True
 
     yield TestClient(app)
 
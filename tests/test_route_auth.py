@@ -1,6 +1,13 @@
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock
 
+import pytest
+from passlib.hash import bcrypt
+
+from main import app
 from src.database.models import Users
+from src.conf.config import settings
+from src.services.auth import auth_service
+from src.services.rate_limit import SlidingWindowLimiter, get_rate_limiter
 
 
 def test_create_user(client, user, monkeypatch):
@@ -51,6 +58,209 @@ def test_login_user(client, session, user):
     assert data["token_type"] == "bearer"
 
 
+def test_login_access_token_claims(client, user):
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get("email"), "password": user.get("password")},
+    )
+    assert response.status_code == 200, response.text
+    claims = auth_service._decode(response.json()["access_token"])
+    assert claims["sub"] == user.get("email")
+    assert (claims["role"], claims["confirmed"], claims["ver"]) == ("user", True, 0)
+
+
+def test_refresh_token_rotation(client, session, user):
+    current_user: Users = (
+        session.query(Users).filter(Users.email == user.get("email")).first()
+    )
+    refresh_token_column = current_user.refresh_token
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get("email"), "password": user.get("password")},
+    )
+    assert response.status_code == 200, response.text
+    first = response.json()["refresh_token"]
+    response = client.get(
+        "/api/auth/refresh_token", headers={"Authorization": f"Bearer {first}"}
+    )
+    assert response.status_code == 200, response.text
+    second = response.json()["refresh_token"]
+    assert second != first
+    claims = auth_service._decode(response.json()["access_token"])
+    assert claims["sub"] == user.get("email")
+    session.refresh(current_user)
+    assert current_user.refresh_token == refresh_token_column
+
+
+def test_refresh_token_reuse_revokes_family(client, user):
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get("email"), "password": user.get("password")},
+    )
+    first = response.json()["refresh_token"]
+    response = client.get(
+        "/api/auth/refresh_token", headers={"Authorization": f"Bearer {first}"}
+    )
+    second = response.json()["refresh_token"]
+    response = client.get(
+        "/api/auth/refresh_token", headers={"Authorization": f"Bearer {first}"}
+    )
+    assert response.status_code == 401, response.text
+    assert response.json()["detail"] == "Invalid refresh token"
+    response = client.get(
+        "/api/auth/refresh_token", headers={"Authorization": f"Bearer {second}"}
+    )
+    assert response.status_code == 401, response.text
+
+
+@pytest.fixture()
+def denylist_redis(monkeypatch):
+    revoked = set()
+    redis = MagicMock()
+    pipe = MagicMock()
+    pipe.set.side_effect = lambda key, value, ex: revoked.add(key)
+    pipe.execute = AsyncMock()
+    redis.pipeline.return_value.__aenter__.return_value = pipe
+    redis.exists = AsyncMock(side_effect=lambda key: int(key in revoked))
+    monkeypatch.setattr("src.services.revocation.get_redis", lambda: redis)
+    return revoked
+
+
+def login(client, user):
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get("email"), "password": user.get("password")},
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_logout(client, user, denylist_redis):
+    tokens = login(client, user)
+    other = login(client, user)
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    response = client.get("/api/users/me/", headers=headers)
+    assert response.status_code == 200, response.text
+    response = client.post("/api/auth/logout", headers=headers)
+    assert response.status_code == 204, response.text
+    response = client.get("/api/users/me/", headers=headers)
+    assert response.status_code == 401, response.text
+    response = client.get(
+        "/api/auth/refresh_token",
+        headers={"Authorization": f"Bearer {tokens['refresh_token']}"},
+    )
+    assert response.status_code == 401, response.text
+    response = client.get(
+        "/api/users/me/",
+        headers={"Authorization": f"Bearer {other['access_token']}"},
+    )
+    assert response.status_code == 200, response.text
+
+
+def test_refresh_after_logout_keeps_other_sessions(client, user, denylist_redis):
+    session_a = login(client, user)
+    session_b = login(client, user)
+    response = client.post(
+        "/api/auth/logout",
+        headers={"Authorization": f"Bearer {session_a['access_token']}"},
+    )
+    assert response.status_code == 204, response.text
+    response = client.get(
+        "/api/auth/refresh_token",
+        headers={"Authorization": f"Bearer {session_a['refresh_token']}"},
+    )
+    assert response.status_code == 401, response.text
+    response = client.get(
+        "/api/auth/refresh_token",
+        headers={"Authorization": f"Bearer {session_b['refresh_token']}"},
+    )
+    assert response.status_code == 200, response.text
+
+
+def test_revoke_refresh_token(client, user, denylist_redis):
+    tokens = login(client, user)
+    response = client.post("/api/auth/revoke", json={"token": tokens["refresh_token"]})
+    assert response.status_code == 204, response.text
+    response = client.get(
+        "/api/auth/refresh_token",
+        headers={"Authorization": f"Bearer {tokens['refresh_token']}"},
+    )
+    assert response.status_code == 401, response.text
+    assert not denylist_redis
+
+
+def test_revoke_invalid_token(client):
+    response = client.post("/api/auth/revoke", json={"token": "not-a-jwt"})
+    assert response.status_code == 204, response.text
+
+
+def test_verify(client, user, denylist_redis):
+    tokens = login(client, user)
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    response = client.get("/api/auth/verify", headers=headers)
+    assert response.status_code == 204, response.text
+    assert response.headers["X-User-Email"] == user.get("email")
+    assert (
+        response.headers["X-User-Role"]
+        == auth_service.decode_token(tokens["access_token"])["role"]
+    )
+    assert int(response.headers["X-User-Id"]) > 0
+    assert response.headers["X-DB-Query-Count"] == "0"
+    client.post("/api/auth/logout", headers=headers)
+    response = client.get("/api/auth/verify", headers=headers)
+    assert response.status_code == 401, response.text
+
+
+def test_verify_invalid_token(client):
+    response = client.get(
+        "/api/auth/verify", headers={"Authorization": "Bearer not-a-jwt"}
+    )
+    assert response.status_code == 401, response.text
+    response = client.get("/api/auth/verify")
+    assert response.status_code == 401, response.text
+
+
+def test_login_rate_limited_before_password_check(client, user, monkeypatch):
+    limiter = SlidingWindowLimiter(60, 20, 2)
+    limiter.redis_down_until = float("inf")
+    previous = app.dependency_overrides[get_rate_limiter]
+    app.dependency_overrides[get_rate_limiter] = lambda: limiter
+    verify = AsyncMock(return_value=(False, None))
+    monkeypatch.setattr(auth_service, "verify_and_update_async", verify)
+    try:
+        for _ in range(2):
+            response = client.post(
+                "/api/auth/login",
+                data={"username": user.get("email"), "password": "wrong"},
+            )
+            assert response.status_code == 401, response.text
+        response = client.post(
+            "/api/auth/login",
+            data={"username": user.get("email"), "password": "wrong"},
+        )
+        assert response.status_code == 429, response.text
+        assert "Retry-After" in response.headers
+        assert verify.await_count == 2
+    finally:
+        app.dependency_overrides[get_rate_limiter] = previous
+
+
+def test_login_rehashes_outdated_password(client, session, user):
+    current_user: Users = (
+        session.query(Users).filter(Users.email == user.get("email")).first()
+    )
+    current_user.password = bcrypt.using(rounds=4).hash(user.get("password"))
+    session.commit()
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get("email"), "password": user.get("password")},
+    )
+    assert response.status_code == 200, response.text
+    session.refresh(current_user)
+    assert bcrypt.from_string(current_user.password).rounds == settings.bcrypt_rounds
+    assert bcrypt.verify(user.get("password"), current_user.password)
+
+
 def test_login_wrong_password(client, user):
     response = client.post(
         "/api/auth/login",
@@ -69,3 +279,15 @@ def test_login_wrong_email(client, user):
     assert response.status_code == 401, response.text
     data = response.json()
     assert data["detail"] == "Invalid email"
+
+
+def test_jwks(client):
+    response = client.get("/.well-known/jwks.json")
+    assert response.status_code == 200, response.text
+    assert response.json() == auth_service.keyring.jwks()
+    assert "max-age" in response.headers["Cache-Control"]
+    response = client.get(
+        "/.well-known/jwks.json",
+        headers={"If-None-Match": response.headers["ETag"]},
+    )
+    assert response.status_code == 304
@@ -0,0 +1,165 @@
+import csv
+import io
+import json
+
+import pytest
+
+from main import app
+from src.database.models import Users, Role
+from src.services.auth import Principal, auth_service
+
+
+@pytest.fixture(scope="module")
+def admin(session):
+    users = [
+        Users(
+            username=f"user{number:03}",
+            email=f"user{number:03}@example.com",
+            password="secret",
+            avatar="avatar.png",
+            confirmed=True,
+        )
+        for number in range(1, 6)
+    ]
+    session.add_all(users)
+    session.commit()
+    admin = users[0]
+    admin.roles = Role.admin
+    session.commit()
+    principal = Principal.from_user(admin)
+    app.dependency_overrides[auth_service.get_current_user] = lambda: admin
+    app.dependency_overrides[auth_service.get_principal] = lambda: principal
+    yield admin
+    app.dependency_overrides.pop(auth_service.get_current_user)
+    app.dependency_overrides.pop(auth_service.get_principal)
+
+
+def test_get_users_pages(client, admin):
+    response = client.get("/api/users/", params={"limit": 2})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert [user["username"] for user in data["items"]] == ["user001", "user002"]
+    emails = [user["email"] for user in data["items"]]
+    while data["next_cursor"]:
+        response = client.get(
+            "/api/users/", params={"limit": 2, "cursor": data["next_cursor"]}
+        )
+        assert response.status_code == 200, response.text
+        data = response.json()
+        emails += [user["email"] for user in data["items"]]
+    assert len(emails) == 5
+    assert len(set(emails)) == 5
+
+
+def test_get_users_db_stats_headers(client, admin):
+    response = client.get("/api/users/", params={"limit": 2})
+    assert response.status_code == 200, response.text
+    assert response.headers["X-DB-Query-Count"] == "1"
+    assert float(response.headers["X-DB-Time"]) >= 0
+
+
+def test_get_users_invalid_cursor(client, admin):
+    response = client.get("/api/users/", params={"cursor": "bad"})
+    assert response.status_code == 400, response.text
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_export_users_ndjson(client, admin):
+    response = client.get("/api/users/export/")
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["username"] for row in rows][:2] == ["user001", "user002"]
+    assert len(rows) == 5
+    assert rows[0]["roles"] == "admin"
+    assert "password" not in rows[0]
+
+
+def test_export_users_csv(client, admin):
+    response = client.get("/api/users/export/", params={"format": "csv"})
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 5
+    assert rows[0]["email"] == "user001@example.com"
+    assert rows[0]["roles"] == "admin"
+
+
+def test_search_user(client, admin):
+    response = client.get("/api/users/search/", params={"q": "USER00"})
+    assert response.status_code == 200, response.text
+    assert len(response.json()) == 5
+
+
+def test_search_user_ranks_exact_email_first(client, admin):
+    response = client.get("/api/users/search/", params={"q": "user004@example.com"})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert [user["username"] for user in data] == ["user004"]
+
+
+def test_search_user_escapes_wildcards(client, admin):
+    response = client.get("/api/users/search/", params={"q": "%"})
+    assert response.status_code == 200, response.text
+    assert response.json() == []
+
+
+def test_import_users_csv(client, admin):
+    content = (
+        "username,email,password,born_date\n"
+        "imported1,imported1@example.com,123456,1999-01-02\n"
+        "short,not-an-email,123456,\n"
+        "imported2,user001@example.com,123456,\n"
+        "imported3,imported1@example.com,123456,\n"
+    )
+    response = client.post(
+        "/api/users/import/",
+        files={"file": ("users.csv", content, "text/csv")},
+    )
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["total"] == 4
+    assert data["imported"] == 1
+    assert data["failed"] == 3
+    assert [error["row"] for error in data["errors"]] == [2, 4, 3]
+    assert data["errors"][1]["detail"] == "Duplicate email in the import"
+    assert data["errors"][2]["detail"] == "Account already exists"
+
+
+def test_import_users_ndjson(client, session, admin):
+    password_hash = auth_service.get_password_hash("123456")
+    content = "\n".join(
+        [
+            json.dumps(
+                {
+                    "username": "imported4",
+                    "email": "imported4@example.com",
+                    "password_hash": password_hash,
+                    "born_date": "1990-12-31",
+                }
+            ),
+            "{not json",
+        ]
+    )
+    response = client.post(
+        "/api/users/import/",
+        params={"format": "ndjson"},
+        files={"file": ("users.ndjson", content, "application/x-ndjson")},
+    )
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["imported"] == 1
+    assert data["errors"][0]["row"] == 2
+    user = session.query(Users).filter_by(email="imported4@example.com").first()
+    assert user.password == password_hash
+    assert user.born_md == 1231
+    assert user.roles == Role.user
+    assert user.avatar
+
+
+def test_hash_pool_status(client, admin):
+    response = client.get("/api/admin/auth/hash-pool")
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["rejected"] == 0
+    assert data["in_flight"] == 0
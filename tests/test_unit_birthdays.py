@@ -0,0 +1,69 @@
+import unittest
+from datetime import date
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from src.database.models import Base, Users, birth_month_day
+from src.repository.users import upcoming_birthdays_filter
+
+
+class TestUpcomingBirthdays(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=self.engine)
+        self.session = Session(self.engine)
+        for number, born_date in enumerate(
+            [
+                date(1990, 12, 25),
+                date(1985, 12, 30),
+                date(2001, 1, 2),
+                date(1970, 1, 10),
+                date(2000, 2, 29),
+                None,
+            ]
+        ):
+            self.session.add(
+                Users(
+                    email=f"user{number}@example.com",
+                    password="secret",
+                    born_date=born_date,
+                )
+            )
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+
+    def born_dates(self, start, days):
+        upcoming_filter, _ = upcoming_birthdays_filter(start, days)
+        users = self.session.scalars(select(Users).filter(upcoming_filter))
+        return sorted(user.born_date for user in users)
+
+    def test_born_md_kept_in_sync(self):
+        user = self.session.scalar(select(Users).filter_by(email="user0@example.com"))
+        self.assertEqual(user.born_md, 1225)
+        user.born_date = date(1990, 7, 4)
+        self.session.commit()
+        self.assertEqual(user.born_md, 704)
+        self.assertIsNone(birth_month_day(None))
+
+    def test_window_inside_year(self):
+        self.assertEqual(self.born_dates(date(2024, 12, 20), 7), [date(1990, 12, 25)])
+
+    def test_window_crosses_new_year(self):
+        self.assertEqual(
+            self.born_dates(date(2024, 12, 29), 7),
+            [date(1985, 12, 30), date(2001, 1, 2)],
+        )
+
+    def test_leap_day_in_common_year(self):
+        self.assertEqual(self.born_dates(date(2023, 2, 27), 2), [date(2000, 2, 29)])
+
+    def test_whole_year(self):
+        self.assertEqual(len(self.born_dates(date(2024, 6, 1), 366)), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
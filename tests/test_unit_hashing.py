@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import unittest
+from unittest.mock import patch
+
+from fastapi import HTTPException
+
+from src.services.hashing import HashPool, calibrate_bcrypt, MIN_BCRYPT_ROUNDS
+
+
+class TestHashPool(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.pool = HashPool(workers=1, queue_size=1)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.pool.executor.shutdown(wait=True)
+
+    def blocking_hash(self, password):
+        self.release.wait(5)
+        return f"hash:{password}"
+
+    async def test_run_returns_result(self):
+        self.release.set()
+        result = await self.pool.run(self.blocking_hash, "secret")
+        self.assertEqual(result, "hash:secret")
+        stats = self.pool.as_dict()
+        self.assertEqual(stats["completed"], 1)
+        self.assertEqual(stats["in_flight"], 0)
+        self.assertGreaterEqual(stats["hash_max_ms"], 0)
+
+    async def test_event_loop_not_blocked(self):
+        task = asyncio.create_task(self.pool.run(self.blocking_hash, "secret"))
+        await asyncio.sleep(0.01)
+        self.assertFalse(task.done())
+        self.assertEqual(self.pool.as_dict()["in_flight"], 1)
+        self.release.set()
+        self.assertEqual(await task, "hash:secret")
+
+    async def test_saturated_pool_rejects(self):
+        tasks = [
+            asyncio.create_task(self.pool.run(self.blocking_hash, str(number)))
+            for number in range(2)
+        ]
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.pool.as_dict()["queued"], 1)
+        with self.assertRaises(HTTPException) as err:
+            await self.pool.run(self.blocking_hash, "rejected")
+        self.assertEqual(err.exception.status_code, 503)
+        self.assertEqual(self.pool.as_dict()["rejected"], 1)
+        self.release.set()
+        self.assertEqual(await asyncio.gather(*tasks), ["hash:0", "hash:1"])
+
+    async def test_cancelled_call_stays_in_flight_until_done(self):
+        task = asyncio.create_task(self.pool.run(self.blocking_hash, "secret"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(self.pool.as_dict()["in_flight"], 1)
+        self.release.set()
+        for _ in range(100):
+            if not self.pool.in_flight:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(self.pool.as_dict()["in_flight"], 0)
+
+
+def fake_measure(rounds, samples=3):
+    return 0.001 * 2 ** (rounds - 4)
+
+
+class TestCalibrateBcrypt(unittest.TestCase):
+    @patch("src.services.hashing.measure_bcrypt", side_effect=fake_measure)
+    def test_highest_rounds_within_target(self, measure):
+        rounds, measured_ms = calibrate_bcrypt(target_ms=300)
+        self.assertEqual(rounds, 12)
+        self.assertEqual(measured_ms, 256)
+
+    @patch("src.services.hashing.measure_bcrypt", side_effect=fake_measure)
+    def test_minimum_rounds(self, measure):
+        rounds, _ = calibrate_bcrypt(target_ms=1)
+        self.assertEqual(rounds, MIN_BCRYPT_ROUNDS)
+
+
+if __name__ == "__main__":
+    unittest.main()
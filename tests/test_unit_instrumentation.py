@@ -0,0 +1,58 @@
+import logging
+import unittest
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.database.instrumentation import (
+    QueryStats,
+    instrument_engine,
+    start_request_stats,
+    log_request_stats,
+)
+
+
+class TestQueryStats(unittest.TestCase):
+    def test_record(self):
+        stats = QueryStats()
+        stats.record("SELECT 1", 0.002)
+        stats.record("SELECT 2", 0.005)
+        stats.record("SELECT 1", 0.001)
+        self.assertEqual(stats.count, 3)
+        self.assertAlmostEqual(stats.total_time, 0.008)
+        self.assertEqual(stats.slowest_statement, "SELECT 2")
+        self.assertEqual(stats.most_repeated(), ("SELECT 1", 2))
+
+    def test_warning_above_threshold(self):
+        stats = QueryStats()
+        for _ in range(3):
+            stats.record("SELECT * FROM users WHERE id = ?", 0.001)
+        with self.assertLogs("src.database.instrumentation", logging.WARNING) as logs:
+            log_request_stats("GET", "/api/users/", stats, warn_count=2)
+        self.assertIn("repeated 3 times", logs.output[0])
+
+
+class TestInstrumentEngine(unittest.IsolatedAsyncioTestCase):
+    async def test_sync_engine(self):
+        engine = create_engine("sqlite://")
+        instrument_engine(engine)
+        stats = start_request_stats()
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+        self.assertEqual(stats.count, 2)
+        engine.dispose()
+
+    async def test_async_engine(self):
+        engine = create_async_engine("sqlite+aiosqlite://")
+        instrument_engine(engine)
+        stats = start_request_stats()
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        self.assertEqual(stats.count, 1)
+        self.assertEqual(stats.slowest_statement, "SELECT 1")
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    unittest.main()
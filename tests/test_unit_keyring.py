@@ -0,0 +1,117 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from cryptography.hazmat.primitives import serialization
+from jose import JWTError, jwt
+
+from src.services.keyring import KeyRing, generate_key
+
+
+def public_pem(private_pem: str) -> str:
+    key = serialization.load_pem_private_key(private_pem.encode(), password=None)
+    return (
+        key.public_key()
+        .public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        .decode()
+    )
+
+
+class TestKeyRing(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.old_kid, cls.old_pem = generate_key("RS256")
+        cls.new_kid, cls.new_pem = generate_key("RS256")
+
+    def setUp(self):
+        self.claims = {"sub": "a@example.com", "exp": int(time.time()) + 60}
+
+    def test_sign_and_verify(self):
+        ring = KeyRing("RS256", keys={self.new_kid: self.new_pem})
+        token = ring.sign(self.claims)
+        self.assertEqual(jwt.get_unverified_header(token)["kid"], self.new_kid)
+        self.assertEqual(ring.verify(token), self.claims)
+
+    def test_es256(self):
+        kid, pem = generate_key("ES256")
+        ring = KeyRing("ES256", keys={kid: pem})
+        self.assertEqual(ring.verify(ring.sign(self.claims)), self.claims)
+        self.assertEqual(ring.jwks()["keys"][0]["kty"], "EC")
+
+    def test_rotation_keeps_old_tokens_valid(self):
+        old_ring = KeyRing("RS256", keys={self.old_kid: self.old_pem})
+        token = old_ring.sign(self.claims)
+        ring = KeyRing(
+            "RS256",
+            keys={self.old_kid: public_pem(self.old_pem), self.new_kid: self.new_pem},
+            active_kid=self.new_kid,
+        )
+        self.assertEqual(ring.verify(token), self.claims)
+        self.assertEqual(
+            jwt.get_unverified_header(ring.sign(self.claims))["kid"], self.new_kid
+        )
+
+    def test_unknown_kid_rejected(self):
+        token = KeyRing("RS256", keys={self.old_kid: self.old_pem}).sign(self.claims)
+        ring = KeyRing("RS256", keys={self.new_kid: self.new_pem})
+        with self.assertRaises(JWTError):
+            ring.verify(token)
+
+    def test_expired_token_rejected(self):
+        ring = KeyRing("RS256", keys={self.new_kid: self.new_pem})
+        token = ring.sign({"sub": "a@example.com", "exp": int(time.time()) - 60})
+        with self.assertRaises(JWTError):
+            ring.verify(token)
+
+    def test_jwks_publishes_public_keys_only(self):
+        ring = KeyRing(
+            "RS256",
+            keys={self.old_kid: self.old_pem, self.new_kid: self.new_pem},
+            active_kid=self.new_kid,
+        )
+        keys = ring.jwks()["keys"]
+        self.assertEqual({key["kid"] for key in keys}, {self.old_kid, self.new_kid})
+        for key in keys:
+            self.assertEqual(
+                (key["alg"], key["use"], key["kty"]), ("RS256", "sig", "RSA")
+            )
+            self.assertNotIn("d", key)
+        token = ring.sign(self.claims)
+        self.assertEqual(
+            jwt.decode(token, ring.jwks(), algorithms=["RS256"]), self.claims
+        )
+
+    def test_active_kid_needs_private_key(self):
+        with self.assertRaises(ValueError):
+            KeyRing(
+                "RS256",
+                keys={self.old_kid: self.old_pem, self.new_kid: self.new_pem},
+            )
+        with self.assertRaises(ValueError):
+            KeyRing(
+                "RS256",
+                keys={self.old_kid: public_pem(self.old_pem)},
+                active_kid=self.old_kid,
+            )
+
+    def test_hs256_ring(self):
+        ring = KeyRing("HS256", secret="secret")
+        token = ring.sign(self.claims)
+        self.assertNotIn("kid", jwt.get_unverified_header(token))
+        self.assertEqual(ring.verify(token), self.claims)
+        self.assertEqual(ring.jwks(), {"keys": []})
+
+    def test_load_from_directory(self):
+        with tempfile.TemporaryDirectory() as keys_dir:
+            Path(keys_dir, f"{self.new_kid}.pem").write_text(self.new_pem)
+            Path(keys_dir, f"{self.old_kid}.pem").write_text(public_pem(self.old_pem))
+            ring = KeyRing.load("RS256", "secret", keys_dir, "")
+        self.assertEqual(ring.active_kid, self.new_kid)
+        self.assertEqual(len(ring.jwks()["keys"]), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi import HTTPException
+from redis.exceptions import ConnectionError
+
+from src.services.rate_limit import SlidingWindowLimiter, client_ip
+
+
+class TestSlidingWindowLimiter(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.limiter = SlidingWindowLimiter(60, 3, 2, redis_retry=5)
+        self.limiter.script = AsyncMock(return_value=0)
+        self.request = MagicMock()
+        self.request.client.host = "10.0.0.1"
+        patcher = patch("src.services.rate_limit.get_redis")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_one_script_call_per_request(self):
+        await self.limiter.hit("login", self.request, "A@example.com")
+        self.limiter.script.assert_awaited_once()
+        kwargs = self.limiter.script.await_args.kwargs
+        self.assertEqual(
+            kwargs["keys"],
+            [
+                "rate:login:ip:10.0.0.1",
+                "rate:login:account:10.0.0.1:a@example.com",
+            ],
+        )
+        self.assertEqual(kwargs["args"][1], 60000)
+        self.assertEqual(kwargs["args"][3:], [3, 2])
+
+    async def test_full_window_is_rejected(self):
+        self.limiter.script.return_value = 1500
+        with self.assertRaises(HTTPException) as cm:
+            await self.limiter.hit("login", self.request, "a@example.com")
+        self.assertEqual(cm.exception.status_code, 429)
+        self.assertEqual(cm.exception.headers["Retry-After"], "2")
+
+    async def test_redis_error_falls_back_to_local_buckets(self):
+        self.limiter.script.side_effect = ConnectionError()
+        await self.limiter.hit("login", self.request, "a@example.com")
+        await self.limiter.hit("login", self.request, "a@example.com")
+        with self.assertRaises(HTTPException) as cm:
+            await self.limiter.hit("login", self.request, "a@example.com")
+        self.assertEqual(cm.exception.status_code, 429)
+        self.assertEqual(int(cm.exception.headers["Retry-After"]), 30)
+        # the circuit is open: Redis was only tried once
+        self.limiter.script.assert_awaited_once()
+
+    async def test_local_limits_are_per_ip_and_per_account(self):
+        self.limiter.redis_down_until = float("inf")
+        await self.limiter.hit("login", self.request, "a@example.com")
+        await self.limiter.hit("login", self.request, "b@example.com")
+        await self.limiter.hit("login", self.request, "c@example.com")
+        with self.assertRaises(HTTPException):
+            await self.limiter.hit("login", self.request, "d@example.com")
+        await self.limiter.hit("signup", self.request, "d@example.com")
+
+    async def test_account_limit_is_per_client_ip(self):
+        self.limiter.redis_down_until = float("inf")
+        await self.limiter.hit("login", self.request, "a@example.com")
+        await self.limiter.hit("login", self.request, "a@example.com")
+        with self.assertRaises(HTTPException):
+            await self.limiter.hit("login", self.request, "a@example.com")
+        owner = MagicMock()
+        owner.client.host = "10.0.0.2"
+        await self.limiter.hit("login", owner, "a@example.com")
+
+    async def test_redis_retried_after_circuit_closes(self):
+        self.limiter.script.side_effect = ConnectionError()
+        await self.limiter.hit("login", self.request)
+        self.limiter.redis_down_until = 0
+        self.limiter.script.side_effect = None
+        await self.limiter.hit("login", self.request)
+        self.assertEqual(self.limiter.script.await_count, 2)
+
+    async def test_disabled(self):
+        self.limiter.enabled = False
+        await self.limiter.hit("login", self.request, "a@example.com")
+        self.limiter.script.assert_not_awaited()
+
+
+class TestClientIp(unittest.TestCase):
+    def setUp(self):
+        with patch("src.services.rate_limit.get_redis"):
+            limiter = SlidingWindowLimiter(
+                60, 3, 2, trusted_proxies=["10.0.0.1", "172.16.0.0/12"]
+            )
+        self.trusted = limiter.trusted_proxies
+        self.request = MagicMock()
+        self.request.client.host = "10.0.0.1"
+        self.request.headers = {"X-Forwarded-For": "1.2.3.4, 5.6.7.8, 172.16.0.5"}
+
+    def test_forwarded_by_trusted_proxies(self):
+        self.assertEqual(client_ip(self.request, self.trusted), "5.6.7.8")
+
+    def test_header_of_untrusted_peer_is_ignored(self):
+        self.request.client.host = "9.9.9.9"
+        self.assertEqual(client_ip(self.request, self.trusted), "9.9.9.9")
+
+    def test_without_trusted_proxies_the_peer_is_the_client(self):
+        self.assertEqual(client_ip(self.request, []), "10.0.0.1")
+
+    def test_missing_header_keeps_the_proxy(self):
+        self.request.headers = {}
+        self.assertEqual(client_ip(self.request, self.trusted), "10.0.0.1")
@@ -0,0 +1,142 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi import HTTPException
+from redis.exceptions import ConnectionError
+
+from src.services.refresh_tokens import (
+    MemoryRefreshTokenStore,
+    RedisRefreshTokenStore,
+    RefreshTokenStore,
+    REUSED,
+    ROTATED,
+    UNKNOWN_FAMILY,
+    new_token_id,
+)
+
+
+class TestMemoryRefreshTokenStore(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.store = MemoryRefreshTokenStore()
+
+    async def test_rotate_current_token(self):
+        await self.store.start("a@example.com", "fam", "jti-1", 60)
+        self.assertEqual(
+            await self.store.rotate("a@example.com", "fam", "jti-1", "jti-2", 60),
+            ROTATED,
+        )
+        self.assertEqual(
+            await self.store.rotate("a@example.com", "fam", "jti-2", "jti-3", 60),
+            ROTATED,
+        )
+
+    async def test_rotated_token_is_rejected(self):
+        await self.store.start("a@example.com", "fam", "jti-1", 60)
+        await self.store.rotate("a@example.com", "fam", "jti-1", "jti-2", 60)
+        self.assertEqual(
+            await self.store.rotate("a@example.com", "fam", "jti-1", "jti-3", 60),
+            REUSED,
+        )
+
+    async def test_expired_family_is_rejected(self):
+        await self.store.start("a@example.com", "fam", "jti-1", 0)
+        self.assertEqual(
+            await self.store.rotate("a@example.com", "fam", "jti-1", "jti-2", 60),
+            UNKNOWN_FAMILY,
+        )
+
+    async def test_revoked_family_is_unknown(self):
+        await self.store.start("a@example.com", "fam", "jti-1", 60)
+        await self.store.revoke_family("a@example.com", "fam")
+        self.assertEqual(
+            await self.store.rotate("a@example.com", "fam", "jti-1", "jti-2", 60),
+            UNKNOWN_FAMILY,
+        )
+
+    async def test_revoke_user_drops_every_family(self):
+        await self.store.start("a@example.com", "fam-1", "jti-1", 60)
+        await self.store.start("a@example.com", "fam-2", "jti-2", 60)
+        await self.store.start("b@example.com", "fam-3", "jti-3", 60)
+        await self.store.revoke_user("a@example.com")
+        self.assertEqual(
+            await self.store.rotate("a@example.com", "fam-1", "jti-1", "x", 60),
+            UNKNOWN_FAMILY,
+        )
+        self.assertEqual(
+            await self.store.rotate("a@example.com", "fam-2", "jti-2", "x", 60),
+            UNKNOWN_FAMILY,
+        )
+        self.assertEqual(
+            await self.store.rotate("b@example.com", "fam-3", "jti-3", "x", 60),
+            ROTATED,
+        )
+
+    def test_partial_store_cannot_be_created(self):
+        class PartialStore(RefreshTokenStore):
+            async def start(self, email, family, jti, ttl):
+                pass
+
+        with self.assertRaises(TypeError):
+            PartialStore()
+
+    def test_token_ids_are_unique(self):
+        self.assertEqual(len({new_token_id() for _ in range(100)}), 100)
+
+
+class TestRedisRefreshTokenStore(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.redis = MagicMock()
+        self.pipe = MagicMock()
+        self.pipe.execute = AsyncMock()
+        self.redis.pipeline.return_value.__aenter__.return_value = self.pipe
+        self.redis.smembers = AsyncMock(return_value={b"fam-1", b"fam-2"})
+        self.redis.delete = AsyncMock()
+        patcher = patch(
+            "src.services.refresh_tokens.get_redis", return_value=self.redis
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = RedisRefreshTokenStore()
+        self.store.rotate_script = AsyncMock(return_value=1)
+
+    async def test_start(self):
+        await self.store.start("a@example.com", "fam", "jti", 60)
+        self.pipe.set.assert_called_once_with("refresh-family:fam", "jti", ex=60)
+        self.pipe.sadd.assert_called_once_with("refresh-families:a@example.com", "fam")
+        self.pipe.expire.assert_called_once_with("refresh-families:a@example.com", 60)
+        self.pipe.execute.assert_awaited_once()
+
+    async def test_rotate_runs_script(self):
+        rotated = await self.store.rotate("a@example.com", "fam", "jti-1", "jti-2", 60)
+        self.assertEqual(rotated, ROTATED)
+        self.store.rotate_script.assert_awaited_once_with(
+            keys=["refresh-family:fam", "refresh-families:a@example.com"],
+            args=["jti-1", "jti-2", 60],
+            client=self.redis,
+        )
+
+    async def test_rotate_results(self):
+        for result in (REUSED, UNKNOWN_FAMILY):
+            self.store.rotate_script.return_value = result
+            self.assertEqual(
+                await self.store.rotate("a@example.com", "fam", "jti-1", "jti-2", 60),
+                result,
+            )
+
+    async def test_revoke_user(self):
+        await self.store.revoke_user("a@example.com")
+        keys = self.redis.delete.await_args.args
+        self.assertEqual(keys[0], "refresh-families:a@example.com")
+        self.assertEqual(
+            sorted(keys[1:]), ["refresh-family:fam-1", "refresh-family:fam-2"]
+        )
+
+    async def test_redis_error_is_503(self):
+        self.store.rotate_script.side_effect = ConnectionError()
+        with self.assertRaises(HTTPException) as cm:
+            await self.store.rotate("a@example.com", "fam", "jti-1", "jti-2", 60)
+        self.assertEqual(cm.exception.status_code, 503)
+
+
+if __name__ == "__main__":
+    unittest.main()
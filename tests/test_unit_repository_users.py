@@ -1,12 +1,11 @@
-from datetime import datetime
+from datetime import date, datetime
 import sys
 import os
 
 import unittest
-from unittest.mock import MagicMock
-
-from sqlalchemy.orm import Session
+from unittest.mock import AsyncMock, MagicMock, patch
 
+from sqlalchemy.ext.asyncio import AsyncSession
 
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(project_root)
@@ -32,23 +31,35 @@ from src.repository.users import (
 
 class TestUsersRepository(unittest.IsolatedAsyncioTestCase):
     def setUp(self):
-        self.session = MagicMock(spec=Session)
+        self.session = MagicMock(spec=AsyncSession)
         self.user = Users(id=1)
+        patcher = patch("src.repository.users.user_cache", new=AsyncMock())
+        self.user_cache = patcher.start()
+        self.addCleanup(patcher.stop)
 
     async def test_get_users(self):
         users = [Users(), Users(), Users()]
-        self.session.query().all.return_value = users
+        self.session.scalars.return_value = MagicMock(all=MagicMock(return_value=users))
         result = await get_users(db=self.session)
         self.assertEqual(result, users)
 
+    async def test_get_users_page(self):
+        users = [Users(id=11), Users(id=12)]
+        self.session.scalars.return_value = MagicMock(all=MagicMock(return_value=users))
+        result = await get_users(db=self.session, limit=2, after_id=10)
+        self.assertEqual(result, users)
+        statement = str(self.session.scalars.call_args.args[0])
+        self.assertIn("WHERE users.id >", statement)
+        self.assertIn("ORDER BY users.id", statement)
+
     async def test_get_user_found(self):
         user = Users(id=1)
-        self.session.query().filter_by().first.return_value = user
+        self.session.scalar.return_value = user
         result = await get_user(user_id=1, db=self.session)
         self.assertEqual(result, user)
 
     async def test_get_user_not_found(self):
-        self.session.query().filter_by().first.return_value = None
+        self.session.scalar.return_value = None
         result = await get_user(user_id=99, db=self.session)
         self.assertIsNone(result)
 
@@ -83,7 +94,7 @@ class TestUsersRepository(unittest.IsolatedAsyncioTestCase):
             email="bill.johnson@example.com",
             password="passwd",
             phone_number="999 999 99 99",
-            born_date="2000-05-05",
+            born_date=date(2000, 5, 5),
             description="test",
         )
         body = UserModel(
@@ -96,7 +107,7 @@ class TestUsersRepository(unittest.IsolatedAsyncioTestCase):
             born_date="2000-05-05",
             description="test",
         )
-        self.session.query().filter_by().first.return_value = user
+        self.session.scalar.return_value = user
         result = await update_user(body=body, user_id=user.id, db=self.session)
         self.assertEqual(result.first_name, body.first_name)
         self.assertEqual(result.last_name, body.last_name)
@@ -109,12 +120,13 @@ class TestUsersRepository(unittest.IsolatedAsyncioTestCase):
 
     async def test_remove_user_found(self):
         user = Users()
-        self.session.query().filter_by().first.return_value = user
+        self.session.scalar.return_value = user
         result = await remove_user(user_id=2, db=self.session)
         self.assertEqual(result, user)
+        self.user_cache.evict.assert_awaited_once_with(user.id, user.email)
 
     async def test_remove_user_not_found(self):
-        self.session.query().filter_by().first.return_value = None
+        self.session.scalar.return_value = None
         result = await remove_user(user_id=99, db=self.session)
         self.assertIsNone(result)
 
@@ -122,65 +134,74 @@ class TestUsersRepository(unittest.IsolatedAsyncioTestCase):
         user = Users()
         old_token = "old_token"
         new_token = "new_token"
-        self.session.query().filter_by().first.return_value = user
+        self.session.scalar.return_value = user
         result = await update_token(user=user, refresh_token=new_token, db=self.session)
         self.session.commit.assert_called_once()
         self.assertEqual(user.refresh_token, new_token)
 
     async def test_update_user_email_found(self):
-        user = Users()
         new_email = "new_email@example.com"
+        user = Users(id=1, email=new_email)
         body = UserEmailModel(email=new_email)
-        self.session.query().filter_by().first.return_value = user
+        self.session.scalar.return_value = user
         result = await update_user_email(body=body, user_id=user.id, db=self.session)
         self.session.commit.assert_called_once()
-        self.assertEqual(user.email, new_email)
         self.assertEqual(result, user)
+        cached = self.user_cache.write_through.await_args.args[0]
+        self.assertEqual((cached.id, cached.email), (1, new_email))
 
     async def test_update_user_email_not_found(self):
         user = Users()
         new_email = "new_email@example.com"
         body = UserEmailModel(email=new_email)
-        self.session.query().filter_by().first.return_value = None
+        self.session.scalar.return_value = None
         result = await update_user_email(body=body, user_id=user.id, db=self.session)
         self.session.commit.assert_not_called()
         self.assertIsNone(result)
+        self.user_cache.write_through.assert_not_called()
 
     async def test_search_user_not_found(self):
         query = "user@ex.com"
         user = Users()
-        self.session.query().filter().offset().limit().all.return_value = user
+        self.session.scalars.return_value = MagicMock(all=MagicMock(return_value=[]))
         result = await search_user(q=query, skip=0, limit=10, db=self.session)
         self.assertNotEqual(result, user)
 
     async def test_birthdays_per_week(self):
         users = Users(born_date=datetime.now().date())
-        self.session.query().filter().offset().limit().all.return_value = users
+        self.session.scalars.return_value = MagicMock(all=MagicMock(return_value=users))
         result = await birthdays_per_week(db=self.session, days=7, skip=0, limit=10)
         self.assertEqual(result, users)
 
     async def test_get_user_by_email_found(self):
         user = Users(email="username@example.com")
-        self.session.query().filter_by().first.return_value = user
+        self.session.scalar.return_value = user
         result = await get_user_by_email(email="username@example.com", db=self.session)
         self.assertEqual(result, user)
 
     async def test_get_user_by_email_not_found(self):
-        self.session.query().filter_by().first.return_value = None
+        self.session.scalar.return_value = None
         result = await get_user_by_email(email="user@example.com", db=self.session)
         self.assertIsNone(result)
 
     async def test_confirmed_email(self):
         email = "username@example.com"
-        user = Users(email=email)
-        self.session.query().filter_by().first.return_value = user
-        await confirmed_email(email=email, db=self.session)
-        self.assertTrue(user.confirmed)
+        user = Users(email=email, confirmed=True)
+        self.session.scalar.return_value = user
+        result = await confirmed_email(email=email, db=self.session)
+        self.assertEqual(result, user)
         self.session.commit.assert_called_once()
 
+    async def test_confirmed_email_already_confirmed(self):
+        self.session.scalar.return_value = None
+        result = await confirmed_email(email="username@example.com", db=self.session)
+        self.assertIsNone(result)
+        self.session.commit.assert_not_called()
+
     async def test_update_avatar(self):
-        user = Users()
         url = "avatar.com"
+        user = Users(email="username@example.com", avatar=url)
+        self.session.scalar.return_value = user
         result = await update_avatar(user.email, url, db=self.session)
         self.assertEqual(result.avatar, url)
         self.session.commit.assert_called_once()
@@ -0,0 +1,100 @@
+import unittest
+from unittest.mock import AsyncMock, patch
+from datetime import date
+
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import Session
+
+from src.database.db import SyncSession
+from src.database.models import Base, Users, Role, ADMIN_EMAIL
+from src.schemas import UserModel, UserEmailModel
+from src.repository.users import (
+    update_user,
+    update_user_email,
+    remove_user,
+    confirmed_email,
+    update_avatar,
+)
+
+
+class TestUsersWrites(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=self.engine)
+        self.session = Session(self.engine, expire_on_commit=False)
+        self.session.add(
+            Users(
+                email="bill.johnson@example.com",
+                password="secret",
+                born_date=date(2000, 5, 5),
+            )
+        )
+        self.session.commit()
+        self.session.expunge_all()
+        self.db = SyncSession(self.session)
+        patcher = patch("src.repository.users.user_cache", new=AsyncMock())
+        self.user_cache = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.statements = []
+        event.listen(self.engine, "before_cursor_execute", self.count_statement)
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+
+    def count_statement(self, conn, cursor, statement, *args):
+        self.statements.append(statement.split()[0])
+
+    async def test_update_user_single_statement(self):
+        body = UserModel(
+            first_name="Bill",
+            last_name="Johnson",
+            username="bill.johnson",
+            email=ADMIN_EMAIL,
+            password="passwd",
+            phone_number="999 999 99 99",
+            born_date="1990-12-25",
+            description="test",
+        )
+        user = await update_user(body, 1, self.db)
+        self.assertEqual(self.statements, ["UPDATE"])
+        self.assertEqual(user.first_name, "Bill")
+        self.assertEqual(user.born_md, 1225)
+        self.assertEqual(user.roles, Role.admin)
+        self.assertIsNotNone(user.updated_at)
+
+    async def test_update_user_not_found(self):
+        body = UserEmailModel(email="new_email@example.com")
+        self.assertIsNone(await update_user_email(body, 99, self.db))
+        self.assertEqual(self.statements, ["UPDATE"])
+
+    async def test_update_user_email(self):
+        body = UserEmailModel(email="new_email@example.com")
+        user = await update_user_email(body, 1, self.db)
+        self.assertEqual(user.email, "new_email@example.com")
+        self.assertEqual(user.roles, Role.user)
+        cached, generation = self.user_cache.write_through.await_args.args
+        self.assertEqual(cached.email, "new_email@example.com")
+        self.user_cache.generation.assert_awaited_once_with("new_email@example.com")
+        self.assertIs(generation, self.user_cache.generation.return_value)
+
+    async def test_confirmed_email_once(self):
+        user = await confirmed_email("bill.johnson@example.com", self.db)
+        self.assertTrue(user.confirmed)
+        self.assertIsNone(await confirmed_email("bill.johnson@example.com", self.db))
+        self.assertEqual(self.statements, ["UPDATE", "UPDATE"])
+
+    async def test_update_avatar(self):
+        user = await update_avatar("bill.johnson@example.com", "avatar.com", self.db)
+        self.assertEqual(user.avatar, "avatar.com")
+        self.assertEqual(self.statements, ["UPDATE"])
+
+    async def test_remove_user(self):
+        user = await remove_user(1, self.db)
+        self.assertEqual(user.email, "bill.johnson@example.com")
+        self.assertEqual(self.statements, ["DELETE"])
+        self.assertIsNone(self.session.scalar(select(Users).filter_by(id=1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
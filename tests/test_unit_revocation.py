@@ -0,0 +1,115 @@
+import time
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi import HTTPException
+from redis.exceptions import ConnectionError
+
+from src.services.bloom import BloomFilter
+from src.services.revocation import TokenDenylist
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        items = [f"jti-{number}" for number in range(1000)]
+        for item in items:
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in items))
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(1000, 0.01)
+        for number in range(1000):
+            bloom.add(f"jti-{number}")
+        false_positives = sum(f"other-{number}" in bloom for number in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_sizing(self):
+        bloom = BloomFilter(100000, 0.001)
+        self.assertEqual((bloom.size, bloom.hashes), (1437759, 10))
+
+
+class TestTokenDenylist(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.denylist = TokenDenylist(1000, 0.01, "revoked")
+        self.denylist.loaded = True
+        self.redis = MagicMock()
+        self.redis.exists = AsyncMock(return_value=1)
+        self.pipe = MagicMock()
+        self.pipe.execute = AsyncMock()
+        self.redis.pipeline.return_value.__aenter__.return_value = self.pipe
+        patcher = patch("src.services.revocation.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_unknown_token_skips_redis(self):
+        self.assertFalse(await self.denylist.is_revoked("jti"))
+        self.assertFalse(await self.denylist.is_revoked(None))
+        self.redis.exists.assert_not_called()
+
+    async def test_revoke(self):
+        await self.denylist.revoke("jti", time.time() + 60)
+        self.pipe.set.assert_called_once()
+        key, value = self.pipe.set.call_args.args
+        self.assertEqual((key, value), ("revoked:jti", 1))
+        self.assertTrue(0 < self.pipe.set.call_args.kwargs["ex"] <= 61)
+        self.pipe.publish.assert_called_once_with("revoked", "jti")
+        self.assertTrue(await self.denylist.is_revoked("jti"))
+        self.redis.exists.assert_awaited_once_with("revoked:jti")
+
+    async def test_expired_token_is_not_stored(self):
+        await self.denylist.revoke("jti", time.time() - 60)
+        self.pipe.set.assert_not_called()
+
+    async def test_false_positive(self):
+        self.denylist.bloom.add("jti")
+        self.redis.exists.return_value = 0
+        self.assertFalse(await self.denylist.is_revoked("jti"))
+        self.assertEqual(self.denylist.as_dict()["false_positives"], 1)
+
+    async def test_redis_error_on_hit_is_revoked(self):
+        self.denylist.bloom.add("jti")
+        self.redis.exists.side_effect = ConnectionError()
+        self.assertTrue(await self.denylist.is_revoked("jti"))
+
+    async def test_revoke_redis_error_is_503(self):
+        self.pipe.execute.side_effect = ConnectionError()
+        with self.assertRaises(HTTPException) as cm:
+            await self.denylist.revoke("jti", time.time() + 60)
+        self.assertEqual(cm.exception.status_code, 503)
+
+    async def test_rebuild_from_redis(self):
+        async def scan_iter(match, count):
+            self.assertEqual(match, "revoked:*")
+            for key in (b"revoked:a", b"revoked:b"):
+                yield key
+
+        self.denylist.bloom.add("expired")
+        self.redis.scan_iter = scan_iter
+        await self.denylist.rebuild()
+        self.assertIn("a", self.denylist.bloom)
+        self.assertIn("b", self.denylist.bloom)
+        self.assertEqual(self.denylist.bloom.count, 2)
+        self.assertEqual(self.denylist.bloom.capacity, 1000)
+
+    async def test_rebuild_sizes_filter_for_revoked_tokens(self):
+        async def scan_iter(match, count):
+            for number in range(800):
+                yield f"revoked:{number}".encode()
+
+        self.redis.scan_iter = scan_iter
+        await self.denylist.rebuild()
+        self.assertEqual(self.denylist.bloom.capacity, 1600)
+        self.assertIn("799", self.denylist.bloom)
+
+    async def test_tokens_are_looked_up_until_loaded(self):
+        self.denylist.loaded = False
+        self.redis.exists.return_value = 0
+        self.assertFalse(await self.denylist.is_revoked("jti"))
+        self.redis.exists.assert_awaited_once_with("revoked:jti")
+        self.redis.exists.side_effect = ConnectionError()
+        self.assertTrue(await self.denylist.is_revoked("jti"))
+
+
+if __name__ == "__main__":
+    unittest.main()
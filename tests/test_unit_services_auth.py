@@ -0,0 +1,154 @@
+import asyncio
+import pickle
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi import HTTPException
+from redis.exceptions import RedisError, TimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.conf.config import settings
+from src.database.models import Users, Role
+from src.services.auth import Principal, auth_service
+from src.services.user_cache import CachedUser, dumps_user, user_cache
+
+
+class TestGetCurrentUser(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.user = Users(
+            id=1,
+            email="cached@example.com",
+            username="cached",
+            roles=Role.user,
+            confirmed=True,
+        )
+        self.token = asyncio.run(
+            auth_service.create_access_token({"sub": self.user.email})
+        )
+        self.db = MagicMock(spec=AsyncSession)
+        self.cache = MagicMock()
+        self.cache.get = AsyncMock()
+        self.pipe = MagicMock()
+        self.pipe.execute = AsyncMock()
+        self.cache.pipeline.return_value.__aenter__.return_value = self.pipe
+        self.cache.evalsha = AsyncMock(return_value=1)
+        user_cache.local.clear()
+        patcher = patch("src.services.user_cache.get_redis", return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_cache_hit(self):
+        self.cache.get.return_value = dumps_user(CachedUser.from_user(self.user))
+        user = await auth_service.get_current_user(self.token, self.db)
+        self.assertEqual(user.email, self.user.email)
+        self.assertEqual(user.roles, Role.user)
+        self.db.scalar.assert_not_called()
+
+    async def test_pickled_entry_is_a_miss(self):
+        self.cache.get.return_value = pickle.dumps(self.user)
+        self.db.scalar.return_value = self.user
+        user = await auth_service.get_current_user(self.token, self.db)
+        self.assertIsInstance(user, CachedUser)
+        self.db.scalar.assert_awaited_once()
+
+    async def test_cache_miss_fills_cache(self):
+        self.cache.get.return_value = None
+        self.db.scalar.return_value = self.user
+        user = await auth_service.get_current_user(self.token, self.db)
+        self.assertEqual(user, CachedUser.from_user(self.user))
+        self.cache.evalsha.assert_awaited_once()
+        _, _, key, _, _, _, ttl, _, _ = self.cache.evalsha.await_args.args
+        self.assertEqual(key, "user:cached@example.com")
+        jitter = settings.user_cache_ttl * settings.user_cache_ttl_jitter
+        self.assertTrue(
+            settings.user_cache_ttl - jitter <= ttl <= settings.user_cache_ttl
+        )
+
+    async def test_local_hit_skips_redis(self):
+        self.cache.get.return_value = None
+        self.db.scalar.return_value = self.user
+        await auth_service.get_current_user(self.token, self.db)
+        redis_reads = self.cache.get.await_count
+        user = await auth_service.get_current_user(self.token, self.db)
+        self.assertEqual(user.email, self.user.email)
+        self.assertEqual(self.cache.get.await_count, redis_reads)
+        self.db.scalar.assert_awaited_once()
+
+    async def test_redis_error_falls_back_to_database(self):
+        self.cache.get.side_effect = TimeoutError()
+        self.cache.evalsha.side_effect = RedisError()
+        self.db.scalar.return_value = self.user
+        user = await auth_service.get_current_user(self.token, self.db)
+        self.assertEqual(user.email, self.user.email)
+
+
+class TestGetPrincipal(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.user = Users(
+            id=1,
+            email="claims@example.com",
+            username="claims",
+            roles=Role.moderator,
+            confirmed=True,
+            token_version=3,
+        )
+        self.token = asyncio.run(
+            auth_service.create_access_token(auth_service.access_claims(self.user))
+        )
+        self.db = MagicMock(spec=AsyncSession)
+        self.db.scalar.return_value = self.user
+        self.cache = MagicMock()
+        self.cache.get = AsyncMock(return_value=None)
+        self.pipe = MagicMock()
+        self.pipe.execute = AsyncMock()
+        self.cache.pipeline.return_value.__aenter__.return_value = self.pipe
+        self.cache.evalsha = AsyncMock(return_value=1)
+        user_cache.local.clear()
+        patcher = patch("src.services.user_cache.get_redis", return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_claims_only_skips_lookups(self):
+        with patch.object(settings, "auth_claims_only", True):
+            principal = await auth_service.get_principal(self.token, self.db)
+        self.assertEqual(
+            principal, Principal("claims@example.com", Role.moderator, True, 3, 1)
+        )
+        self.cache.get.assert_not_called()
+        self.db.scalar.assert_not_called()
+
+    async def test_without_claims_only_loads_user(self):
+        with patch.object(settings, "auth_claims_only", False):
+            principal = await auth_service.get_principal(self.token, self.db)
+        self.assertEqual(principal, Principal.from_user(self.user))
+        self.db.scalar.assert_awaited_once()
+
+    async def test_token_without_role_claims_loads_user(self):
+        token = await auth_service.create_access_token({"sub": self.user.email})
+        with patch.object(settings, "auth_claims_only", True):
+            principal = await auth_service.get_principal(token, self.db)
+        self.assertEqual(principal.roles, Role.moderator)
+        self.db.scalar.assert_awaited_once()
+
+    async def test_refresh_token_rejected(self):
+        token = await auth_service.create_refresh_token({"sub": self.user.email})
+        with patch.object(settings, "auth_claims_only", True):
+            with self.assertRaises(HTTPException) as cm:
+                await auth_service.get_principal(token, self.db)
+        self.assertEqual(cm.exception.status_code, 401)
+
+    async def test_token_principal_ignores_claims_only_setting(self):
+        with patch.object(settings, "auth_claims_only", False):
+            principal = await auth_service.get_token_principal(self.token)
+        self.assertEqual(principal, Principal.from_user(self.user))
+        self.cache.get.assert_not_called()
+
+    async def test_stale_token_version_rejected(self):
+        self.user.token_version = 4
+        with self.assertRaises(HTTPException) as cm:
+            await auth_service.get_current_user(self.token, self.db)
+        self.assertEqual(cm.exception.status_code, 401)
+
+
+if __name__ == "__main__":
+    unittest.main()
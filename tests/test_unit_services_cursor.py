@@ -0,0 +1,23 @@
+import unittest
+
+from fastapi import HTTPException
+
+from src.services.cursor import encode_cursor, decode_cursor
+
+
+class TestCursor(unittest.TestCase):
+    def test_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor(42)), 42)
+
+    def test_first_page(self):
+        self.assertEqual(decode_cursor(None), 0)
+
+    def test_invalid_cursor(self):
+        for cursor in ("not-a-cursor", encode_cursor("42")):
+            with self.assertRaises(HTTPException) as ctx:
+                decode_cursor(cursor)
+            self.assertEqual(ctx.exception.status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import asyncio
+import unittest
+
+from src.services.single_flight import SingleFlight
+
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def load(self):
+        self.calls += 1
+        await self.release.wait()
+        return f"result {self.calls}"
+
+    async def test_concurrent_calls_coalesced(self):
+        tasks = [
+            asyncio.create_task(self.flight.do("key", self.load)) for _ in range(10)
+        ]
+        await asyncio.sleep(0)
+        self.release.set()
+        results = await asyncio.gather(*tasks)
+        self.assertEqual(results, ["result 1"] * 10)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.flight.as_dict()["coalesced"], 9)
+        self.assertEqual(self.flight.as_dict()["in_flight"], 0)
+
+    async def test_other_keys_run_separately(self):
+        self.release.set()
+        await asyncio.gather(
+            self.flight.do("a", self.load), self.flight.do("b", self.load)
+        )
+        self.assertEqual(self.calls, 2)
+
+    async def test_error_shared_with_waiters(self):
+        async def fail():
+            await self.release.wait()
+            raise ValueError("database down")
+
+        tasks = [asyncio.create_task(self.flight.do("key", fail)) for _ in range(3)]
+        await asyncio.sleep(0)
+        self.release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    async def test_waiter_takes_over_cancelled_call(self):
+        leader = asyncio.create_task(self.flight.do("key", self.load))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(self.flight.do("key", self.load))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        self.release.set()
+        self.assertEqual(await waiter, "result 2")
+        self.assertTrue(leader.cancelled())
+
+
+if __name__ == "__main__":
+    unittest.main()
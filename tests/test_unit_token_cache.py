@@ -0,0 +1,57 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+
+from jose import jwt
+
+from src.services.auth import auth_service
+from src.services.token_cache import TokenCache
+
+
+class TestTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = TokenCache(maxsize=2)
+        self.exp = int(time.time()) + 60
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get("token"))
+        self.cache.set("token", {"sub": "user", "exp": self.exp})
+        self.assertEqual(self.cache.get("token")["sub"], "user")
+        stats = self.cache.as_dict()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+    def test_least_recently_used_evicted(self):
+        for token in ("a", "b"):
+            self.cache.set(token, {"exp": self.exp})
+        self.cache.get("a")
+        self.cache.set("c", {"exp": self.exp})
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.as_dict()["evictions"], 1)
+
+    def test_expired_entry(self):
+        self.cache.set("token", {"exp": int(time.time()) - 1})
+        self.assertIsNone(self.cache.get("token"))
+        self.assertEqual(self.cache.as_dict()["expired"], 1)
+
+    def test_token_without_exp_not_cached(self):
+        self.cache.set("token", {"sub": "user"})
+        self.assertEqual(self.cache.as_dict()["size"], 0)
+
+
+class TestAuthDecode(unittest.TestCase):
+    def setUp(self):
+        auth_service.token_cache.clear()
+
+    def test_token_verified_once(self):
+        token = asyncio.run(auth_service.create_access_token({"sub": "a@example.com"}))
+        with patch("src.services.keyring.jwt.decode", wraps=jwt.decode) as decode:
+            for _ in range(3):
+                claims = auth_service._decode(token)
+        self.assertEqual(claims["sub"], "a@example.com")
+        decode.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
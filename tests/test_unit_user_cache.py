@@ -0,0 +1,409 @@
+import asyncio
+import time
+import unittest
+from datetime import date, datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import orjson
+from redis.exceptions import ConnectionError
+
+from src.database.models import Users, Role
+from src.schemas import UserDb
+from src.services.user_cache import (
+    CACHE_VERSION,
+    CachedUser,
+    LocalCache,
+    UserCache,
+    dumps_user,
+    loads_entry,
+    loads_user,
+)
+
+
+class TestUserCacheEncoding(unittest.TestCase):
+    def setUp(self):
+        self.user = Users(
+            id=7,
+            username="bill.johnson",
+            email="bill.johnson@example.com",
+            password="$2b$12$secret",
+            refresh_token="refresh",
+            roles=Role.moderator,
+            confirmed=True,
+            first_name="Bill",
+            last_name="Johnson",
+            phone_number="999 999 99 99",
+            born_date=date(2000, 5, 5),
+            description="test",
+            avatar="avatar.com",
+            created_at=datetime(2023, 1, 2, 3, 4, 5),
+            updated_at=datetime(2023, 1, 2, 3, 4, 5, 6),
+        )
+
+    def test_round_trip(self):
+        cached = CachedUser.from_user(self.user)
+        self.assertEqual(loads_user(dumps_user(cached)), cached)
+
+    def test_entry_round_trip(self):
+        cached = CachedUser.from_user(self.user)
+        self.assertEqual(
+            loads_entry(dumps_user(cached, 1700000000.5, 0.004)),
+            (cached, 1700000000.5, 0.004),
+        )
+
+    def test_no_secrets(self):
+        payload = dumps_user(CachedUser.from_user(self.user))
+        self.assertNotIn(b"secret", payload)
+        self.assertNotIn(b"refresh", payload)
+
+    def test_serves_user_db(self):
+        cached = loads_user(dumps_user(CachedUser.from_user(self.user)))
+        self.assertEqual(UserDb.model_validate(cached).roles, Role.moderator)
+
+    def test_other_version_rejected(self):
+        payload = orjson.loads(dumps_user(CachedUser.from_user(self.user)))
+        payload[0] = CACHE_VERSION + 1
+        self.assertIsNone(loads_user(orjson.dumps(payload)))
+
+    def test_invalid_payloads_rejected(self):
+        self.assertIsNone(loads_user(b"\x80\x04garbage"))
+        self.assertIsNone(loads_user(b'{"id": 1}'))
+
+
+class TestLocalCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = LocalCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.as_dict()["evictions"], 1)
+
+    def test_ttl(self):
+        cache = LocalCache(maxsize=2, ttl=0)
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.as_dict()["expired"], 1)
+
+
+class FakePubSub:
+    def __init__(self, messages, on_listen):
+        self.messages = messages
+        self.on_listen = on_listen
+        self.subscribe = AsyncMock()
+        self.close = AsyncMock()
+
+    async def listen(self):
+        self.on_listen()
+        for message in self.messages:
+            yield message
+        raise ConnectionError()
+
+
+class TestUserCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cache = UserCache(LocalCache(10, 60), ttl=900, channel="invalidate")
+        self.redis = MagicMock()
+        self.redis.get = AsyncMock(return_value=None)
+        self.pipe = MagicMock()
+        self.pipe.execute = AsyncMock()
+        self.redis.pipeline.return_value.__aenter__.return_value = self.pipe
+        self.redis.evalsha = AsyncMock(return_value=1)
+        patcher = patch("src.services.user_cache.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = CachedUser.from_user(
+            Users(id=1, email="a@example.com", username="a", roles=Role.user)
+        )
+
+    async def test_redis_hit_fills_local(self):
+        self.redis.get.return_value = dumps_user(self.user)
+        self.assertEqual(await self.cache.get("a@example.com"), self.user)
+        self.assertEqual(await self.cache.get("a@example.com"), self.user)
+        self.redis.get.assert_awaited_once_with("user:a@example.com")
+        stats = self.cache.as_dict()
+        self.assertEqual((stats["local"]["hits"], stats["redis"]["hits"]), (1, 1))
+
+    async def test_set_writes_both_tiers(self):
+        await self.cache.set(self.user, 0.004, b"2")
+        self.assertEqual(self.cache.local.get("a@example.com"), self.user)
+        _, keys, *args = self.redis.evalsha.await_args.args
+        self.assertEqual(
+            args[:3], ["user:a@example.com", "user-id:1", "user-gen:a@example.com"]
+        )
+        generation, ttl, payload, email = args[3:]
+        user, expires_at, delta = loads_entry(payload)
+        self.assertEqual((generation, ttl, email), (b"2", 900, "a@example.com"))
+        self.assertEqual((user, delta), (self.user, 0.004))
+        self.assertAlmostEqual(expires_at, time.time() + 900, delta=1)
+
+    async def test_set_after_concurrent_write_is_skipped(self):
+        self.redis.evalsha.return_value = 0
+        await self.cache.set(self.user, 0.004, b"")
+        self.assertIsNone(self.cache.local.get("a@example.com"))
+        self.assertEqual(self.cache.as_dict()["redis"]["stale_fills"], 1)
+
+    async def test_load_passes_generation_read_before_loader(self):
+        events = []
+
+        async def get(key):
+            events.append(key)
+            return b"7" if key == "user-gen:a@example.com" else None
+
+        async def loader():
+            events.append("loader")
+            return self.user
+
+        self.redis.get = AsyncMock(side_effect=get)
+        await self.cache.get_or_load("a@example.com", loader)
+        self.assertEqual(
+            events, ["user:a@example.com", "user-gen:a@example.com", "loader"]
+        )
+        self.assertEqual(self.redis.evalsha.await_args.args[5], b"7")
+
+    async def test_ttl_jitter(self):
+        cache = UserCache(LocalCache(10, 60), 1000, "invalidate", ttl_jitter=0.2)
+        ttls = {cache.entry_ttl() for _ in range(200)}
+        self.assertTrue(all(800 <= ttl <= 1000 for ttl in ttls))
+        self.assertGreater(len(ttls), 20)
+
+    def write_call(self):
+        _, numkeys, *rest = self.redis.evalsha.await_args.args
+        return rest[:numkeys], rest[numkeys:]
+
+    async def test_write_through_replaces_entry(self):
+        self.redis.get.return_value = b"a@example.com"
+        await self.cache.write_through(self.user, b"3")
+        self.redis.get.assert_awaited_once_with("user-id:1")
+        keys, args = self.write_call()
+        self.assertEqual(
+            keys, ["user-id:1", "user:a@example.com", "user-gen:a@example.com"]
+        )
+        generation, ttl, payload, email, generation_ttl, channel, *emails = args
+        self.assertEqual((generation, ttl, email), (b"3", 900, "a@example.com"))
+        self.assertEqual(loads_user(payload), self.user)
+        self.assertEqual((generation_ttl, channel), (900, "invalidate"))
+        self.assertEqual(emails, ["a@example.com"])
+        self.assertEqual(self.cache.local.get("a@example.com"), self.user)
+
+    async def test_write_through_email_change(self):
+        self.redis.get.return_value = b"old@example.com"
+        self.cache.local.set("old@example.com", self.user)
+        await self.cache.write_through(self.user, b"")
+        keys, args = self.write_call()
+        self.assertEqual(keys[3:], ["user:old@example.com", "user-gen:old@example.com"])
+        self.assertEqual(args[6:], ["a@example.com", "old@example.com"])
+        self.assertIsNone(self.cache.local.get("old@example.com"))
+        self.assertEqual(self.cache.local.get("a@example.com"), self.user)
+
+    async def test_write_through_after_later_write_is_skipped(self):
+        self.redis.evalsha.return_value = 0
+        await self.cache.write_through(self.user, b"3")
+        self.assertIsNone(self.cache.local.get("a@example.com"))
+        self.assertEqual(self.cache.as_dict()["redis"]["stale_writes"], 1)
+
+    async def test_write_through_without_generation_deletes_entry(self):
+        await self.cache.write_through(self.user, None)
+        _, args = self.write_call()
+        self.assertEqual(args[0], "-")
+
+    async def test_write_through_error_drops_local_entries_of_user(self):
+        self.cache.local.set("a@example.com", self.user)
+        self.cache.local.set("old@example.com", self.user)
+        self.redis.get.side_effect = ConnectionError()
+        await self.cache.write_through(self.user, None)
+        self.assertIsNone(self.cache.local.get("a@example.com"))
+        self.assertIsNone(self.cache.local.get("old@example.com"))
+        self.assertEqual(self.cache.as_dict()["redis"]["errors"], 1)
+
+    async def test_evict(self):
+        self.redis.get.return_value = b"old@example.com"
+        await self.cache.evict(1, "a@example.com")
+        self.pipe.delete.assert_called_once_with(
+            "user:a@example.com", "user:old@example.com", "user-id:1"
+        )
+
+    async def test_invalidate_deletes_and_publishes(self):
+        await self.cache.set(self.user)
+        await self.cache.invalidate("a@example.com")
+        self.assertIsNone(self.cache.local.get("a@example.com"))
+        self.pipe.delete.assert_called_once_with("user:a@example.com")
+        self.pipe.publish.assert_called_once_with("invalidate", "a@example.com")
+        self.pipe.incr.assert_called_once_with("user-gen:a@example.com")
+        self.pipe.expire.assert_called_once_with("user-gen:a@example.com", 900)
+        self.assertEqual(self.cache.as_dict()["redis"]["invalidations_sent"], 1)
+
+    async def test_redis_errors_are_misses(self):
+        self.redis.get.side_effect = ConnectionError()
+        self.redis.evalsha.side_effect = ConnectionError()
+        self.assertIsNone(await self.cache.get("a@example.com"))
+        await self.cache.set(self.user)
+        self.assertEqual(self.cache.as_dict()["redis"]["errors"], 2)
+
+    async def test_listen_evicts_local_entries(self):
+        def fill_local():
+            self.cache.local.set("a@example.com", self.user)
+            self.cache.local.set("b@example.com", self.user)
+
+        pubsub = FakePubSub([{"type": "message", "data": b"a@example.com"}], fill_local)
+
+        async def stop(seconds):
+            raise asyncio.CancelledError
+
+        with patch("src.services.user_cache.get_pubsub", return_value=pubsub), patch(
+            "src.services.user_cache.asyncio.sleep", side_effect=stop
+        ):
+            with self.assertRaises(asyncio.CancelledError):
+                await self.cache.listen()
+        self.assertIsNone(self.cache.local.get("a@example.com"))
+        self.assertEqual(self.cache.local.get("b@example.com"), self.user)
+        stats = self.cache.as_dict()["redis"]
+        self.assertEqual((stats["invalidations_received"], stats["errors"]), (1, 1))
+        pubsub.subscribe.assert_awaited_once_with("invalidate")
+        pubsub.close.assert_awaited_once()
+
+
+class TestUserCacheLoads(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.redis = MagicMock()
+        self.redis.get = AsyncMock(return_value=None)
+        self.pipe = MagicMock()
+        self.pipe.execute = AsyncMock()
+        self.redis.pipeline.return_value.__aenter__.return_value = self.pipe
+        self.lock = MagicMock()
+        self.lock.acquire = AsyncMock(return_value=True)
+        self.lock.release = AsyncMock()
+        self.redis.lock.return_value = self.lock
+        self.redis.register_script.return_value = AsyncMock(return_value=1)
+        patcher = patch("src.services.user_cache.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = CachedUser.from_user(
+            Users(id=1, email="a@example.com", username="a", roles=Role.user)
+        )
+        self.loads = 0
+
+    async def loader(self):
+        self.loads += 1
+        await asyncio.sleep(0.01)
+        return self.user
+
+    async def test_concurrent_misses_load_once(self):
+        cache = UserCache(LocalCache(10, 60), ttl=900, channel="invalidate")
+        users = await asyncio.gather(
+            *(cache.get_or_load("a@example.com", self.loader) for _ in range(20))
+        )
+        self.assertEqual(users, [self.user] * 20)
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(cache.as_dict()["loads"]["coalesced"], 19)
+        self.redis.lock.assert_not_called()
+
+    async def test_lock_holder_loads(self):
+        cache = UserCache(
+            LocalCache(10, 60), 900, "invalidate", lock_ttl=2, lock_wait=1
+        )
+        self.assertEqual(
+            await cache.get_or_load("a@example.com", self.loader), self.user
+        )
+        self.assertEqual(self.loads, 1)
+        self.lock.release.assert_awaited_once()
+
+    async def test_lock_taken_waits_for_other_worker(self):
+        cache = UserCache(
+            LocalCache(10, 60), 900, "invalidate", lock_ttl=2, lock_wait=1
+        )
+        self.lock.acquire.return_value = False
+        self.redis.get.side_effect = [None, None, dumps_user(self.user)]
+        self.assertEqual(
+            await cache.get_or_load("a@example.com", self.loader), self.user
+        )
+        self.assertEqual(self.loads, 0)
+        self.assertEqual(cache.as_dict()["loads"]["lock_wait_hits"], 1)
+
+    async def test_lock_wait_timeout_loads(self):
+        cache = UserCache(
+            LocalCache(10, 60), 900, "invalidate", lock_ttl=2, lock_wait=0
+        )
+        self.lock.acquire.return_value = False
+        self.assertEqual(
+            await cache.get_or_load("a@example.com", self.loader), self.user
+        )
+        self.assertEqual(self.loads, 1)
+        self.lock.release.assert_not_called()
+
+
+class TestUserCacheEarlyRefresh(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cache = UserCache(LocalCache(10, 0), 900, "invalidate", beta=1.0)
+        self.redis = MagicMock()
+        self.pipe = MagicMock()
+        self.pipe.execute = AsyncMock()
+        self.redis.pipeline.return_value.__aenter__.return_value = self.pipe
+        self.redis.evalsha = AsyncMock(return_value=1)
+        patcher = patch("src.services.user_cache.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = CachedUser.from_user(
+            Users(id=1, email="a@example.com", username="a", roles=Role.user)
+        )
+        self.loader = AsyncMock(return_value=self.user)
+        self.refresh = AsyncMock(return_value=self.user)
+
+    def cached(self, expires_in):
+        payload = dumps_user(self.user, time.time() + expires_in, 0.05)
+        self.redis.get = AsyncMock(return_value=payload)
+
+    def test_refresh_due_near_expiry(self):
+        now = time.time()
+        self.assertTrue(self.cache.refresh_due(now, 0.05))
+        due = sum(self.cache.refresh_due(now + 3600, 0.05) for _ in range(1000))
+        self.assertEqual(due, 0)
+        cache = UserCache(LocalCache(10, 0), 900, "invalidate", beta=0)
+        self.assertFalse(cache.refresh_due(now, 0.05))
+
+    async def test_fresh_entry_is_not_refreshed(self):
+        self.cached(3600)
+        user = await self.cache.get_or_load("a@example.com", self.loader, self.refresh)
+        self.assertEqual(user, self.user)
+        await asyncio.sleep(0)
+        self.refresh.assert_not_called()
+        self.assertEqual(self.cache.as_dict()["loads"]["early_refreshes"], 0)
+
+    async def test_entry_near_expiry_refreshed_in_background(self):
+        self.cached(0)
+        user = await self.cache.get_or_load("a@example.com", self.loader, self.refresh)
+        self.assertEqual(user, self.user)
+        self.refresh.assert_not_awaited()
+        await asyncio.gather(*self.cache._refreshes.values())
+        self.refresh.assert_awaited_once()
+        self.loader.assert_not_called()
+        self.redis.evalsha.assert_awaited_once()
+        self.assertEqual(self.cache.as_dict()["loads"]["early_refreshes"], 1)
+
+    async def test_concurrent_reads_refresh_once(self):
+        self.cached(0)
+        await asyncio.gather(
+            *(
+                self.cache.get_or_load("a@example.com", self.loader, self.refresh)
+                for _ in range(10)
+            )
+        )
+        await asyncio.gather(*self.cache._refreshes.values())
+        self.refresh.assert_awaited_once()
+
+    async def test_refresh_error_is_counted(self):
+        self.cached(0)
+        self.refresh.side_effect = RuntimeError("database is down")
+        with self.assertLogs("src.services.user_cache", "WARNING"):
+            await self.cache.get_or_load("a@example.com", self.loader, self.refresh)
+            await asyncio.gather(
+                *self.cache._refreshes.values(), return_exceptions=True
+            )
+            await asyncio.sleep(0)
+        self.assertEqual(self.cache.as_dict()["loads"]["refresh_errors"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()